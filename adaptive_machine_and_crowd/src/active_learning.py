@@ -1,6 +1,9 @@
 import numpy as np
 from modAL.models import ActiveLearner
-from sklearn.utils import shuffle
+
+from adaptive_machine_and_crowd.src.utils import ChoosePredicateMixin
+from adaptive_machine_and_crowd.src.training_buffer import TrainingBuffer
+from adaptive_machine_and_crowd.src.scoring import fused_scorer
 
 
 class ActiveLearner(ActiveLearner):
@@ -20,21 +23,64 @@ class Learner:
         self.clf = params['clf']
         self.sampling_strategy = params['sampling_strategy']
         self.screening_out_threshold = params.get('screening_out_threshold', 0.5)
-
-    def setup_active_learner(self, X_train_init, y_train_init, X_pool, y_pool):
-        # generate the pool
-        self.X_pool = X_pool
+        self.tuner = params.get('tuner', None)  # AlphaTuner, tunes regularization before fits (see tuning.py)
+
+    def setup_active_learner(self, X_train_init, y_train_init, X_features, pool_rows, y_pool):
+        '''
+        :param X_features: feature matrix shared by all learners, it is never copied
+        :param pool_rows: rows of X_features in the pool
+        '''
+        # the pool is kept as row indices, rows are gathered when the pool is scored or taught
+        self.X_features = X_features
+        self.pool_rows = pool_rows
         self.y_pool = y_pool
 
-        # initialize active learner
+        # initialize active learner, the initial fit is tuned like every refit
+        if self.tuner is not None:
+            self.tuner.before_fit(self.clf, X_train_init, y_train_init)
         self.learner = ActiveLearner(
             estimator=self.clf,
             X_training=X_train_init, y_training=y_train_init,
             query_strategy=self.sampling_strategy
         )
+        self.training = TrainingBuffer(X_train_init, y_train_init)
+
+    def teach(self, X, y, max_training_size=None):
+        '''
+        Shuffle the known data, then refit on it with the new batch appended
+        :param max_training_size: number of the latest labelled rows kept for fitting, all rows if None
+        '''
+        self.training.shuffle()
+        self.training.append(X, y)
+        if max_training_size is not None:
+            self.training.keep_last(max_training_size)
+        X_training, y_training = self.training.ordered()
+        if self.tuner is not None:
+            self.tuner.before_fit(self.learner.estimator, X_training, y_training)
+        self.learner.fit(X_training, y_training)
+
+    @property
+    def X_pool(self):
+        return self.X_features[self.pool_rows]
+
+    def pool_features(self, idx):
+        '''
+        :param idx: positions in the pool
+        '''
+        return self.X_features[self.pool_rows[idx]]
+
+
+# helpers mapped over the learners by the executor
+def _predict_proba_in(l, X):
+    return l.learner.predict_proba(X)[:, 1]
+
 
+def _setup_learner(l, X_train_init, y_train_init, X_features, pool_rows, y_pool):
+    l.setup_active_learner(X_train_init, y_train_init, X_features, pool_rows, y_pool)
+    return l
 
-class ScreeningActiveLearner:
+
+class ScreeningActiveLearner(ChoosePredicateMixin):
 
     def __init__(self, params):
         self.n_instances_query = params['n_instances_query']
@@ -44,6 +90,24 @@ class ScreeningActiveLearner:
         self.learners = params['learners']
         self.predicates = list(self.learners.keys())
         self.predicate_queue = list(range(len(self.predicates)))
+        # optional thread pool to score predicate learners the fused scorer does not cover concurrently
+        self.executor = params.get('executor', None)
+
+    def map_learners(self, func, *args, predicates=None):
+        '''
+        :param func: func(learner, *args)
+        :param predicates: subset of predicates, all by default
+        :return: dict predicate -> func result
+        '''
+        predicates = self.predicates if predicates is None else predicates
+        learners = [self.learners[pr] for pr in predicates]
+        if self.executor is None:
+            results = [func(l, *args) for l in learners]
+        else:
+            # threads see the same X object, no copies of the feature matrix are made
+            results = self.executor.map(func, learners, *[[arg] * len(learners) for arg in args])
+
+        return dict(zip(predicates, results))
 
     def select_predicate(self):
         pred_id = self.predicate_queue.pop(0)
@@ -51,33 +115,58 @@ class ScreeningActiveLearner:
 
         return self.predicates[pred_id]
 
-    def query(self, predicate):
+    def query(self, predicate, n_instances=None):
+        '''
+        :param n_instances: number of items to query, n_instances_query by default
+        '''
         l = self.learners[predicate]
         # all learners except the current one
         learners_ = {l_: self.learners[l_] for l_ in self.learners if l_ not in [predicate]}
-        if self.n_instances_query > len(l.y_pool):
+        n_instances = self.n_instances_query if n_instances is None else n_instances
+        if n_instances > len(l.y_pool):
             if len(l.y_pool) == 0:
                 return []
             n_instances = len(l.y_pool)
-        else:
-            n_instances = self.n_instances_query
-        query_idx, _ = l.learner.query(l.X_pool,
+        query_kwargs = {}
+        X_pool = l.X_pool  # gathered for the query only
+        if learners_ and l.learner.query_strategy.__name__ in ['mix_sampling', 'objective_aware_sampling']:
+            # score the pool with all other learners in one pass
+            query_kwargs['l_prob_in'] = np.prod(list(self.predict_proba_predicates(X_pool, list(learners_)).values()),
+                                                axis=0)
+        query_idx, _ = l.learner.query(X_pool,
                                        n_instances=n_instances,
-                                       learners_=learners_)
+                                       learners_=learners_,
+                                       **query_kwargs)
         return query_idx
 
     def teach(self, predicate, query_idx, y_crowdsourced):
         l = self.learners[predicate]
-        l.learner.X_training, l.learner.y_training = shuffle(l.learner.X_training, l.learner.y_training)
-        l.learner.teach(l.X_pool[query_idx], y_crowdsourced)
+        X_queried = l.pool_features(query_idx)
+        if getattr(self, 'prequential', None) is not None:
+            self.score_prequential(predicate, X_queried, y_crowdsourced)
+        l.teach(X_queried, y_crowdsourced)
+        self.remove_from_pool(predicate, query_idx)
+
+    def remove_from_pool(self, predicate, query_idx):
         # remove queried instance from pool
-        l.X_pool = np.delete(l.X_pool, query_idx, axis=0)
+        l = self.learners[predicate]
+        l.pool_rows = np.delete(l.pool_rows, query_idx)
         l.y_pool = np.delete(l.y_pool, query_idx)
 
+    def predict_proba_predicates(self, X, predicates=None):
+        '''
+        :return: dict predicate -> prob of predicate being IN for X
+        '''
+        # calibrated linear learners are scored together with one matrix multiply per chunk
+        scorer = fused_scorer(self.learners, predicates)
+        if scorer is not None:
+            return scorer.predict_proba_predicates(X)
+        return self.map_learners(_predict_proba_in, X, predicates=predicates)
+
     def predict_proba(self, X):
         proba_in = np.ones(X.shape[0])
-        for l in self.learners.values():
-            proba_in *= l.learner.predict_proba(X)[:, 1]
+        for proba_predicate_in in self.predict_proba_predicates(X).values():
+            proba_in *= proba_predicate_in
         proba = np.stack((1-proba_in, proba_in), axis=1)
 
         return np.array(proba)
@@ -0,0 +1,149 @@
+import os
+import json
+import shutil
+import random
+import hashlib
+import numpy as np
+
+from adaptive_machine_and_crowd.src.utils import get_data_path
+from adaptive_machine_and_crowd.src.snapshot import save_snapshot
+
+'''
+    Content-addressed on-disk cache of AL-Box outcomes, used by run_forked_trials if params['al_cache_path']
+    and params['seed'] are set. Crowd-Box only parameters (stop_score, screening_out_threshold, base round)
+    can then be tuned without re-running active learning.
+    An entry is a directory named by the sha256 of its key:
+        key.json       the key, for inspection
+        outcome.npz    priors, vote counts, real votes drawn, labels and spend of the AL-Box, labels of the pool
+                       of every predicate
+        learners/      snapshot of the learners at the AL stop point (see snapshot.py)
+    The key holds the dataset file hash, AL parameters, sampling strategy, crowd backend and its repetition,
+    the seed of the trial and the AL budget of the entry: batches are sized by the schedule only and a policy
+    ends with a final batch of its own, so the trajectory does not depend on the other policies of the run.
+'''
+
+AL_CACHE_FORMAT_VERSION = 3
+AL_KEY_PARAMS = ['dataset_file_name', 'predicates', 'crowd_acc', 'crowd_votes_per_item_al', 'size_init_train_data',
+                 'n_instances_query', 'batch_schedule', 'al_staleness', 'alpha_grid', 'tune_every',
+                 'dedup_threshold']
+_file_hashes = {}
+
+
+def trial_seed(params, experiment_id):
+    '''
+    :return: seed of the repetition, None if params['seed'] is not set
+    '''
+    return None if params.get('seed') is None else params['seed'] + experiment_id
+
+
+def seed_trial(seed, stage):
+    # separate streams for the AL-Box and the Crowd-Box, so the Crowd-Box draws the same numbers on cache hits
+    random.seed('{}-{}'.format(seed, stage))
+    np.random.seed(int(hashlib.sha256('{}-{}'.format(seed, stage).encode()).hexdigest()[:8], 16))
+
+
+def learner_seed(seed, predicate):
+    # random_state of the learner of a predicate, its fits draw the same numbers whatever thread runs them
+    if seed is None:
+        return None
+    return int(hashlib.sha256('{}-learner-{}'.format(seed, predicate).encode()).hexdigest()[:8], 16)
+
+
+def dataset_hash(params):
+    path = get_data_path(params['dataset_file_name'], params['path_to_project']) + params['dataset_file_name']
+    stat = os.stat(path)
+    if (path, stat.st_size, stat.st_mtime) not in _file_hashes:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+        _file_hashes[(path, stat.st_size, stat.st_mtime)] = sha.hexdigest()
+
+    return _file_hashes[(path, stat.st_size, stat.st_mtime)]
+
+
+class ALBoxCache:
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, params, B_al, seed):
+        '''
+        :param B_al: AL budget of the policy
+        :return: (hex digest, key dict)
+        '''
+        crowd = params.get('crowd')
+        key = {param: params.get(param) for param in AL_KEY_PARAMS}
+        key.update({
+            'format_version': AL_CACHE_FORMAT_VERSION,
+            'dataset_hash': dataset_hash(params),
+            'sampling_strategy': params['sampling_strategy'].__name__,
+            'crowd': 'simulator' if crowd is None else getattr(crowd, 'cache_key',
+                                                                getattr(crowd, '__name__', type(crowd).__name__)),
+            'B_al': float(B_al),
+            'seed': seed,
+            # crowds drawing per repetition (VoteTape) give other votes to the same seed in another repetition
+            'crowd_repetition': getattr(crowd, 'repetition', None)
+        })
+        digest = hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
+
+        return digest, key
+
+    def load(self, digest, predicates):
+        '''
+        :return: (ALBoxOutcome kwargs, dict predicate -> pool labels), None if the entry is missing
+        '''
+        file_name = os.path.join(self.path, digest, 'outcome.npz')
+        if not os.path.isfile(file_name):
+            self.misses += 1
+            return None
+        with np.load(file_name) as data:
+            prior_in, votes, drawn = data['prior_in'], data['votes'], data['drawn']
+            outcome = {
+                'prior_prob': {item_id: {pr: {'in': prior_in[item_id, j], 'out': 1 - prior_in[item_id, j]}
+                                         for j, pr in enumerate(predicates)} for item_id in range(prior_in.shape[0])},
+                'crowd_votes_counts': {item_id: {pr: {'in': int(votes[item_id, j, 0]), 'out': int(votes[item_id, j, 1]),
+                                                      'drawn': int(drawn[item_id, j])}
+                                                 for j, pr in enumerate(predicates)} for item_id in range(votes.shape[0])},
+                'item_labels': dict(enumerate(data['item_labels'].tolist())),
+                'B_al_spent': data['B_al_spent'].item(),
+                'machine_proba_in': data['machine_proba_in']
+            }
+            y_predicate = {pr: data['y_predicate{}'.format(j)] for j, pr in enumerate(predicates)}
+        self.hits += 1
+
+        return outcome, y_predicate
+
+    def save(self, digest, key, outcome, predicates, y_predicate, vectorizer=None, SAL=None):
+        '''
+        Write the entry to a temporary directory and rename it, concurrent writers of one key keep the first entry
+        '''
+        entry = os.path.join(self.path, digest)
+        if os.path.isdir(entry):
+            return
+        tmp = '{}.tmp{}'.format(entry, os.getpid())
+        os.makedirs(tmp, exist_ok=True)
+        items_num = len(outcome.item_labels)
+        np.savez_compressed(
+            os.path.join(tmp, 'outcome.npz'),
+            prior_in=np.array([[outcome.prior_prob[item_id][pr]['in'] for pr in predicates] for item_id in range(items_num)]),
+            votes=np.array([[[outcome.crowd_votes_counts[item_id][pr]['in'], outcome.crowd_votes_counts[item_id][pr]['out']]
+                             for pr in predicates] for item_id in range(items_num)], dtype=np.int32),
+            # real votes drawn by RealVotesCrowd, 0 for simulated crowds
+            drawn=np.array([[outcome.crowd_votes_counts[item_id][pr].get('drawn', 0) for pr in predicates]
+                            for item_id in range(items_num)], dtype=np.int32),
+            item_labels=np.array([outcome.item_labels[item_id] for item_id in range(items_num)], dtype=np.int8),
+            B_al_spent=np.asarray(outcome.B_al_spent),
+            machine_proba_in=outcome.machine_proba_in,
+            **{'y_predicate{}'.format(j): y_predicate[pr] for j, pr in enumerate(predicates)}
+        )
+        if SAL is not None:
+            save_snapshot(os.path.join(tmp, 'learners'), vectorizer, SAL, meta=key)
+        with open(os.path.join(tmp, 'key.json'), 'w') as f:
+            json.dump(key, f, indent=2, default=str)
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)  # written by another worker meanwhile
@@ -0,0 +1,99 @@
+import numpy as np
+
+'''
+    Schedules of the number of items queried per AL iteration.
+    A schedule is built per AL-Box run from params['batch_schedule'], a dict with 'name' and schedule parameters:
+        None or {'name': 'fixed'}: n_instances_query items per iteration (the default)
+        {'name': 'geometric', 'initial': 10, 'growth': 1.5, 'max_size': None}: the batch grows by 'growth'
+            after every iteration
+        {'name': 'budget_fraction', 'fraction': 0.1, 'min_size': 10}: 'fraction' of the items the AL budget
+            left can pay for
+        {'name': 'model_change', 'initial': 10, 'growth': 2., 'threshold': 0.5, 'probe_size': 500}: the batch
+            grows while the mean change of the predicted probabilities on a probe sample after teaching is
+            below 'threshold' times the largest change observed for the predicate (refits of calibrated SGD
+            change the probabilities by a few percent even without new data, so the change is relative)
+    Batch sizes depend on the schedule only, a policy whose AL budget left cannot pay for the next batch ends
+    with a final batch of its own. min_size is the smallest batch the schedule asks for, AL stops once the
+    budget left is at most its cost. budget_fraction sizes batches by the AL budget left of the policy, every
+    policy then runs the AL-Box on its own.
+'''
+
+BUDGET_DEPENDENT_SCHEDULES = ['budget_fraction']
+
+
+class FixedBatchSize:
+
+    def __init__(self, size):
+        self.size = size
+        self.min_size = size
+
+    def next_size(self, B_al_left, votes_per_item):
+        return self.size
+
+    def update(self, SAL, predicate):
+        pass
+
+
+class GeometricBatchSize(FixedBatchSize):
+
+    def __init__(self, initial=10, growth=1.5, max_size=None):
+        FixedBatchSize.__init__(self, initial)
+        self.current = float(initial)
+        self.growth = growth
+        self.max_size = max_size
+
+    def next_size(self, B_al_left, votes_per_item):
+        size = int(round(self.current))
+        return min(size, self.max_size) if self.max_size else size
+
+    def update(self, SAL, predicate):
+        self.current *= self.growth
+
+
+class BudgetFractionBatchSize(FixedBatchSize):
+
+    def __init__(self, fraction=0.1, min_size=10):
+        FixedBatchSize.__init__(self, min_size)
+        self.fraction = fraction
+
+    def next_size(self, B_al_left, votes_per_item):
+        return max(self.min_size, int(self.fraction * B_al_left / votes_per_item))
+
+
+class ModelChangeBatchSize(GeometricBatchSize):
+
+    def __init__(self, X_probe, initial=10, growth=2., threshold=0.5, max_size=None):
+        GeometricBatchSize.__init__(self, initial, growth, max_size)
+        self.X_probe = X_probe
+        self.threshold = threshold
+        self.proba_prev = {}
+        self.change_max = {}
+
+    def update(self, SAL, predicate):
+        proba = SAL.predict_proba_predicates(self.X_probe, [predicate])[predicate]
+        if predicate in self.proba_prev:
+            change = np.abs(proba - self.proba_prev[predicate]).mean()
+            self.change_max[predicate] = max(change, self.change_max.get(predicate, 0.))
+            if change < self.threshold * self.change_max[predicate]:
+                self.current *= self.growth
+        self.proba_prev[predicate] = proba
+
+
+def make_batch_schedule(params):
+    config = dict(params.get('batch_schedule') or {'name': 'fixed'})
+    name = config.pop('name')
+    if name == 'fixed':
+        return FixedBatchSize(config.get('size', params['n_instances_query']))
+    if name == 'geometric':
+        return GeometricBatchSize(**config)
+    if name == 'budget_fraction':
+        return BudgetFractionBatchSize(**config)
+    if name == 'model_change':
+        X = params['X_features']
+        probe_idx = np.random.choice(X.shape[0], min(config.pop('probe_size', 500), X.shape[0]), replace=False)
+        return ModelChangeBatchSize(X[probe_idx], **config)
+    raise ValueError('Unknown batch schedule: {}'.format(name))
+
+
+def is_budget_dependent(params):
+    return (params.get('batch_schedule') or {}).get('name') in BUDGET_DEPENDENT_SCHEDULES
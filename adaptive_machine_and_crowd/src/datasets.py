@@ -0,0 +1,105 @@
+import copy
+
+# dataset configurations used in experiments: file name, predicates, size and crowd accuracy range per predicate
+DATASETS = {
+    # AMAZON DATASET
+    'amazon': {
+        'dataset_file_name': '5000_reviews_lemmatized.csv',
+        'predicates': ['is_negative', 'is_book'],
+        'dataset_size': 5000,
+        'crowd_acc': {'is_negative': [0.94, 0.94], 'is_book': [0.94, 0.94]}
+    },
+    # OHUSMED DATASET
+    'ohusmed': {
+        'dataset_file_name': 'ohsumed_C14_C23_1grams.csv',
+        'predicates': ['C14', 'C23'],
+        'dataset_size': 34387,
+        'crowd_acc': {'C14': [0.6, 1.], 'C23': [0.6, 1.]}
+    },
+    # LONELINESS SLR DATASET
+    'slr': {
+        'dataset_file_name': 'loneliness-dataset-2018.csv',
+        'predicates': ['oa_predicate', 'study_predicate'],
+        'dataset_size': 825,
+        'crowd_acc': {'oa_predicate': [0.8, 0.8], 'study_predicate': [0.6, 0.6]}
+    },
+    # AMAZON BINARY DATASET
+    'amazon_binary': {
+        'dataset_file_name': '5000_reviews_lemmatized.csv',
+        'predicates': ['Y'],
+        'dataset_size': 5000,
+        'crowd_acc': {'Y': [0.94, 0.94]}
+    },
+    # LONELINESS BINARY SLR DATASET
+    'slr_binary': {
+        'dataset_file_name': 'loneliness-dataset-2018.csv',
+        'predicates': ['Y'],
+        'dataset_size': 825,
+        'crowd_acc': {'Y': [0.75, 0.75]}
+    },
+    # OHUSMED BINARY DATASET
+    'ohusmed_binary': {
+        'dataset_file_name': 'ohsumed_C14_C23_1grams.csv',
+        'predicates': ['Y'],
+        'dataset_size': 34387,
+        'crowd_acc': {'Y': [0.6, 1.]}
+    },
+    # CRISIS DATASET
+    'crisis': {
+        'dataset_file_name': 'crisis-lemmatized_witness_inf.csv',
+        'predicates': ['eye_witness', 'informative'],
+        'dataset_size': 1943,
+        'crowd_acc': {'eye_witness': [0.87, 0.87], 'informative': [0.85, 0.85]}
+    },
+    # CRISIS BINARY DATASET
+    'crisis_binary': {
+        'dataset_file_name': 'crisis-lemmatized_witness_inf.csv',
+        'predicates': ['Y'],
+        'dataset_size': 1943,
+        'crowd_acc': {'Y': [0.927, 0.927]}
+    },
+    # AMAZON CROWDSOURCED DATASETS, real votes are replayed, crowd accuracy is the observed agreement with gt
+    'amazon_crowdsourced_min3votes': {
+        'dataset_file_name': '1k_amazon_reviews_crowdsourced_lemmatized_min3votes.csv',
+        'predicates': ['is_negative', 'is_book'],
+        'dataset_size': 989,
+        'crowd_acc': {'is_negative': [0.944, 0.944], 'is_book': [0.947, 0.947]},
+        'real_votes': True
+    },
+    'amazon_crowdsourced_min5votes': {
+        'dataset_file_name': '1k_amazon_reviews_crowdsourced_lemmatized_min5votes.csv',
+        'predicates': ['is_negative', 'is_book'],
+        'dataset_size': 863,
+        'crowd_acc': {'is_negative': [0.957, 0.957], 'is_book': [0.959, 0.959]},
+        'real_votes': True
+    }
+}
+
+
+def get_dataset_config(dataset):
+    '''
+    :param dataset: name of the dataset configuration, key of DATASETS
+    :return: copy of the configuration, safe to modify
+    '''
+    if dataset not in DATASETS:
+        raise ValueError('Unknown dataset: {}'.format(dataset))
+    return copy.deepcopy(DATASETS[dataset])
+
+
+def get_crowd(dataset_config, path_to_project):
+    '''
+    :return: RealVotesCrowd replaying the dataset votes if dataset_config['real_votes'], otherwise CrowdSimulator
+    '''
+    from adaptive_machine_and_crowd.src.utils import CrowdSimulator, RealVotesCrowd
+    if dataset_config.get('real_votes', False):
+        return RealVotesCrowd.load(dataset_config['dataset_file_name'], dataset_config['predicates'], path_to_project)
+    return CrowdSimulator
+
+
+def get_sampling_strategy(name):
+    from modAL.uncertainty import uncertainty_sampling
+    from adaptive_machine_and_crowd.src.utils import random_sampling, objective_aware_sampling, mix_sampling
+    strategies = {s.__name__: s for s in [random_sampling, uncertainty_sampling, objective_aware_sampling, mix_sampling]}
+    if name not in strategies:
+        raise ValueError('Unknown sampling strategy: {}'.format(name))
+    return strategies[name]
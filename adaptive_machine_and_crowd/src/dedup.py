@@ -0,0 +1,156 @@
+import zlib
+import numpy as np
+
+from adaptive_machine_and_crowd.src.al_cache import dataset_hash
+
+'''
+    Near-duplicate collapsing before screening, enabled by params['dedup_threshold'].
+    Documents are MinHash signed over word shingles of their tokens (crc32 hashes of shingles, num_perm universal
+    hash permutations). LSH buckets signatures by bands of rows, documents sharing a bucket with a band are
+    candidates, and candidates whose signatures agree on at least `threshold` of the hashes (estimated Jaccard
+    similarity) are merged with union-find. A bucket is compared pair by pair up to max_bucket_size members, in larger
+    buckets every member is compared with the next max_bucket_size members in id order.
+    Each cluster is screened through its representative only, the item with the smallest id: AL-Box, priors and
+    SM-Run see the representatives, and the budget is the budget per item times the number of representatives.
+    Members get the final label of their representative, metrics are computed over all items.
+    Clusters are computed once per dataset file hash and threshold in a process and reused by its trials.
+'''
+
+MERSENNE_PRIME = (1 << 31) - 1
+_clusters_cache = {}  # (dataset hash, dedup_threshold) -> DuplicateClusters
+
+
+def _shingles(doc, shingle_size):
+    tokens = str(doc).split()
+    if len(tokens) <= shingle_size:
+        return {' '.join(tokens)}
+    return {' '.join(tokens[i:i + shingle_size]) for i in range(len(tokens) - shingle_size + 1)}
+
+
+def minhash_signatures(docs, num_perm=64, shingle_size=2, seed=0):
+    '''
+    :param docs: documents as strings of space separated tokens
+    :return: int64 array [docs, num_perm]
+    '''
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, MERSENNE_PRIME, num_perm).astype(np.int64)
+    b = rng.randint(0, MERSENNE_PRIME, num_perm).astype(np.int64)
+    signatures = np.empty((len(docs), num_perm), dtype=np.int64)
+    for i, doc in enumerate(docs):
+        hashes = np.array([zlib.crc32(s.encode('utf-8')) for s in _shingles(doc, shingle_size)],
+                          dtype=np.int64) % MERSENNE_PRIME
+        # a, hashes < 2^31, products fit in int64
+        signatures[i] = ((np.outer(hashes, a) + b) % MERSENNE_PRIME).min(axis=0)
+
+    return signatures
+
+
+class UnionFind:
+
+    def __init__(self, size):
+        self.parent = np.arange(size)
+
+    def find(self, i):
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]  # path halving
+            i = parent[i]
+        return i
+
+    def union(self, i, j):
+        # the smaller id becomes the root, so roots are the smallest item of a cluster
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i != root_j:
+            self.parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    def roots(self):
+        return np.array([self.find(i) for i in range(len(self.parent))])
+
+
+class DuplicateClusters:
+
+    def __init__(self, roots):
+        '''
+        :param roots: representative (smallest item id of the cluster) per item
+        '''
+        self.roots = np.asarray(roots)
+        self.items_num = len(roots)
+        self.representatives = np.unique(roots)
+        # position of the representative of every item among the representatives
+        self.member_of = np.searchsorted(self.representatives, roots)
+        self.collapsed_num = self.items_num - len(self.representatives)
+        self.y_screening = None  # ground truth of all items, set by collapse_data
+
+    def expand(self, values):
+        '''
+        :param values: array per representative
+        :return: array per item
+        '''
+        return np.asarray(values)[self.member_of]
+
+    def expand_labels(self, item_labels):
+        '''
+        :param item_labels: dict representative position -> label
+        :return: dict item_id -> label of its representative
+        '''
+        return {item_id: item_labels[rep] for item_id, rep in enumerate(self.member_of)}
+
+
+def find_duplicates(docs, threshold=0.8, num_perm=64, bands=16, shingle_size=2, seed=0, max_bucket_size=100):
+    '''
+    :param threshold: min estimated Jaccard similarity of shingles of near-duplicates
+    :param bands: LSH bands of num_perm // bands rows, more bands find more candidates of lower similarity
+    :param max_bucket_size: number of following members of its bucket a member is compared with
+    :return: DuplicateClusters
+    '''
+    signatures = minhash_signatures(docs, num_perm, shingle_size, seed)
+    clusters = UnionFind(len(docs))
+    # documents with equal signatures are merged first, candidates are compared among distinct signatures
+    signatures, first, distinct_of = np.unique(signatures, axis=0, return_index=True, return_inverse=True)
+    for i, j in enumerate(distinct_of.ravel()):
+        clusters.union(i, first[j])
+    rows = num_perm // bands
+    for band in range(bands):
+        _, bucket = np.unique(signatures[:, band * rows:(band + 1) * rows], axis=0, return_inverse=True)
+        bucket = bucket.ravel()
+        order = np.argsort(bucket, kind='stable')
+        starts = np.flatnonzero(np.diff(bucket[order], prepend=-1))
+        for members in np.split(order, starts[1:]):
+            members = members[np.argsort(first[members])]  # id order
+            # pairs (i, i + offset) of the bucket, all pairs if the bucket has up to max_bucket_size members
+            for offset in range(1, min(len(members), max_bucket_size + 1)):
+                similarity = (signatures[members[:-offset]] == signatures[members[offset:]]).mean(axis=1)
+                for a in np.flatnonzero(similarity >= threshold):
+                    clusters.union(first[members[a]], first[members[a + offset]])
+
+    return DuplicateClusters(clusters.roots())
+
+
+def collapse_data(data, params, roots=None):
+    '''
+    :param data: (X, y_screening, y_predicate, vectorizer, X_features) as returned by prepare_data
+    :param roots: representative per item computed beforehand, e.g. published with shared data
+    :return: (data of the representatives as prepare_data, DuplicateClusters), clusters are cached per dataset
+             file hash and threshold
+    '''
+    X, y_screening, y_predicate, vectorizer, X_features = data
+    key = (dataset_hash(params), params['dedup_threshold'])
+    clusters = _clusters_cache.get(key)
+    if clusters is None:
+        if roots is not None:
+            clusters = DuplicateClusters(roots)
+        elif X is None:
+            raise ValueError('Collapsing near-duplicates needs the tokens of the documents, X is not loaded: '
+                             'publish shared data with the dedup_threshold of the run')
+        else:
+            clusters = find_duplicates(X, params['dedup_threshold'])
+        clusters.y_screening = np.asarray(y_screening)
+        print('near-duplicates: {} of {} items collapsed into {} representatives'
+              .format(clusters.collapsed_num, clusters.items_num, len(clusters.representatives)))
+        _clusters_cache[key] = clusters
+    reps = clusters.representatives
+    X_reps = X[reps] if X is not None else None
+    collapsed = (X_reps, y_screening[reps], {pr: y_predicate[pr][reps] for pr in y_predicate}, vectorizer,
+                 X_features[reps])
+
+    return collapsed, clusters
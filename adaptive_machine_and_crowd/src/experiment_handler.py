@@ -1,153 +1,544 @@
 import os
+import copy
+import random
 import pandas as pd
 import numpy as np
 from sklearn.linear_model import SGDClassifier  # linear svm by default
 from sklearn.calibration import CalibratedClassifierCV
+from sklearn.model_selection import StratifiedKFold
 
 from adaptive_machine_and_crowd.src.utils import get_init_training_data_idx, \
-    load_data, Vectorizer, CrowdSimulator, MetricsMixin
-from adaptive_machine_and_crowd.src.active_learning import Learner, ScreeningActiveLearner
+    load_data, Vectorizer, CrowdSimulator, MetricsMixin, make_executor, votes_cast
+from adaptive_machine_and_crowd.src.active_learning import Learner, ScreeningActiveLearner, _setup_learner
 from adaptive_machine_and_crowd.src.sm_run.shortest_multi_run import ShortestMultiRun
+from adaptive_machine_and_crowd.src.sm_run.sharded import ShardedShortestMultiRun
 from adaptive_machine_and_crowd.src.policy import PointSwitchPolicy
+from adaptive_machine_and_crowd.src.batch_schedules import make_batch_schedule, is_budget_dependent
+from adaptive_machine_and_crowd.src.repetitions import RepetitionController
+from adaptive_machine_and_crowd.src.snapshot import save_snapshot
+from adaptive_machine_and_crowd.src.pipelined_al import BackgroundTrainer
+from adaptive_machine_and_crowd.src.posteriors import crowd_posterior_in, save_posteriors
+from adaptive_machine_and_crowd.src.al_cache import ALBoxCache, trial_seed, seed_trial, learner_seed
+from adaptive_machine_and_crowd.src.shared_data import attach_data, attach_duplicate_roots
+from adaptive_machine_and_crowd.src.tuning import AlphaTuner
+from adaptive_machine_and_crowd.src.memory import MemoryTracker, mark_phase, watch
+from adaptive_machine_and_crowd.src.dedup import collapse_data
 
 
 def run_experiment(params):
-    # parameters for crowd simulation
+    # fit and score predicate learners concurrently if n_jobs > 1
+    executor = make_executor(params.get('n_jobs'))
+    params['executor'] = executor
+    # one pool and shared memory for the sharded SM-Run of every Crowd-Box run if crowd_box_workers > 1
+    params['crowd_box_executor'] = make_crowd_box_executor(params)
+    # memory records per phase and per repetition if params['memory_report_path'] is set (see memory.py)
+    tracker = MemoryTracker() if params.get('memory_report_path') else None
+    params['memory_tracker'] = tracker
+
+    cells = [(budget_per_item, switch_point) for budget_per_item in params['budget_per_item']
+             for switch_point in params['policy_switch_point']]
+    # repetitions per cell: experiment_nums, or sequential stopping by confidence interval width if ci_width is set
+    controllers = {cell: make_repetition_controller(params) for cell in cells}
+    results = {cell: [] for cell in cells}
+    if params.get('fork_al', False):
+        # run the AL-Box once per repetition and fork the Crowd-Box for every grid cell still repeated
+        data = prepare_data(params)
+        experiment_id = 0
+        while any(controllers[cell].is_continue for cell in cells):
+            active_cells = [cell for cell in cells if controllers[cell].is_continue]
+            for cell, row in zip(active_cells, run_forked_trials(params, active_cells, experiment_id, data)):
+                results[cell].append(row)
+                controllers[cell].add(row)
+            if tracker is not None:
+                tracker.end_repetition(experiment_id)
+            experiment_id += 1
+
+    df_to_print = pd.DataFrame()
+    for budget_per_item, switch_point in cells:
+        print('Policy switch point: {}'.format(switch_point))
+        print('Budget per item: {}'.format(budget_per_item))
+        print('************************************')
+        cell = (budget_per_item, switch_point)
+        experiment_id = 0
+        while controllers[cell].is_continue:
+            row = run_trial(params, budget_per_item, switch_point, experiment_id)
+            results[cell].append(row)
+            controllers[cell].add(row)
+            if tracker is not None:
+                tracker.end_repetition(experiment_id)
+            experiment_id += 1
+
+        df_to_print = df_to_print.append(summarize_results(results[cell], params, switch_point), ignore_index=True)
+
+    save_results(df_to_print, params)
+
+    if executor is not None:
+        executor.shutdown()
+    params['executor'] = None
+    close_crowd_box_executor(params)
+    if tracker is not None:
+        tracker.save(os.path.join(params['memory_report_path'], '{}_{}_memory'.format(
+            params['dataset_file_name'][:-4], params['sampling_strategy'].__name__)))
+        tracker.stop()
+    params['memory_tracker'] = None
+
+
+def make_crowd_box_executor(params):
+    '''
+    :return: ShardedShortestMultiRun reused by the Crowd-Box runs, None if SM-Run runs in-process
+    '''
+    crowd_box_workers = params.get('crowd_box_workers', 1)
+    if crowd_box_workers > 1 and params.get('crowd', CrowdSimulator) is CrowdSimulator:
+        return ShardedShortestMultiRun(crowd_box_workers)
+    return None
+
+
+def close_crowd_box_executor(params):
+    if params.get('crowd_box_executor') is not None:
+        params['crowd_box_executor'].close()
+    params['crowd_box_executor'] = None
+
+
+def make_repetition_controller(params):
+    '''
+    :return: RepetitionController for a grid cell, sequential stopping if params['ci_width'] is set,
+             otherwise exactly params['experiment_nums'] repetitions
+    '''
+    if params.get('ci_width'):
+        return RepetitionController(params['ci_width'], min_reps=params.get('min_experiment_nums', 3),
+                                    max_reps=params['experiment_nums'])
+    return RepetitionController(0., min_reps=params['experiment_nums'], max_reps=params['experiment_nums'])
+
+
+def prepare_data(params):
+    if params.get('shared_data') is not None:
+        # features published by another process (see shared_data.py)
+        return attach_data(params['shared_data'])
+    X, y_screening, y_predicate = load_data(params['dataset_file_name'], params['predicates'], params['path_to_project'])
+    mark_phase(params, 'load')
+    vectorizer = Vectorizer()
+    X_features = vectorizer.fit_transform(X)
+    mark_phase(params, 'featurize')
+
+    return X, y_screening, y_predicate, vectorizer, X_features
+
+
+class ALBoxOutcome:
+    '''
+    State the Crowd-Box starts from: machine priors, crowd votes and labels collected by the AL-Box,
+    budget spent on AL and machine probabilities to classify the items left after the Crowd-Box
+    '''
+
+    def __init__(self, prior_prob, crowd_votes_counts, item_labels, B_al_spent, machine_proba_in=None):
+        self.prior_prob = prior_prob
+        self.crowd_votes_counts = crowd_votes_counts
+        self.item_labels = item_labels
+        self.B_al_spent = B_al_spent
+        self.machine_proba_in = machine_proba_in
+
+
+# run one repetition of the experiment for a given budget per item and policy switch point
+def run_trial(params, budget_per_item, switch_point, experiment_id=0, data=None):
+    '''
+    :param data: (X, y_screening, y_predicate, vectorizer, X_features) as returned by prepare_data, loaded if None
+    :return: results row [budget_per_item, budget_spent_per_item, precision, recall, f_beta, loss,
+             fn_count, fp_count, AL_switch_point]
+    '''
+    return run_forked_trials(params, [(budget_per_item, switch_point)], experiment_id, data)[0]
+
+
+# run one repetition for several (budget_per_item, switch_point) cells sharing a single AL-Box trajectory
+def run_forked_trials(params, cells, experiment_id=0, data=None):
+    '''
+    The AL-Box runs once up to the largest B_al of the cells, its state is snapshot
+    when the policy of a cell stops AL, and the Crowd-Box of the cell is forked from that snapshot.
+    :return: list of results rows, one per cell
+    '''
+    data = data if data is not None else prepare_data(params)
+    clusters, dataset_size, crowd = None, params['dataset_size'], params.get('crowd', CrowdSimulator)
+    if params.get('dedup_threshold') is not None:
+        # screen one representative per cluster of near-duplicates (see dedup.py)
+        roots = attach_duplicate_roots(params['shared_data'], params['dedup_threshold']) \
+            if params.get('shared_data') is not None else None
+        data, clusters = collapse_data(data, params, roots)
+        dataset_size -= clusters.collapsed_num
+        if hasattr(crowd, 'subset'):
+            crowd = crowd.subset(clusters.representatives)  # real votes of the representatives
+    X, y_screening, y_predicate, vectorizer, X_features = data
+    y_predicate = dict(y_predicate)  # configure_al_box replaces the label arrays of the pool
+    # per trial copy, so that data and learners are not kept by the caller's params
+    params = dict(params, X=X, y_screening=y_screening, y_predicate=y_predicate, vectorizer=vectorizer,
+                  X_features=X_features, experiment_id=experiment_id, duplicate_clusters=clusters, crowd=crowd)
+
+    policies = [PointSwitchPolicy(dataset_size * budget_per_item, switch_point)
+                for budget_per_item, switch_point in cells]
+    items_num = y_screening.shape[0]
+    item_predicate_gt = {}
+    for pr in params['predicates']:
+        item_predicate_gt[pr] = {item_id: gt_val for item_id, gt_val in zip(list(range(items_num)), y_predicate[pr])}
+
+    seed = trial_seed(params, experiment_id)
+    if seed is not None:
+        seed_trial(seed, 'al')
+    if hasattr(crowd, 'start_repetition'):
+        crowd.start_repetition(experiment_id)  # vote tape shared by all configurations of the repetition
+    elif hasattr(crowd, 'shuffle'):
+        crowd.shuffle()  # new order of replayed real votes per repetition
+    y_predicate_all = dict(y_predicate)  # before the AL-Box removes initial training items
+    al_policies = [policy for policy, (_, switch_point) in zip(policies, cells) if switch_point != 0]
+    if al_policies:
+        # policies share one AL-Box run unless batch sizes depend on the AL budget of the policy
+        runs = [[policy] for policy in al_policies] if is_budget_dependent(params) else [al_policies]
+        random_state = random.getstate(), np.random.get_state()
+        outcomes = []
+        for run_policies in runs:
+            random.setstate(random_state[0])
+            np.random.set_state(random_state[1])
+            params['y_predicate'] = dict(y_predicate_all)
+            if params.get('al_cache_path') and seed is not None:
+                outcomes += run_al_box_cached(params, run_policies, seed)
+            else:
+                outcomes += run_al_box(params, run_policies)
+        print('experiment_id {}'.format(experiment_id), end=', ')
+    if seed is not None:
+        seed_trial(seed, 'crowd')
+    crowd_only_outcome = ALBoxOutcome(prior_prob={}, item_labels={item_id: 1 for item_id in range(items_num)},
+                                      crowd_votes_counts={item_id: {pr: {'in': 0, 'out': 0} for pr in params['predicates']}
+                                                          for item_id in range(items_num)},
+                                      B_al_spent=0)
+
+    rows = []
+    for policy, (budget_per_item, switch_point) in zip(policies, cells):
+        if switch_point != 0:
+            outcome, y_predicate_selectivity = outcomes[al_policies.index(policy)], params['y_predicate']
+        else:
+            outcome, y_predicate_selectivity = crowd_only_outcome, y_predicate_all
+        policy.B_al_spent = outcome.B_al_spent
+        rows.append(run_crowd_box(params, policy, outcome, item_predicate_gt, y_predicate_selectivity,
+                                  budget_per_item, switch_point))
+
+    return rows
+
+
+def run_al_box_cached(params, policies, seed):
+    '''
+    AL-Box outcomes from the cache in params['al_cache_path'] if all policies are cached,
+    otherwise run_al_box, which caches the outcome of every policy at its stop point
+    '''
+    cache = ALBoxCache(params['al_cache_path'])
+    keys = [cache.key(params, policy.B_al, seed) for policy in policies]
+    cached = [cache.load(digest, params['predicates']) for digest, _ in keys]
+    if all(entry is not None for entry in cached):
+        params['y_predicate'].update(cached[0][1])  # labels of the pool, without initial training items
+        return [ALBoxOutcome(**outcome) for outcome, _ in cached]
+
+    return run_al_box(params, policies, cache, keys)
+
+
+# run the AL-Box until every policy stops active learning, returns ALBoxOutcome per policy
+def run_al_box(params, policies, cache=None, cache_keys=None):
     crowd_acc = params['crowd_acc']
     crowd_votes_per_item_al = params['crowd_votes_per_item_al']
     predicates = params['predicates']
     screening_out_threshold_machines = 0.7
+    X_features = params['X_features']
+    items_num = params['y_screening'].shape[0]
+    crowd = params.get('crowd', CrowdSimulator)  # crowd simulator or a real votes backend
+
+    item_ids_helper = {pr: np.arange(items_num) for pr in predicates}  # helper to track item ids
+    crowd_votes_counts = {}
+    for item_id in range(items_num):
+        crowd_votes_counts[item_id] = {pr: {'in': 0, 'out': 0} for pr in predicates}
+    item_labels = {item_id: 1 for item_id in range(items_num)}  # classify all items as in by default
+
+    SAL = configure_al_box(params, item_ids_helper, crowd_votes_counts, item_labels)
+    if hasattr(crowd, 'votes_left'):
+        # item-predicates without real votes cannot be labeled by the crowd
+        for pr in predicates:
+            exhausted_idx = np.nonzero(crowd.votes_left(pr, item_ids_helper[pr], crowd_votes_counts) == 0)[0]
+            SAL.remove_from_pool(pr, exhausted_idx)
+            item_ids_helper[pr] = np.delete(item_ids_helper[pr], exhausted_idx)
+    watch(params, SAL, 'ScreeningActiveLearner')
+    B_al_spent = params['size_init_train_data']*len(predicates)*crowd_votes_per_item_al
+    batch_schedule = make_batch_schedule(params)
+    for policy in policies:
+        policy.query_cost = batch_schedule.min_size*crowd_votes_per_item_al
+    SAL.screening_out_threshold = screening_out_threshold_machines
+    outcomes = [None] * len(policies)
+    # refit learners in the background while the crowd labels the next query
+    trainer = BackgroundTrainer(SAL, params['al_staleness']) if params.get('al_staleness') is not None else None
+
+    def al_step(SAL_, crowd_votes_counts_, item_ids_helper_, pr, n_instances, trainer_=None):
+        # query, crowdsource and teach one batch, returns the votes cast, None if the pool is empty
+        query_idx = SAL_.query(pr, n_instances)
+        if len(query_idx) == 0:
+            return None
+        gt_items_queried = SAL_.learners[pr].y_pool[query_idx]
+        item_ids_queried = item_ids_helper_[pr][query_idx]
+        votes_before = votes_cast(crowd_votes_counts_, item_ids_queried, pr)
+        if trainer_ is None:
+            y_crowdsourced = crowd.crowdsource_items(item_ids_queried, gt_items_queried, pr,
+                                                     crowd_acc[pr], crowd_votes_per_item_al, crowd_votes_counts_)
+            SAL_.teach(pr, query_idx, y_crowdsourced)
+        else:
+            # queried items leave the pool before their labels arrive
+            X_queried = SAL_.learners[pr].pool_features(query_idx)
+            SAL_.remove_from_pool(pr, query_idx)
+            trainer_.start()
+            y_crowdsourced = crowd.crowdsource_items(item_ids_queried, gt_items_queried, pr,
+                                                     crowd_acc[pr], crowd_votes_per_item_al, crowd_votes_counts_)
+            trainer_.add_labels(pr, X_queried, y_crowdsourced)
+        item_ids_helper_[pr] = np.delete(item_ids_helper_[pr], query_idx)
+
+        # real votes backends may have fewer votes left than crowd_votes_per_item_al
+        return votes_cast(crowd_votes_counts_, item_ids_queried, pr) - votes_before
+
+    def snapshot(stopped, SAL_, crowd_votes_counts_, B_al_spent_):
+        # Get prior from machines, all items and predicates are scored in one pass
+        proba_in = SAL_.predict_proba_predicates(X_features)
+        prior_prob = {}
+        for item_id in range(items_num):
+            prior_prob[item_id] = {}
+            for pr in predicates:
+                prior_prob[item_id][pr] = {'in': proba_in[pr][item_id], 'out': 1 - proba_in[pr][item_id]}
+        machine_proba_in = np.prod([proba_in[pr] for pr in predicates], axis=0)
+        mark_phase(params, 'prior', experiment_id=params['experiment_id'], B_al_spent=B_al_spent_)
+        for i in stopped:
+            outcomes[i] = ALBoxOutcome(prior_prob, copy.deepcopy(crowd_votes_counts_), dict(item_labels),
+                                       B_al_spent_, machine_proba_in)
+            watch(params, outcomes[i], 'ALBoxOutcome')
+            if cache is not None:
+                digest, key = cache_keys[i]
+                cache.save(digest, key, outcomes[i], predicates, params['y_predicate'], params['vectorizer'], SAL_)
+        if params.get('snapshot_path'):
+            # keep the trained learners, one snapshot per AL stop point
+            save_snapshot(os.path.join(params['snapshot_path'], '{}_experiment{}_B_al{}'.format(
+                params['dataset_file_name'][:-4], params['experiment_id'], B_al_spent_)),
+                params['vectorizer'], SAL_, meta={'dataset_file_name': params['dataset_file_name'],
+                                                  'sampling_strategy': params['sampling_strategy'].__name__,
+                                                  'experiment_id': params['experiment_id'],
+                                                  'B_al_spent': B_al_spent_})
+
+    def snapshot_stopped(al_finished=False):
+        # snapshot AL state for every policy that stops active learning at the current spend
+        stopped = []
+        for i, policy in enumerate(policies):
+            policy.B_al_spent = B_al_spent
+            if outcomes[i] is None and (al_finished or not policy.is_continue_al):
+                stopped.append(i)
+        if stopped:
+            if trainer is not None:
+                trainer.drain()  # priors come from models fitted on all the labels
+            snapshot(stopped, SAL, crowd_votes_counts, B_al_spent)
+        return all(outcome is not None for outcome in outcomes)
+
+    while not snapshot_stopped():
+        # SAL.update_stat()  # uncomment if use predicate selection feature
+        pr = SAL.select_predicate()
+        if trainer is not None:
+            trainer.wait(pr)
+        # the batch size depends on the schedule only, so the trajectory is the same whatever the other policies
+        running = [i for i, outcome in enumerate(outcomes) if outcome is None]
+        n_instances = int(batch_schedule.next_size(max(policies[i].B_al for i in running) - B_al_spent,
+                                                   crowd_votes_per_item_al))
+        # policies that cannot pay for the batch stop after a final batch of the items their AL budget left pays for,
+        # queried on a copy of the AL-Box, random state is restored so that the trajectory goes on unchanged
+        final_sizes = {i: int((policies[i].B_al - B_al_spent) // crowd_votes_per_item_al) for i in running
+                       if policies[i].B_al - B_al_spent < n_instances*crowd_votes_per_item_al}
+        for n_final in sorted(set(final_sizes.values())):
+            if trainer is not None:
+                trainer.drain()
+            random_state = random.getstate(), np.random.get_state()
+            SAL_final = fork_al_box(SAL)
+            crowd_votes_counts_final = copy.deepcopy(crowd_votes_counts)
+            votes_final = al_step(SAL_final, crowd_votes_counts_final, copy.deepcopy(item_ids_helper), pr, n_final)
+            snapshot([i for i, n in final_sizes.items() if n == n_final], SAL_final, crowd_votes_counts_final,
+                     B_al_spent + (votes_final or 0))
+            random.setstate(random_state[0])
+            np.random.set_state(random_state[1])
+        if all(outcome is not None for outcome in outcomes):
+            break
+        votes = al_step(SAL, crowd_votes_counts, item_ids_helper, pr, n_instances, trainer)
+        if votes is None:
+            # exit the loop if we crowdsourced all the items
+            snapshot_stopped(al_finished=True)
+            break
+        batch_schedule.update(SAL, pr)
+        B_al_spent += votes
+        mark_phase(params, 'al_iteration', experiment_id=params['experiment_id'], predicate=pr, B_al_spent=B_al_spent)
+    if trainer is not None:
+        trainer.shutdown()
+
+    return outcomes
+
+
+def fork_al_box(SAL):
+    # copy of the AL-Box learners, the feature matrix and the executor are shared
+    memo = {id(l.X_features): l.X_features for l in SAL.learners.values()}
+    memo[id(SAL.executor)] = SAL.executor
+    return copy.deepcopy(SAL, memo)
+
+
+# run the Crowd-Box from the AL-Box outcome, classify the rest via machines and compute metrics
+def run_crowd_box(params, policy, outcome, item_predicate_gt, y_predicate, budget_per_item, switch_point):
+    crowd_acc = params['crowd_acc']
+    crowd_votes_per_item_al = params['crowd_votes_per_item_al']
+    predicates = params['predicates']
+    screening_out_threshold_machines = 0.7
+    y_screening = params['y_screening']
+    crowd = params.get('crowd', CrowdSimulator)  # crowd simulator or a real votes backend
+    items_num = y_screening.shape[0]
+    y_screening_dict = {item_id: label for item_id, label in zip(list(range(items_num)), y_screening)}
+    # an outcome may be forked into several cells
+    crowd_votes_counts = copy.deepcopy(outcome.crowd_votes_counts)
+    item_labels = dict(outcome.item_labels)
+    prior_prob = outcome.prior_prob
+    unclassified_item_ids = np.arange(items_num)
+
+    estimated_predicate_accuracy = {}
+    estimated_predicate_selectivity = {}
+    for pr in predicates:
+        estimated_predicate_accuracy[pr] = sum(crowd_acc[pr]) / 2
+        estimated_predicate_selectivity[pr] = sum(y_predicate[pr]) / len(y_predicate[pr])
+    crowd_labels = {}  # labels decided by SM-Run
+    # SM-Run rounds are sharded across processes for simulated crowds only
+    crowd_box_workers = params.get('crowd_box_workers', 1) if crowd is CrowdSimulator else 1
+    # counter-based votes in seeded and sharded runs, so that votes do not depend on the order of items
+    vote_seed = trial_seed(params, params['experiment_id'])
+    if vote_seed is None and crowd_box_workers > 1:
+        vote_seed = np.random.randint(2 ** 31)
+    machine_item_ids = []
+
+    # if Available Budget for Crowd-Box DO SM-RUN
+    if policy.B_crowd:
+        policy.B_crowd = policy.B - policy.B_al_spent
+        smr_params = {
+            'estimated_predicate_accuracy': estimated_predicate_accuracy,
+            'estimated_predicate_selectivity': estimated_predicate_selectivity,
+            'predicates': predicates,
+            'item_predicate_gt': item_predicate_gt,
+            'clf_threshold': params['screening_out_threshold'],
+            'stop_score': params['stop_score'],
+            'crowd_acc': crowd_acc,
+            'prior_prob': prior_prob,
+            'crowd': crowd if crowd is not CrowdSimulator else None,
+            'vote_seed': vote_seed
+        }
+        unclassified_item_ids = np.arange(items_num)
+        # crowdsource items for SM-Run base-round in case poor SM-Run used
+        if switch_point == 0:
+            baseround_item_num = 50  # since 50 used in WWW2018 Krivosheev et.al
+            items_baseround = unclassified_item_ids[:baseround_item_num]
+            for pr in predicates:
+                gt_items_baseround = {item_id: item_predicate_gt[pr][item_id] for item_id in items_baseround}
+                votes_before = votes_cast(crowd_votes_counts, items_baseround, pr)
+                crowd.crowdsource_items(items_baseround, gt_items_baseround, pr, crowd_acc[pr],
+                                        crowd_votes_per_item_al, crowd_votes_counts)
+                policy.update_budget_crowd(votes_cast(crowd_votes_counts, items_baseround, pr) - votes_before)
+        sharded = crowd_box_workers > 1
+        if sharded:
+            # the pool of the experiment if any, a pool of this run otherwise
+            SMR = params.get('crowd_box_executor') or ShardedShortestMultiRun(crowd_box_workers)
+            SMR.start(smr_params, crowd_votes_counts)
+        else:
+            SMR = ShortestMultiRun(smr_params)
+        try:
+            unclassified_item_ids = SMR.classify_items(unclassified_item_ids, crowd_votes_counts, crowd_labels)
+
+            while policy.is_continue_crowd and unclassified_item_ids.any():
+                # Check money
+                if (policy.B_crowd - policy.B_crowd_spent) < len(unclassified_item_ids):
+                    unclassified_item_ids = unclassified_item_ids[:(policy.B_crowd - policy.B_crowd_spent)]
+                unclassified_item_ids, budget_round = SMR.do_round(crowd_votes_counts, unclassified_item_ids,
+                                                                   crowd_labels)
+                policy.update_budget_crowd(budget_round)
+        finally:
+            if sharded:
+                SMR.finish()  # votes back to crowd_votes_counts
+                if SMR is not params.get('crowd_box_executor'):
+                    SMR.close()
+        item_labels.update(crowd_labels)
+        watch(params, SMR, 'ShortestMultiRun')
+        mark_phase(params, 'sm_run', experiment_id=params['experiment_id'], budget_per_item=budget_per_item,
+                   switch_point=switch_point)
+        # print('Crowd-Box finished')
+
+    # if budget is over and we did the AL part then classify the rest of the items via machines
+    if unclassified_item_ids.any() and switch_point != 0:
+        proba_out = 1 - outcome.machine_proba_in[unclassified_item_ids]
+        predicted = [0 if p > screening_out_threshold_machines else 1 for p in proba_out]
+        item_labels.update(dict(zip(unclassified_item_ids, predicted)))
+        machine_item_ids = unclassified_item_ids
+
+    if params.get('posteriors_path'):
+        save_trial_posteriors(params, outcome, crowd_votes_counts, item_labels, crowd_labels, machine_item_ids,
+                              estimated_predicate_accuracy, estimated_predicate_selectivity,
+                              screening_out_threshold_machines, budget_per_item, switch_point)
+
+    clusters = params.get('duplicate_clusters')
+    if clusters is not None:
+        # members of near-duplicate clusters get the label of their representative
+        item_labels = clusters.expand_labels(item_labels)
+        items_num = clusters.items_num
+        y_screening_dict = dict(enumerate(clusters.y_screening))
+    # compute metrics and pint results to csv
+    metrics = MetricsMixin.compute_screening_metrics(y_screening_dict, item_labels, params['lr'], params['beta'])
+    pre, rec, f_beta, loss, fn_count, fp_count = metrics
+    mark_phase(params, 'metrics', experiment_id=params['experiment_id'], budget_per_item=budget_per_item,
+               switch_point=switch_point)
+    budget_spent_item = (policy.B_al_spent + policy.B_crowd_spent) / items_num
+
+    print('budget spent per item: {:1.3f}, loss: {:1.3f}, fbeta: {:1.3f}, '
+          'recall: {:1.3f}, precisoin: {:1.3f}'
+          .format(budget_spent_item, loss, f_beta, rec, pre))
+    print('--------------------------------------------------------------')
+
+    return [budget_per_item, budget_spent_item, pre, rec, f_beta, loss, fn_count, fp_count, switch_point]
+
+
+def save_trial_posteriors(params, outcome, crowd_votes_counts, item_labels, crowd_labels, machine_item_ids,
+                          accuracy, selectivity, screening_out_threshold_machines, budget_per_item, switch_point):
+    y_screening = params['y_screening']
+    items_num = y_screening.shape[0]
+    crowd_proba_in, votes = crowd_posterior_in(crowd_votes_counts, range(items_num), params['predicates'],
+                                               accuracy, selectivity, outcome.prior_prob)
+    provenance = {item_id: 'crowd' for item_id in crowd_labels}
+    provenance.update({item_id: 'machine' for item_id in machine_item_ids})
+    machine_proba_in = outcome.machine_proba_in
+    clusters = params.get('duplicate_clusters')
+    if clusters is not None:
+        # per item of the whole dataset, members take the posteriors of their representative
+        y_screening, item_labels = clusters.y_screening, clusters.expand_labels(item_labels)
+        provenance = {item_id: provenance[rep] for item_id, rep in enumerate(clusters.member_of) if rep in provenance}
+        crowd_proba_in, votes = clusters.expand(crowd_proba_in), clusters.expand(votes)
+        machine_proba_in = clusters.expand(machine_proba_in) if machine_proba_in is not None else None
+    strategy = params['sampling_strategy'].__name__ if switch_point != 0 else 'crowd'
+    file_name = os.path.join(params['posteriors_path'], '{}_{}_budget{}_switch{}_experiment{}.npz'.format(
+        params['dataset_file_name'][:-4], strategy, budget_per_item, switch_point, params['experiment_id']))
+    save_posteriors(file_name, y_screening, item_labels, provenance, crowd_proba_in, machine_proba_in, votes,
+                    meta={'budget_per_item': budget_per_item, 'switch_point': switch_point,
+                          'crowd_threshold': params['screening_out_threshold'],
+                          'machine_threshold': screening_out_threshold_machines,
+                          'lr': params['lr'], 'beta': params['beta']})
+
+
+def summarize_results(results_list, params, switch_point):
+    df = pd.DataFrame(results_list, columns=['budget_per_item', 'budget_spent_per_item',
+                                             'precision', 'recall', 'f{}'.format(params['beta']), 'loss',
+                                             'fn_count', 'fp_count', 'AL_switch_point'])
+    df = compute_mean_std(df)
+    df['active_learning_strategy'] = params['sampling_strategy'].__name__ if switch_point != 0 else ''
+    df['screening_out_threshold'] = params['screening_out_threshold']
+    df['reps_used'] = len(results_list)
+
+    return df
 
-    df_to_print = pd.DataFrame()
-    for budget_per_item in params['budget_per_item']:
-        B = params['dataset_size'] * budget_per_item
-        for switch_point in params['policy_switch_point']:
-            print('Policy switch point: {}'.format(switch_point))
-            print('Budget per item: {}'.format(budget_per_item))
-            print('************************************')
-            results_list = []
-            for experiment_id in range(params['experiment_nums']):
-                policy = PointSwitchPolicy(B, switch_point)
-
-                X, y_screening, y_predicate = load_data(params['dataset_file_name'], predicates, params['path_to_project'])
-                vectorizer = Vectorizer()
-                vectorizer.fit(X)
-
-                items_num = y_screening.shape[0]
-                item_predicate_gt = {}
-                for pr in predicates:
-                    item_predicate_gt[pr] = {item_id: gt_val for item_id, gt_val in zip(list(range(items_num)), y_predicate[pr])}
-                item_ids_helper = {pr: np.arange(items_num) for pr in predicates}  # helper to track item ids
-                crowd_votes_counts, prior_prob = {}, {}
-                for item_id in range(items_num):
-                    crowd_votes_counts[item_id] = {pr: {'in': 0, 'out': 0} for pr in predicates}
-                item_labels = {item_id: 1 for item_id in range(items_num)}  # classify all items as in by default
-                y_screening_dict = {item_id: label for item_id, label in zip(list(range(items_num)), y_screening)}
-
-                params.update({
-                    'X': X,
-                    'y_screening': y_screening,
-                    'y_predicate': y_predicate,
-                    'vectorizer': vectorizer
-                })
-
-                # if Available Budget for Active Learniong is available then Do Run Active Learning Box
-                if switch_point != 0:
-                    SAL = configure_al_box(params, item_ids_helper, crowd_votes_counts, item_labels)
-                    policy.update_budget_al(params['size_init_train_data']*len(predicates)*crowd_votes_per_item_al)
-                    SAL.screening_out_threshold = screening_out_threshold_machines
-                    while policy.is_continue_al:
-                        # SAL.update_stat()  # uncomment if use predicate selection feature
-                        pr = SAL.select_predicate()
-                        query_idx = SAL.query(pr)
-                        if len(query_idx) == 0:
-                            # exit the loop if we crowdsourced all the items
-                            break
-                        # crowdsource sampled items
-                        gt_items_queried = SAL.learners[pr].y_pool[query_idx]
-                        y_crowdsourced = CrowdSimulator.crowdsource_items(item_ids_helper[pr][query_idx], gt_items_queried, pr,
-                                                                          crowd_acc[pr], crowd_votes_per_item_al, crowd_votes_counts)
-                        SAL.teach(pr, query_idx, y_crowdsourced)
-                        item_ids_helper[pr] = np.delete(item_ids_helper[pr], query_idx)
-
-                        policy.update_budget_al(SAL.n_instances_query*crowd_votes_per_item_al)
-
-                    unclassified_item_ids = np.arange(items_num)
-                    # Get prior from machines
-                    for item_id in range(items_num):
-                        prior_prob[item_id] = {}
-                        for pr in predicates:
-                            prediction = SAL.learners[pr].learner.predict_proba(vectorizer.transform([X[item_id]]))[0]
-                            prior_prob[item_id][pr] = {'in': prediction[1], 'out': prediction[0]}
-                    print('experiment_id {}'.format(experiment_id), end=', ')
-
-                # if Available Budget for Crowd-Box DO SM-RUN
-                if policy.B_crowd:
-                    policy.B_crowd = policy.B - policy.B_al_spent
-                    estimated_predicate_accuracy = {}
-                    estimated_predicate_selectivity = {}
-                    for pr in predicates:
-                        estimated_predicate_accuracy[pr] = sum(crowd_acc[pr]) / 2
-                        estimated_predicate_selectivity[pr] = sum(y_predicate[pr]) / len(y_predicate[pr])
-                    smr_params = {
-                        'estimated_predicate_accuracy': estimated_predicate_accuracy,
-                        'estimated_predicate_selectivity': estimated_predicate_selectivity,
-                        'predicates': predicates,
-                        'item_predicate_gt': item_predicate_gt,
-                        'clf_threshold': params['screening_out_threshold'],
-                        'stop_score': params['stop_score'],
-                        'crowd_acc': crowd_acc,
-                        'prior_prob': prior_prob
-                    }
-                    SMR = ShortestMultiRun(smr_params)
-                    unclassified_item_ids = np.arange(items_num)
-                    # crowdsource items for SM-Run base-round in case poor SM-Run used
-                    if switch_point == 0:
-                        baseround_item_num = 50  # since 50 used in WWW2018 Krivosheev et.al
-                        items_baseround = unclassified_item_ids[:baseround_item_num]
-                        for pr in predicates:
-                            gt_items_baseround = {item_id: item_predicate_gt[pr][item_id] for item_id in items_baseround}
-                            CrowdSimulator.crowdsource_items(items_baseround, gt_items_baseround, pr, crowd_acc[pr],
-                                                             crowd_votes_per_item_al, crowd_votes_counts)
-                            policy.update_budget_crowd(baseround_item_num * crowd_votes_per_item_al)
-                    unclassified_item_ids = SMR.classify_items(unclassified_item_ids, crowd_votes_counts, item_labels)
-
-                    while policy.is_continue_crowd and unclassified_item_ids.any():
-                        # Check money
-                        if (policy.B_crowd - policy.B_crowd_spent) < len(unclassified_item_ids):
-                            unclassified_item_ids = unclassified_item_ids[:(policy.B_crowd - policy.B_crowd_spent)]
-                        unclassified_item_ids, budget_round = SMR.do_round(crowd_votes_counts, unclassified_item_ids, item_labels)
-                        policy.update_budget_crowd(budget_round)
-                    # print('Crowd-Box finished')
-
-                # if budget is over and we did the AL part then classify the rest of the items via machines
-                if unclassified_item_ids.any() and switch_point != 0:
-                    predicted = SAL.predict(vectorizer.transform(X[unclassified_item_ids]))
-                    item_labels.update(dict(zip(unclassified_item_ids, predicted)))
-
-                # compute metrics and pint results to csv
-                metrics = MetricsMixin.compute_screening_metrics(y_screening_dict, item_labels, params['lr'], params['beta'])
-                pre, rec, f_beta, loss, fn_count, fp_count = metrics
-                budget_spent_item = (policy.B_al_spent + policy.B_crowd_spent) / items_num
-                results_list.append([budget_per_item, budget_spent_item, pre, rec, f_beta, loss, fn_count,
-                                     fp_count, switch_point])
-
-                print('budget spent per item: {:1.3f}, loss: {:1.3f}, fbeta: {:1.3f}, '
-                      'recall: {:1.3f}, precisoin: {:1.3f}'
-                      .format(budget_spent_item, loss, f_beta, rec, pre))
-                print('--------------------------------------------------------------')
-
-            df = pd.DataFrame(results_list, columns=['budget_per_item', 'budget_spent_per_item',
-                                                     'precision', 'recall', 'f{}'.format(params['beta']), 'loss',
-                                                     'fn_count', 'fp_count', 'AL_switch_point'])
-            df = compute_mean_std(df)
-            df['active_learning_strategy'] = params['sampling_strategy'].__name__ if switch_point != 0 else ''
-            df['screening_out_threshold'] = params['screening_out_threshold']
-            df_to_print = df_to_print.append(df, ignore_index=True)
 
+def save_results(df_to_print, params, suffix=''):
     file_name = params['dataset_file_name'][:-4] + '_experiment_nums_{}_ninstq_{}'.format(params['experiment_nums'], params['n_instances_query'])
-    if len(predicates) == 1:
+    if len(params['predicates']) == 1:
         file_name = 'binary_' + file_name
+    file_name += suffix
     path = params['path_to_project'] + 'adaptive_machine_and_crowd/output/'
     if os.path.isfile(path + '{}.csv'.format(file_name)):
         df_prev = pd.read_csv(path + '{}.csv'.format(file_name))
@@ -163,13 +554,14 @@ def configure_al_box(params, item_ids_helper, crowd_votes_counts, item_labels):
     size_init_train_data = params['size_init_train_data']
     predicates = params['predicates']
 
-    X_pool = params['vectorizer'].transform(params['X'])
+    X_features = params['X_features']
     # creating balanced init training data
     train_idx = get_init_training_data_idx(y_screening, y_predicate, size_init_train_data)
 
     y_predicate_train_init = {}
-    X_train_init = X_pool[train_idx]
-    X_pool = np.delete(X_pool, train_idx, axis=0)
+    X_train_init = X_features[train_idx]
+    # the pool is the rows of the (possibly shared) feature matrix left, learners do not copy it
+    pool_rows = np.delete(np.arange(y_screening.shape[0]), train_idx)
     for pr in predicates:
         y_predicate_train_init[pr] = y_predicate[pr][train_idx]
         y_predicate[pr] = np.delete(y_predicate[pr], train_idx)
@@ -183,14 +575,25 @@ def configure_al_box(params, item_ids_helper, crowd_votes_counts, item_labels):
 
     # dict of active learners per predicate
     learners = {}
+    seed = trial_seed(params, params.get('experiment_id', 0))
     for pr in predicates:  # setup predicate-based learners
+        # seeded learners do not draw from the global numpy stream, so fits on the executor threads are reproducible
+        random_state = learner_seed(seed, pr)
+        cv = StratifiedKFold(5, shuffle=True, random_state=random_state) if random_state is not None else None
+        sgd = SGDClassifier(class_weight='balanced', max_iter=1000, tol=1e-3, n_jobs=-1, random_state=random_state)
         learner_params = {
-            'clf': CalibratedClassifierCV(SGDClassifier(class_weight='balanced', max_iter=1000, tol=1e-3, n_jobs=-1)),
+            'clf': CalibratedClassifierCV(sgd, cv=cv),
             'sampling_strategy': params['sampling_strategy'],
         }
-        learner = Learner(learner_params)
-        learner.setup_active_learner(X_train_init, y_predicate_train_init[pr], X_pool, y_predicate[pr])
-        learners[pr] = learner
+        if params.get('alpha_grid') is not None:
+            learner_params['tuner'] = AlphaTuner(params['alpha_grid'], params.get('tune_every', 1))
+        learners[pr] = Learner(learner_params)
+    setup_args = [[learners[pr] for pr in predicates], [X_train_init] * len(predicates),
+                  [y_predicate_train_init[pr] for pr in predicates], [X_features] * len(predicates),
+                  [pool_rows] * len(predicates), [y_predicate[pr] for pr in predicates]]
+    executor = params.get('executor')
+    fitted = executor.map(_setup_learner, *setup_args) if executor is not None else map(_setup_learner, *setup_args)
+    learners = dict(zip(predicates, fitted))
 
     params.update({'learners': learners})
     SAL = ScreeningActiveLearner(params)
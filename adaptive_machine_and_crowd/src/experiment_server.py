@@ -0,0 +1,244 @@
+import os
+import io
+import json
+import socket
+import argparse
+import contextlib
+import socketserver
+import statistics
+import multiprocessing
+
+from adaptive_machine_and_crowd.src.datasets import get_dataset_config, get_sampling_strategy, get_crowd
+
+'''
+    Long-lived experiment server with warm worker processes.
+    Workers import sklearn/scipy/pandas/modAL once and keep loaded and featurized datasets resident,
+    so a sweep spec only pays for the experiments themselves. The client side imports no heavy libraries.
+    Preloaded datasets are featurized once by the server and attached read-only by the workers.
+
+    Start the server:
+        python -m adaptive_machine_and_crowd.src.experiment_server serve --workers 4 --preload amazon,slr
+    Submit a sweep spec (json file or string), results are streamed back as json lines:
+        python -m adaptive_machine_and_crowd.src.experiment_server submit spec.json
+
+    Spec keys: 'dataset' (key of datasets.DATASETS), 'sampling_strategy' (function name),
+    'budget_per_item', 'policy_switch_point', 'experiment_nums', optionally 'fork_al' and any other
+    experiment parameter of main.py to override DEFAULT_PARAMS.
+'''
+
+path_to_project = os.path.realpath(__file__)[:-len('adaptive_machine_and_crowd/src/experiment_server.py')]
+
+DEFAULT_ADDRESS = ('127.0.0.1', 8765)
+
+DEFAULT_PARAMS = {
+    'n_instances_query': 100,
+    'size_init_train_data': 20,
+    'screening_out_threshold': 0.99,
+    'stop_score': 50,
+    'beta': 1,
+    'lr': 5,
+    'experiment_nums': 1,
+    'crowd_votes_per_item_al': 3,
+    'policy_switch_point': [0.5],
+    'budget_per_item': [3],
+    'sampling_strategy': 'uncertainty_sampling',
+    'fork_al': False
+}
+
+# per worker process cache: (dataset_file_name, predicates) -> prepare_data output
+_data_cache = {}
+# per worker process: (dataset_file_name, predicates) -> handle of the dataset published by the server
+_shared_handles = {}
+# per worker process cache: (dataset, path_to_project) -> crowd backend, real votes are loaded once
+_crowd_cache = {}
+
+
+def build_params(spec):
+    '''
+    :param spec: dict with 'dataset' name and experiment parameters to override DEFAULT_PARAMS
+    :return: params for run_trial
+    '''
+    params = dict(DEFAULT_PARAMS)
+    dataset_config = get_dataset_config(spec['dataset'])
+    params.update(dataset_config)
+    params.update({k: v for k, v in spec.items() if k != 'dataset'})
+    params['sampling_strategy'] = get_sampling_strategy(params['sampling_strategy'])
+    params['path_to_project'] = params.get('path_to_project', path_to_project)
+    crowd_key = spec['dataset'], params['path_to_project']
+    if crowd_key not in _crowd_cache:
+        _crowd_cache[crowd_key] = get_crowd(dataset_config, params['path_to_project'])
+    params['crowd'] = _crowd_cache[crowd_key]
+    # preloaded datasets published by the server
+    params['shared_data'] = _shared_handles.get(data_key(params))
+
+    return params
+
+
+def data_key(params):
+    return params['dataset_file_name'], tuple(params['predicates']), params['path_to_project']
+
+
+def get_data(params):
+    from adaptive_machine_and_crowd.src.experiment_handler import prepare_data
+    key = data_key(params)
+    if key not in _data_cache:
+        _data_cache[key] = prepare_data(params)
+    return _data_cache[key]
+
+
+def _init_worker(preload, shared_handles=None):
+    # warm up: import libraries, load and featurize datasets once per worker,
+    # attach to the preloaded datasets the server published
+    import adaptive_machine_and_crowd.src.experiment_handler
+    _shared_handles.update(shared_handles or {})
+    get_sampling_strategy(DEFAULT_PARAMS['sampling_strategy'])
+    for dataset in preload:
+        get_data(build_params({'dataset': dataset}))
+
+
+def _run_task(task):
+    from adaptive_machine_and_crowd.src.experiment_handler import run_trial, run_forked_trials
+    spec, cells, experiment_id = task
+    params = build_params(spec)
+    with contextlib.redirect_stdout(io.StringIO()):
+        if len(cells) == 1:
+            rows = [run_trial(params, cells[0][0], cells[0][1], experiment_id, get_data(params))]
+        else:
+            rows = run_forked_trials(params, cells, experiment_id, get_data(params))
+
+    return [dict(zip(['budget_per_item', 'budget_spent_per_item', 'precision', 'recall', 'f_beta', 'loss',
+                      'fn_count', 'fp_count', 'AL_switch_point', 'experiment_id'],
+                     [float(v) for v in row] + [experiment_id])) for row in rows]
+
+
+def split_tasks(spec):
+    '''
+    :return: list of (spec, cells, experiment_id), one task per cell and repetition,
+             or one task per repetition covering all cells if spec['fork_al']
+    '''
+    spec = dict(DEFAULT_PARAMS, **spec)
+    cells = [(budget_per_item, switch_point) for budget_per_item in spec['budget_per_item']
+             for switch_point in spec['policy_switch_point']]
+    tasks = []
+    for experiment_id in range(spec['experiment_nums']):
+        if spec['fork_al']:
+            tasks.append((spec, cells, experiment_id))
+        else:
+            tasks.extend((spec, [cell], experiment_id) for cell in cells)
+
+    return tasks
+
+
+class ExperimentServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address=DEFAULT_ADDRESS, n_workers=None, preload=(), share_data=True, dedup_threshold=None):
+        '''
+        :param share_data: featurize preloaded datasets once in the server and share them with the workers
+                           read-only (see shared_data.py) instead of a featurized copy per worker
+        :param dedup_threshold: publish near-duplicate clusters of preloaded datasets for specs with this
+                                'dedup_threshold' (see dedup.py)
+        '''
+        self.shared = []
+        shared_handles = {}
+        if share_data and preload:
+            from adaptive_machine_and_crowd.src.experiment_handler import prepare_data
+            from adaptive_machine_and_crowd.src.shared_data import SharedDataset
+            for dataset in preload:
+                params = build_params({'dataset': dataset})
+                self.shared.append(SharedDataset.publish(prepare_data(params), dedup_threshold=dedup_threshold))
+                shared_handles[data_key(params)] = self.shared[-1].handle
+        self.pool = multiprocessing.Pool(n_workers or os.cpu_count(), initializer=_init_worker,
+                                         initargs=(list(preload), shared_handles))
+        socketserver.TCPServer.__init__(self, address, _SpecHandler)
+
+    def server_close(self):
+        socketserver.TCPServer.server_close(self)
+        self.pool.terminate()
+        self.pool.join()
+        for shared in self.shared:
+            shared.close()
+
+
+class _SpecHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        # one json spec per line, results are streamed back as json lines ending with {"done": true}
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                tasks = split_tasks(json.loads(line.decode()))
+                for rows in self.server.pool.imap_unordered(_run_task, tasks):
+                    for row in rows:
+                        self._send(row)
+                self._send({'done': True, 'tasks': len(tasks)})
+            except Exception as e:
+                self._send({'done': True, 'error': '{}: {}'.format(type(e).__name__, e)})
+
+    def _send(self, message):
+        self.wfile.write((json.dumps(message) + '\n').encode())
+        self.wfile.flush()
+
+
+def submit(spec, address=DEFAULT_ADDRESS):
+    '''
+    Send a sweep spec to a running server
+    :return: generator of result rows as they are finished
+    '''
+    with socket.create_connection(address) as sock:
+        sock.sendall((json.dumps(spec) + '\n').encode())
+        for line in sock.makefile('r'):
+            message = json.loads(line)
+            if message.get('done'):
+                if 'error' in message:
+                    raise RuntimeError(message['error'])
+                return
+            yield message
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='warm experiment server')
+    subparsers = parser.add_subparsers(dest='command')
+    serve_parser = subparsers.add_parser('serve')
+    serve_parser.add_argument('--host', default=DEFAULT_ADDRESS[0])
+    serve_parser.add_argument('--port', type=int, default=DEFAULT_ADDRESS[1])
+    serve_parser.add_argument('--workers', type=int, default=None)
+    serve_parser.add_argument('--preload', default='', help='comma separated dataset names')
+    serve_parser.add_argument('--private-data', action='store_true',
+                              help='featurize preloaded datasets in every worker instead of sharing them')
+    serve_parser.add_argument('--dedup-threshold', type=float, default=None,
+                              help='near-duplicate clusters to publish with shared datasets')
+    submit_parser = subparsers.add_parser('submit')
+    submit_parser.add_argument('spec', help='path to json spec or json string')
+    submit_parser.add_argument('--host', default=DEFAULT_ADDRESS[0])
+    submit_parser.add_argument('--port', type=int, default=DEFAULT_ADDRESS[1])
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        preload = [d for d in args.preload.split(',') if d]
+        server = ExperimentServer((args.host, args.port), args.workers, preload, not args.private_data,
+                                  args.dedup_threshold)
+        print('Experiment server is listening on {}:{}'.format(args.host, args.port))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+    elif args.command == 'submit':
+        spec = json.load(open(args.spec)) if os.path.isfile(args.spec) else json.loads(args.spec)
+        rows = []
+        for row in submit(spec, (args.host, args.port)):
+            print(json.dumps(row))
+            rows.append(row)
+        if rows:
+            print('mean loss: {:1.3f}, mean f_beta: {:1.3f}'.format(statistics.mean([r['loss'] for r in rows]),
+                                                                     statistics.mean([r['f_beta'] for r in rows])))
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
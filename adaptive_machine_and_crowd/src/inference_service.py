@@ -0,0 +1,319 @@
+import json
+import time
+import queue
+import argparse
+import threading
+import collections
+import urllib.request
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+'''
+    Local inference service for trained screening models.
+    Concurrent requests are coalesced into micro-batches (up to max_batch_size documents, waiting at most
+    max_wait seconds for a batch to fill), every batch is vectorized and scored for all predicates in one pass.
+
+    In-process:
+        service = InferenceService(load_snapshot(path)).start()
+        service.classify(doc)  # {'label': 0/1, 'proba_in': .., 'proba_in_predicates': {..}}
+    Local HTTP front end (POST /classify {"docs": [...]}, GET /stats):
+        python -m adaptive_machine_and_crowd.src.inference_service serve SNAPSHOT_PATH --port 8766
+    Load test with concurrent clients, in-process or against a running HTTP front end:
+        python -m adaptive_machine_and_crowd.src.inference_service load DATASET SNAPSHOT_PATH --clients 16
+        python -m adaptive_machine_and_crowd.src.inference_service load DATASET --url http://127.0.0.1:8766
+'''
+
+
+class LearnersModel:
+    '''
+    Adapter of an in-memory Vectorizer and ScreeningActiveLearner to the ScreeningModel interface
+    '''
+
+    def __init__(self, vectorizer, SAL):
+        self.vectorizer = vectorizer
+        self.SAL = SAL
+        self.predicates = SAL.predicates
+        self.screening_out_threshold = SAL.screening_out_threshold
+
+    def transform(self, docs):
+        return self.vectorizer.transform(docs)
+
+    def predict_proba_predicates(self, X, predicates=None):
+        return self.SAL.predict_proba_predicates(X, predicates)
+
+
+class InferenceService:
+
+    def __init__(self, model, max_batch_size=64, max_wait=0.002, latency_window=100000):
+        '''
+        :param model: ScreeningModel (snapshot.load_snapshot) or LearnersModel
+        :param max_batch_size: max number of documents scored in one pass
+        :param max_wait: max seconds the first request of a batch waits for more requests
+        :param latency_window: number of the latest requests latency percentiles are computed over
+        '''
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.latencies = collections.deque(maxlen=latency_window)
+        self.requests_num = 0
+        self.batches_num = 0
+        self.start_time = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._submit_lock = threading.Lock()  # no request is queued once stop has drained the queue
+
+    def start(self):
+        self._stop.clear()
+        self.start_time = time.perf_counter()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        # requests not scored yet fail, so that no caller waits forever
+        with self._submit_lock:
+            self._stop.set()
+        self._thread.join()
+        error = RuntimeError('Inference service stopped')
+        while True:
+            try:
+                _, future, _ = self.requests.get_nowait()
+            except queue.Empty:
+                break
+            future.set_exception(error)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def submit(self, doc):
+        '''
+        :return: Future of the classification result of the document
+        '''
+        future = Future()
+        with self._submit_lock:
+            if self._stop.is_set():
+                future.set_exception(RuntimeError('Inference service stopped'))
+            else:
+                self.requests.put((doc, future, time.perf_counter()))
+        return future
+
+    def classify(self, doc, timeout=None):
+        return self.submit(doc).result(timeout)
+
+    def classify_many(self, docs, timeout=None):
+        futures = [self.submit(doc) for doc in docs]
+        return [future.result(timeout) for future in futures]
+
+    def _next_batch(self):
+        try:
+            batch = [self.requests.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                batch.append(self.requests.get(timeout=timeout) if timeout > 0 else self.requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _serve(self):
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            if not batch:
+                continue
+            docs = [doc for doc, _, _ in batch]
+            try:
+                results = self.score(docs)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            done = time.perf_counter()
+            for (_, future, submitted), result in zip(batch, results):
+                self.latencies.append(done - submitted)
+                future.set_result(result)
+            self.requests_num += len(batch)
+            self.batches_num += 1
+
+    def score(self, docs):
+        # all predicates are scored in one pass over the batch
+        X = self.model.transform(docs)
+        proba_in_predicates = self.model.predict_proba_predicates(X)
+        proba_in = np.prod([proba_in_predicates[pr] for pr in self.model.predicates], axis=0)
+        labels = np.where(1 - proba_in > self.model.screening_out_threshold, 0, 1)
+
+        return [{'label': int(labels[i]), 'proba_in': float(proba_in[i]),
+                 'proba_in_predicates': {pr: float(proba_in_predicates[pr][i]) for pr in self.model.predicates}}
+                for i in range(len(docs))]
+
+    def stats(self):
+        elapsed = time.perf_counter() - self.start_time if self.start_time is not None else 0.
+        latencies = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+        return {
+            'requests': self.requests_num,
+            'batches': self.batches_num,
+            'mean_batch_size': self.requests_num / self.batches_num if self.batches_num else 0.,
+            'throughput_per_sec': self.requests_num / elapsed if elapsed else 0.,
+            'latency_p50_ms': float(np.percentile(latencies, 50)),
+            'latency_p95_ms': float(np.percentile(latencies, 95)),
+            'latency_p99_ms': float(np.percentile(latencies, 99))
+        }
+
+
+class _ClassifyHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        if self.path != '/classify':
+            self.send_error(404)
+            return
+        try:
+            docs = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))['docs']
+            if not isinstance(docs, list) or not all(isinstance(doc, str) for doc in docs):
+                raise TypeError('docs is not a list of strings')
+        except (ValueError, KeyError, TypeError):
+            self.send_error(400, 'Expected a JSON body {"docs": [...]} of strings')
+            return
+        # documents of a request are submitted one by one to be batched with other requests
+        try:
+            results = self.server.service.classify_many(docs)
+        except Exception as e:
+            self.send_error(500, str(e))
+            return
+        self._send(results)
+
+    def do_GET(self):
+        if self.path != '/stats':
+            self.send_error(404)
+            return
+        self._send(self.server.service.stats())
+
+    def _send(self, message):
+        data = json.dumps(message).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_http_server(service, host='127.0.0.1', port=8766):
+    server = ThreadingHTTPServer((host, port), _ClassifyHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def http_classify(docs, url='http://127.0.0.1:8766'):
+    request = urllib.request.Request(url + '/classify', data=json.dumps({'docs': list(docs)}).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def generate_load(classify, docs, clients_num=16, requests_num=2000):
+    '''
+    Closed-loop load: every client sends one document at a time and waits for the result
+    :param classify: function doc -> result, e.g. service.classify or lambda doc: http_classify([doc], url)[0]
+    :return: client side latency percentiles (ms) and throughput
+    '''
+    latencies = []
+    lock = threading.Lock()
+    counter = iter(range(requests_num))
+
+    def client():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            classify(docs[i % len(docs)])
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(clients_num)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies = np.array(latencies) * 1000
+
+    return {
+        'requests': requests_num,
+        'clients': clients_num,
+        'throughput_per_sec': requests_num / elapsed,
+        'latency_p50_ms': float(np.percentile(latencies, 50)),
+        'latency_p95_ms': float(np.percentile(latencies, 95)),
+        'latency_p99_ms': float(np.percentile(latencies, 99))
+    }
+
+
+def main(argv=None):
+    from adaptive_machine_and_crowd.src.snapshot import load_snapshot
+
+    parser = argparse.ArgumentParser(description='micro-batching inference service for screening snapshots')
+    subparsers = parser.add_subparsers(dest='command')
+    serve_parser = subparsers.add_parser('serve')
+    serve_parser.add_argument('snapshot')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8766)
+    load_parser = subparsers.add_parser('load')
+    load_parser.add_argument('dataset', help='key of datasets.DATASETS to take documents from')
+    load_parser.add_argument('snapshot', nargs='?', help='snapshot to load in-process, not used with --url')
+    load_parser.add_argument('--clients', type=int, default=16)
+    load_parser.add_argument('--requests', type=int, default=2000)
+    load_parser.add_argument('--url', default=None, help='load a running HTTP front end instead of in-process')
+    for subparser in [serve_parser, load_parser]:
+        subparser.add_argument('--max-batch-size', type=int, default=64)
+        subparser.add_argument('--max-wait', type=float, default=0.002)
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return
+    if args.command == 'load' and args.url is None and args.snapshot is None:
+        parser.error('load needs a snapshot or the --url of a running front end')
+
+    if args.command == 'serve':
+        service = InferenceService(load_snapshot(args.snapshot), args.max_batch_size, args.max_wait).start()
+        server = make_http_server(service, args.host, args.port)
+        print('Inference service is listening on {}:{}'.format(args.host, args.port))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            service.stop()
+    else:
+        import os
+        from adaptive_machine_and_crowd.src.utils import load_data
+        from adaptive_machine_and_crowd.src.datasets import get_dataset_config
+        dataset_config = get_dataset_config(args.dataset)
+        path_to_project = os.path.realpath(__file__)[:-len('adaptive_machine_and_crowd/src/inference_service.py')]
+        docs, _, _ = load_data(dataset_config['dataset_file_name'], dataset_config['predicates'], path_to_project)
+        if args.url:
+            classify = lambda doc: http_classify([doc], args.url)[0]
+            print('client side: {}'.format(generate_load(classify, docs, args.clients, args.requests)))
+            with urllib.request.urlopen(args.url + '/stats') as response:
+                print('server side: {}'.format(json.loads(response.read())))
+        else:
+            with InferenceService(load_snapshot(args.snapshot), args.max_batch_size, args.max_wait) as service:
+                print('client side: {}'.format(generate_load(service.classify, docs, args.clients, args.requests)))
+                print('server side: {}'.format(service.stats()))
+
+
+if __name__ == '__main__':
+    main()
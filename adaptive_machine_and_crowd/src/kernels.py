@@ -0,0 +1,214 @@
+import os
+import time
+import numpy as np
+
+'''
+    Inner-loop kernels of the Crowd-Box (SM-Run) and the crowd simulator.
+    Every kernel has a pure NumPy reference implementation and a Numba-compiled one,
+    the backend is chosen at import time: Numba if it is installed, NumPy otherwise.
+    Set SCREENING_KERNELS=numpy to force the reference backend.
+
+    posterior_in: P(predicate is IN | votes) for arrays of vote counts and priors
+    look_ahead_scores: SM-Run score of asking one more predicate per item,
+                       expected number of votes to classify the item OUT
+    tally_votes: IN votes of simulated workers given pre-drawn uniforms
+    counter_uniforms: uniforms as a hash of (seed, item, predicate, vote index, stream), NumPy only,
+                      a vote gets the same draws in whatever order or process items are crowdsourced
+
+    Run this module to check equivalence of the backends and benchmark them.
+'''
+
+
+def posterior_in_numpy(in_c, out_c, acc, prior_in, selectivity):
+    '''
+    :param in_c, out_c: int arrays [items, predicates] of IN/OUT votes
+    :param acc: estimated crowd accuracy per predicate [predicates]
+    :param prior_in: prior prob of predicate being IN [items, predicates]
+    :param selectivity: estimated selectivity per predicate [predicates], used for items without votes
+    :return: posterior prob of predicate being IN [items, predicates]
+    '''
+    # the binomial coefficients of IN and OUT terms are equal and cancel out
+    term_in = acc ** in_c * (1 - acc) ** out_c * prior_in
+    term_out = acc ** out_c * (1 - acc) ** in_c * (1 - prior_in)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        prob_in = term_in / (term_in + term_out)
+    no_votes = (in_c == 0) & (out_c == 0)
+
+    return np.where(no_votes, np.broadcast_to(selectivity, in_c.shape), prob_in)
+
+
+def look_ahead_scores_numpy(in_c, out_c, acc, prior_in, prob_other_in, clf_threshold, max_look_ahead=10):
+    '''
+    :param prob_other_in: prob of all other predicates being IN [items, predicates]
+    :return: scores [items, predicates], n / P(n next votes are OUT) for the least n votes
+             classifying the item OUT, or for n = max_look_ahead
+    '''
+    prob_pred_out = 1 - prior_in
+    prob_next_vote_out = acc * prob_pred_out + (1 - acc) * (1 - prob_pred_out)
+    joint_prob_votes_out = np.ones(in_c.shape)
+    scores = np.full(in_c.shape, np.nan)
+    for n in range(1, max_look_ahead + 1):
+        joint_prob_votes_out = joint_prob_votes_out * prob_next_vote_out
+        term_in = acc ** in_c * (1 - acc) ** (out_c + n) * prior_in
+        term_out = acc ** (out_c + n) * (1 - acc) ** in_c * (1 - prior_in)
+        prob_predicate_in = term_in / (term_in + term_out)
+        prob_item_out = 1 - prob_other_in * prob_predicate_in
+        done = np.isnan(scores) & ((prob_item_out >= clf_threshold) | (n == max_look_ahead))
+        scores[done] = n / joint_prob_votes_out[done]
+
+    return scores
+
+
+def tally_votes_numpy(gt, acc_low, acc_high, acc_draws, vote_draws):
+    '''
+    :param gt: ground truth per item [items]
+    :param acc_low, acc_high: range of worker accuracy
+    :param acc_draws, vote_draws: uniform draws [items, votes] for worker accuracy and vote
+    :return: number of IN votes per item [items]
+    '''
+    worker_acc = acc_low + acc_draws * (acc_high - acc_low)
+    prob_vote_in = np.where(np.asarray(gt)[:, None] == 1, worker_acc, 1 - worker_acc)
+
+    return (vote_draws < prob_vote_in).sum(axis=1)
+
+
+def _splitmix64(x):
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def counter_uniforms(seed, item_ids, predicate_idx, vote_idx, streams=2):
+    '''
+    :param item_ids, vote_idx: int arrays [items], vote_idx is the number of votes the item has on the predicate
+    :return: uniform draws in [0, 1) [streams, items]
+    '''
+    item_ids = np.asarray(item_ids, dtype=np.uint64)
+    vote_idx = np.asarray(vote_idx, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        x = _splitmix64(np.full(item_ids.shape, seed, dtype=np.uint64))
+        x = _splitmix64(x ^ item_ids)
+        x = _splitmix64(x ^ (np.uint64(predicate_idx) << np.uint64(32)) ^ vote_idx)
+        draws = [_splitmix64(x ^ np.uint64(stream)) for stream in range(streams)]
+
+    return np.stack([(d >> np.uint64(11)) * 2. ** -53 for d in draws])
+
+
+try:
+    import numba
+
+    @numba.njit(cache=True, error_model='numpy')
+    def posterior_in_numba(in_c, out_c, acc, prior_in, selectivity):
+        prob_in = np.empty(in_c.shape)
+        for i in range(in_c.shape[0]):
+            for j in range(in_c.shape[1]):
+                if in_c[i, j] == 0 and out_c[i, j] == 0:
+                    prob_in[i, j] = selectivity[j]
+                else:
+                    term_in = acc[j] ** in_c[i, j] * (1 - acc[j]) ** out_c[i, j] * prior_in[i, j]
+                    term_out = acc[j] ** out_c[i, j] * (1 - acc[j]) ** in_c[i, j] * (1 - prior_in[i, j])
+                    prob_in[i, j] = term_in / (term_in + term_out)
+        return prob_in
+
+    @numba.njit(cache=True, error_model='numpy')
+    def _look_ahead_scores_numba(in_c, out_c, acc, prior_in, prob_other_in, clf_threshold, max_look_ahead):
+        scores = np.empty(in_c.shape)
+        for i in range(in_c.shape[0]):
+            for j in range(in_c.shape[1]):
+                prob_pred_out = 1 - prior_in[i, j]
+                prob_next_vote_out = acc[j] * prob_pred_out + (1 - acc[j]) * (1 - prob_pred_out)
+                joint_prob_votes_out = 1.
+                for n in range(1, max_look_ahead + 1):
+                    joint_prob_votes_out = joint_prob_votes_out * prob_next_vote_out
+                    term_in = acc[j] ** in_c[i, j] * (1 - acc[j]) ** (out_c[i, j] + n) * prior_in[i, j]
+                    term_out = acc[j] ** (out_c[i, j] + n) * (1 - acc[j]) ** in_c[i, j] * (1 - prior_in[i, j])
+                    prob_item_out = 1 - prob_other_in[i, j] * (term_in / (term_in + term_out))
+                    if prob_item_out >= clf_threshold or n == max_look_ahead:
+                        scores[i, j] = n / joint_prob_votes_out
+                        break
+        return scores
+
+    def look_ahead_scores_numba(in_c, out_c, acc, prior_in, prob_other_in, clf_threshold, max_look_ahead=10):
+        return _look_ahead_scores_numba(in_c, out_c, acc, prior_in, prob_other_in, clf_threshold, max_look_ahead)
+
+    @numba.njit(cache=True, error_model='numpy')
+    def _tally_votes_numba(gt, acc_low, acc_high, acc_draws, vote_draws):
+        in_votes = np.zeros(gt.shape[0], dtype=np.int64)
+        for i in range(acc_draws.shape[0]):
+            for k in range(acc_draws.shape[1]):
+                worker_acc = acc_low + acc_draws[i, k] * (acc_high - acc_low)
+                prob_vote_in = worker_acc if gt[i] == 1 else 1 - worker_acc
+                if vote_draws[i, k] < prob_vote_in:
+                    in_votes[i] += 1
+        return in_votes
+
+    def tally_votes_numba(gt, acc_low, acc_high, acc_draws, vote_draws):
+        return _tally_votes_numba(np.asarray(gt), acc_low, acc_high, acc_draws, vote_draws)
+
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+if NUMBA_AVAILABLE and os.environ.get('SCREENING_KERNELS', 'numba') != 'numpy':
+    BACKEND = 'numba'
+    posterior_in, look_ahead_scores, tally_votes = posterior_in_numba, look_ahead_scores_numba, tally_votes_numba
+else:
+    BACKEND = 'numpy'
+    posterior_in, look_ahead_scores, tally_votes = posterior_in_numpy, look_ahead_scores_numpy, tally_votes_numpy
+
+
+def _random_inputs(items_num, predicates_num, seed=0):
+    rng = np.random.RandomState(seed)
+    in_c = rng.randint(0, 8, (items_num, predicates_num))
+    out_c = rng.randint(0, 8, (items_num, predicates_num))
+    acc = rng.uniform(0.6, 0.95, predicates_num)
+    prior_in = rng.uniform(0.01, 0.99, (items_num, predicates_num))
+    selectivity = rng.uniform(0.1, 0.9, predicates_num)
+    prob_other_in = rng.uniform(0., 1., (items_num, predicates_num))
+    return in_c, out_c, acc, prior_in, selectivity, prob_other_in
+
+
+def check_equivalence(items_num=10000, predicates_num=3):
+    '''
+    :return: max abs difference between NumPy and Numba backends per kernel
+    '''
+    in_c, out_c, acc, prior_in, selectivity, prob_other_in = _random_inputs(items_num, predicates_num)
+    gt = np.random.RandomState(1).randint(0, 2, items_num)
+    acc_draws, vote_draws = np.random.RandomState(2).random_sample((2, items_num, 5))
+    return {
+        'posterior_in': np.abs(posterior_in_numpy(in_c, out_c, acc, prior_in, selectivity)
+                               - posterior_in_numba(in_c, out_c, acc, prior_in, selectivity)).max(),
+        'look_ahead_scores': np.abs(look_ahead_scores_numpy(in_c, out_c, acc, prior_in, prob_other_in, 0.99)
+                                    - look_ahead_scores_numba(in_c, out_c, acc, prior_in, prob_other_in, 0.99)).max(),
+        'tally_votes': np.abs(tally_votes_numpy(gt, 0.6, 0.9, acc_draws, vote_draws)
+                              - tally_votes_numba(gt, 0.6, 0.9, acc_draws, vote_draws)).max()
+    }
+
+
+def benchmark(items_num=100000, predicates_num=2, repeat=5):
+    in_c, out_c, acc, prior_in, selectivity, prob_other_in = _random_inputs(items_num, predicates_num)
+    gt = np.random.RandomState(1).randint(0, 2, items_num)
+    acc_draws, vote_draws = np.random.RandomState(2).random_sample((2, items_num, 3))
+    backends = {'numpy': (posterior_in_numpy, look_ahead_scores_numpy, tally_votes_numpy)}
+    if NUMBA_AVAILABLE:
+        backends['numba'] = (posterior_in_numba, look_ahead_scores_numba, tally_votes_numba)
+    for name, (posterior, look_ahead, tally) in backends.items():
+        calls = {
+            'posterior_in': lambda: posterior(in_c, out_c, acc, prior_in, selectivity),
+            'look_ahead_scores': lambda: look_ahead(in_c, out_c, acc, prior_in, prob_other_in, 0.99),
+            'tally_votes': lambda: tally(gt, 0.6, 0.9, acc_draws, vote_draws)
+        }
+        for kernel, call in calls.items():
+            call()  # compile / warm up
+            start = time.perf_counter()
+            for _ in range(repeat):
+                call()
+            print('{:6s} {:18s} {:8.2f} ms'.format(name, kernel, (time.perf_counter() - start) / repeat * 1000))
+
+
+if __name__ == '__main__':
+    print('selected backend: {}'.format(BACKEND))
+    if NUMBA_AVAILABLE:
+        print('max abs difference numpy vs numba: {}'.format(check_equivalence()))
+    benchmark()
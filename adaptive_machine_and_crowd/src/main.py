@@ -5,16 +5,26 @@ path_to_project = os.path.realpath('main.py')[:-38]
 sys.path.append(path_to_project)
 
 from modAL.uncertainty import uncertainty_sampling
-from adaptive_machine_and_crowd.src.utils import random_sampling, objective_aware_sampling
+from adaptive_machine_and_crowd.src.utils import random_sampling, objective_aware_sampling, CrowdSimulator
+from adaptive_machine_and_crowd.src.vote_tape import VoteTape
 
+from adaptive_machine_and_crowd.src.datasets import DATASETS, get_dataset_config, get_crowd
 from adaptive_machine_and_crowd.src.experiment_handler import run_experiment
+from adaptive_machine_and_crowd.src.switch_point_search import run_switch_point_search
 import numpy as np
 
 '''
     Parameters for active learners:
     'n_instances_query': num of instances for labeling for 1 query,
+    'batch_schedule': schedule of the number of instances per query (see batch_schedules.py),
+                      None for n_instances_query every query,
     'size_init_train_data': initial size of training dataset,
-    'sampling_strategies': list of active learning sampling strategies
+    'al_staleness': None for the serial AL loop, N to refit learners in the background while the crowd labels
+                    the next query, queries use a model at most N label batches behind (see pipelined_al.py),
+    'sampling_strategies': list of active learning sampling strategies,
+    'alpha_grid': regularization values to tune the SGD learners over on their labelled set (see tuning.py),
+                  None for the sklearn default alpha,
+    'tune_every': tune a learner before every tune_every-th fit of it
     
     Classification parameters:
     'screening_out_threshold': threshold to classify a document OUT,
@@ -22,71 +32,61 @@ import numpy as np
     'lr': loss ration for the screening loss
     
     Experiment parameters:
-    'experiment_nums': reputation number of the whole experiment,
+    'experiment_nums': reputation number of the whole experiment (max number if 'ci_width' is set),
+    'ci_width': stop repetitions of a grid cell once the confidence intervals of loss and F_beta are narrower,
+    'min_experiment_nums': min number of repetitions of a grid cell if 'ci_width' is set,
     'dataset_file_name ': file name of dataset,
+    'dedup_threshold': screen one representative per cluster of near-duplicate documents with at least this
+                       estimated Jaccard similarity of token shingles (see dedup.py), None to screen every document,
     'predicates': predicates will be used in experiment,
     'B': budget available for classification,
-    'B_al_prop': proportion of B for training machines (AL-Box)
+    'B_al_prop': proportion of B for training machines (AL-Box),
+    'search_mode': 'grid' sweeps policy_switch_point, 'golden' searches the best switch point per budget,
+    'search_metric': 'loss' or 'f_beta' to optimize in the 'golden' search mode,
+    'search_tol': width of the switch point interval to stop the search at,
+    'search_reps_init', 'search_reps_max': repetitions per evaluated switch point,
+    'fork_al': run the AL-Box once per repetition and fork the Crowd-Box for every (budget, switch point) cell,
+    'snapshot_path': directory to save snapshots of the trained learners to (see snapshot.py), None to skip
+    'posteriors_path': directory to save per item final posteriors and decision provenance of every trial to
+                       (see posteriors.py for threshold sweeps over them), None to skip
+    'seed': seed of the first repetition, repetition i is seeded with seed + i, None for unseeded runs,
+    'al_cache_path': directory of the AL-Box outcomes cache (see al_cache.py), used for seeded runs only, None to skip
+    'memory_report_path': directory to write peak RSS and top allocators per experiment phase and repetition to
+                          (see memory.py), None to skip
+    
+    Execution parameters:
+    'n_jobs': number of threads to fit the initial predicate learners concurrently (1 - sequential), learners are
+              scored by the fused scorer (see scoring.py), non-linear learners are scored on the threads too;
+              learners of seeded runs have a random_state per predicate, so seeded runs do not depend on n_jobs,
+    'crowd_box_workers': number of processes SM-Run rounds are sharded across (see sm_run/sharded.py),
+                         1 - in process, used with simulated crowds only,
+    'shared_data': handle of a SharedDataset (see shared_data.py) to attach to instead of loading the dataset
 '''
 
 
 if __name__ == '__main__':
-    # datasets = 'amazon', 'ohusmed', 'slr', 'amazon_binary', 'ohusmed_binary', 'slr_binary'
+    # datasets = 'amazon', 'ohusmed', 'slr', 'amazon_binary', 'ohusmed_binary', 'slr_binary', 'crisis', 'crisis_binary',
+    #            'amazon_crowdsourced_min3votes', 'amazon_crowdsourced_min5votes'
     dataset = 'crisis_binary'
-    if dataset == 'amazon':
-        # AMAZON DATASET
-        predicates = ['is_negative', 'is_book']
-        dataset_file_name = '5000_reviews_lemmatized.csv'
-        dataset_size = 5000
-        crowd_acc = {predicates[0]: [0.94, 0.94], predicates[1]: [0.94, 0.94]}
-    elif dataset == 'ohusmed':
-        # OHUSMED DATASET
-        dataset_file_name = 'ohsumed_C14_C23_1grams.csv'
-        predicates = ['C14', 'C23']
-        dataset_size = 34387
-        crowd_acc = {predicates[0]: [0.6, 1.], predicates[1]: [0.6, 1.]}
-    elif dataset == 'slr':
-        # LONELINESS SLR DATASET
-        predicates = ['oa_predicate', 'study_predicate']
-        dataset_file_name = 'loneliness-dataset-2018.csv'
-        dataset_size = 825
-        crowd_acc = {predicates[0]: [0.8, 0.8], predicates[1]: [0.6, 0.6]}
-    elif dataset == 'amazon_binary':
-        # AMAZON BINARY DATASET
-        predicates = ['Y']
-        dataset_file_name = '5000_reviews_lemmatized.csv'
-        dataset_size = 5000
-        crowd_acc = {predicates[0]: [0.94, 0.94]}
-    elif dataset == 'slr_binary':
-        # LONELINESS BINARY SLR DATASET
-        predicates = ['Y']
-        dataset_file_name = 'loneliness-dataset-2018.csv'
-        dataset_size = 825
-        crowd_acc = {predicates[0]: [0.75, 0.75]}
-    elif dataset == 'ohusmed_binary':
-        # OHUSMED BINARY DATASET
-        dataset_file_name = 'ohsumed_C14_C23_1grams.csv'
-        predicates = ['Y']
-        dataset_size = 34387
-        crowd_acc = {predicates[0]: [0.6, 1.]}
-    elif dataset == 'crisis':
-        # CRISIS DATASET
-        dataset_file_name = 'crisis-lemmatized_witness_inf.csv'
-        predicates = ['eye_witness', 'informative']
-        dataset_size = 1943
-        crowd_acc = {predicates[0]: [0.87, 0.87], predicates[1]: [0.85, 0.85]}
-    elif dataset == 'crisis_binary':
-        # CRISIS DATASET
-        dataset_file_name = 'crisis-lemmatized_witness_inf.csv'
-        predicates = ['Y']
-        dataset_size = 1943
-        crowd_acc = {predicates[0]: [0.927, 0.927]}
-    else:
+    if dataset not in DATASETS:
         exit(1)
+    dataset_config = get_dataset_config(dataset)
+    predicates = dataset_config['predicates']
+    dataset_file_name = dataset_config['dataset_file_name']
+    dataset_size = dataset_config['dataset_size']
+    crowd_acc = dataset_config['crowd_acc']
+    crowd = get_crowd(dataset_config, path_to_project)  # replays real votes for crowdsourced datasets
+    vote_tape_seed = None  # e.g. 0 to simulate votes from tapes shared by all configurations of a repetition
+    if vote_tape_seed is not None and crowd is CrowdSimulator:
+        crowd = VoteTape(dataset_size, predicates, crowd_acc, seed=vote_tape_seed)
 
     # Parameters for active learners
     n_instances_query = 100
     size_init_train_data = 20
+    batch_schedule = None  # e.g. {'name': 'geometric', 'initial': 10, 'growth': 1.5}
+    al_staleness = None  # e.g. 1 to overlap retraining with crowd labelling
+    alpha_grid = None  # e.g. np.logspace(-6, -2, 5)
+    tune_every = 5
 
     # Classification parameters
     screening_out_threshold = 0.99  # for SM-Run and ML
@@ -96,30 +96,67 @@ if __name__ == '__main__':
 
     # Experiment parameters
     experiment_nums = 10
+    ci_width = None  # e.g. 0.02 for sequential stopping of repetitions
+    min_experiment_nums = 3
     policy_switch_point = np.arange(0., 1.01, 0.1)
     budget_per_item = np.arange(1, 9, 1)  # number of votes per item we can spend per item on average
     crowd_votes_per_item_al = 3  # for Active Learning annotation
+    dedup_threshold = None  # e.g. 0.8 to collapse near-duplicate documents
+    search_mode = 'grid'  # 'grid' or 'golden'
+    fork_al = False  # share the AL-Box trajectory across the grid cells of a repetition
+    snapshot_path = None  # e.g. path_to_project + 'adaptive_machine_and_crowd/snapshots/'
+    posteriors_path = None  # e.g. path_to_project + 'adaptive_machine_and_crowd/output/posteriors/'
+    seed = None
+    al_cache_path = None  # e.g. path_to_project + 'adaptive_machine_and_crowd/al_cache/'
+    memory_report_path = None  # e.g. path_to_project + 'adaptive_machine_and_crowd/output/memory/'
+
+    # Execution parameters
+    n_jobs = 1
+    crowd_box_workers = 1
 
     for sampling_strategy in [random_sampling, uncertainty_sampling]:
         print('{} is Running!'.format(sampling_strategy.__name__))
         params = {
             'dataset_file_name': dataset_file_name,
             'n_instances_query': n_instances_query,
+            'batch_schedule': batch_schedule,
+            'al_staleness': al_staleness,
+            'alpha_grid': alpha_grid,
+            'tune_every': tune_every,
             'size_init_train_data': size_init_train_data,
             'screening_out_threshold': screening_out_threshold,
             'beta': beta,
             'lr': lr,
             'experiment_nums': experiment_nums,
+            'ci_width': ci_width,
+            'min_experiment_nums': min_experiment_nums,
             'predicates': predicates,
             'sampling_strategy': sampling_strategy,
             'crowd_acc': crowd_acc,
+            'crowd': crowd,
             'crowd_votes_per_item_al': crowd_votes_per_item_al,
             'policy_switch_point': policy_switch_point,
             'budget_per_item': budget_per_item,
             'stop_score': stop_score,
             'dataset_size': dataset_size,
-            'path_to_project' : path_to_project
+            'dedup_threshold': dedup_threshold,
+            'path_to_project' : path_to_project,
+            'n_jobs': n_jobs,
+            'crowd_box_workers': crowd_box_workers,
+            'fork_al': fork_al,
+            'snapshot_path': snapshot_path,
+            'posteriors_path': posteriors_path,
+            'seed': seed,
+            'al_cache_path': al_cache_path,
+            'memory_report_path': memory_report_path,
+            'search_metric': 'loss',
+            'search_tol': 0.05,
+            'search_reps_init': 3,
+            'search_reps_max': experiment_nums
         }
 
-        run_experiment(params)
+        if search_mode == 'golden':
+            run_switch_point_search(params)
+        else:
+            run_experiment(params)
         print('{} is Done!'.format(sampling_strategy.__name__))
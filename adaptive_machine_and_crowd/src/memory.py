@@ -0,0 +1,123 @@
+import gc
+import os
+import sys
+import weakref
+import tracemalloc
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+'''
+    Opt-in memory accounting of experiments, enabled by params['memory_report_path'].
+    A phase record is taken at every phase boundary: load, featurize, al_iteration, prior, sm_run, metrics.
+    It holds the current and peak RSS of the process, and current and peak memory traced by tracemalloc since the
+    previous record. Top allocators (source lines) are kept for the records that raise the traced peak to a new
+    high, the allocations behind the growth, so per-iteration records stay cheap.
+    Objects of a trial (the ScreeningActiveLearner, AL-Box outcomes, SM-Run) are watched through weak references:
+    end_repetition() reports those still alive after the trial, e.g. kept by params of the grid loops, and the RSS
+    growth since the first repetition. The report is written as csv files next to the results.
+'''
+
+
+def rss_mb():
+    '''
+    :return: current resident set size in MB, None if /proc is not available
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        return None
+
+
+def peak_rss_mb():
+    '''
+    :return: peak resident set size of the process in MB, None if resource is not available
+    '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def mark_phase(params, phase, **info):
+    tracker = params.get('memory_tracker')
+    if tracker is not None:
+        tracker.phase(phase, **info)
+
+
+def watch(params, obj, label):
+    tracker = params.get('memory_tracker')
+    if tracker is not None:
+        tracker.watch(obj, label)
+
+
+class MemoryTracker:
+
+    def __init__(self, top_allocators=5, trace_frames=1, growth_warn_mb=50.):
+        '''
+        :param top_allocators: number of source lines kept per new traced peak, 0 to skip snapshots
+        :param trace_frames: frames stored per traced allocation, more frames cost more memory and time
+        :param growth_warn_mb: print a warning once RSS after a repetition grows by more than this since the first one
+        '''
+        self.top_allocators = top_allocators
+        self.growth_warn_mb = growth_warn_mb
+        self.records = []
+        self.allocators = []
+        self.repetitions = []
+        self.watched = []
+        self.traced_high = 0
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(trace_frames)
+
+    def phase(self, phase, **info):
+        traced, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        record = dict(info, phase=phase, rss_mb=rss_mb(), peak_rss_mb=peak_rss_mb(),
+                      traced_mb=traced / 2 ** 20, traced_peak_mb=traced_peak / 2 ** 20)
+        self.records.append(record)
+        if self.top_allocators and traced_peak > self.traced_high:
+            self.traced_high = traced_peak
+            for stat in tracemalloc.take_snapshot().statistics('lineno')[:self.top_allocators]:
+                self.allocators.append(dict(info, phase=phase, record=len(self.records) - 1,
+                                            allocator=str(stat.traceback), size_mb=stat.size / 2 ** 20,
+                                            count=stat.count))
+
+    def watch(self, obj, label):
+        # obj is expected to be released by the end of the repetition
+        self.watched.append((weakref.ref(obj), label))
+
+    def end_repetition(self, experiment_id):
+        '''
+        :return: labels of the watched objects still alive
+        '''
+        gc.collect()
+        alive = [label for ref, label in self.watched if ref() is not None]
+        self.watched = []
+        rss = rss_mb()
+        growth = rss - self.repetitions[0]['rss_mb'] if self.repetitions and rss is not None else 0.
+        self.repetitions.append({'experiment_id': experiment_id, 'rss_mb': rss, 'peak_rss_mb': peak_rss_mb(),
+                                 'traced_mb': tracemalloc.get_traced_memory()[0] / 2 ** 20,
+                                 'growth_mb': growth, 'alive': ';'.join(alive)})
+        if alive:
+            print('memory: still referenced after experiment_id {}: {}'.format(experiment_id, ', '.join(alive)))
+        if growth > self.growth_warn_mb:
+            print('memory: RSS grew by {:.1f} MB since the first repetition'.format(growth))
+
+        return alive
+
+    def save(self, file_name):
+        '''
+        :param file_name: prefix of the csv files of phase records, top allocators and repetitions
+        '''
+        os.makedirs(os.path.dirname(file_name) or '.', exist_ok=True)
+        pd.DataFrame(self.records).to_csv(file_name + '_phases.csv', index=False)
+        pd.DataFrame(self.allocators).to_csv(file_name + '_allocators.csv', index=False)
+        pd.DataFrame(self.repetitions).to_csv(file_name + '_repetitions.csv', index=False)
+
+    def stop(self):
+        tracemalloc.stop()
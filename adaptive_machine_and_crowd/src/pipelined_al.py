@@ -0,0 +1,111 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from sklearn.base import clone
+
+from adaptive_machine_and_crowd.src.utils import CrowdSimulator
+
+'''
+    Pipelined AL-Box: predicate learners are refitted in a background thread while the crowd labels the
+    next query. Queries are issued from the last fitted model, which is at most `staleness` label batches
+    behind the labelled data, refits start once the next query is issued. Queried items leave the pool at
+    query time, so they are never issued twice.
+    Used by run_al_box if params['al_staleness'] is set.
+'''
+
+
+class BackgroundTrainer:
+
+    def __init__(self, SAL, staleness=1):
+        '''
+        :param SAL: ScreeningActiveLearner whose learners are refitted
+        :param staleness: max number of label batches the model used for a query may be behind
+        '''
+        self.SAL = SAL
+        self.staleness = staleness
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.lock = threading.Lock()
+        self.data_version = {pr: 0 for pr in SAL.predicates}
+        self.model_version = {pr: 0 for pr in SAL.predicates}
+        self.pending = {pr: [] for pr in SAL.predicates}
+        self.deferred = []
+        self.fits_num = 0
+
+    def add_labels(self, predicate, X, y):
+        # extend the training data right away, the refit is submitted by start()
+        l = self.SAL.learners[predicate]
+        if getattr(self.SAL, 'prequential', None) is not None:
+            self.SAL.score_prequential(predicate, X, y)
+        l.training.append(X, y)
+        l.training.shuffle()
+        # fresh arrays, the fit runs in the background after the next append
+        X_training, y_training = l.training.ordered(copy=True)
+        l.learner.X_training, l.learner.y_training = X_training, y_training
+        self.data_version[predicate] += 1
+        self.deferred.append((predicate, X_training, y_training, self.data_version[predicate]))
+
+    def start(self):
+        # called once the next query is issued, so that refits do not compete with the query for CPU
+        for predicate, X_training, y_training, version in self.deferred:
+            self.pending[predicate].append(self.executor.submit(self._fit, predicate, X_training, y_training, version))
+        self.deferred = []
+
+    def _fit(self, predicate, X, y, version):
+        if version < self.data_version[predicate]:
+            return  # newer labels are queued, their fit supersedes this one
+        l = self.SAL.learners[predicate]
+        learner = l.learner
+        # a fresh estimator is fitted and swapped in, queries keep using the previous one meanwhile
+        estimator = clone(learner.estimator)
+        if l.tuner is not None:
+            l.tuner.before_fit(estimator, X, y)
+        estimator.fit(X, y)
+        with self.lock:
+            if version > self.model_version[predicate]:
+                learner.estimator = estimator
+                self.model_version[predicate] = version
+                self.fits_num += 1
+
+    def wait(self, predicate, staleness=None):
+        # block until the model of the predicate is at most `staleness` label batches behind
+        staleness = self.staleness if staleness is None else staleness
+        if self.data_version[predicate] - self.model_version[predicate] > staleness:
+            self.start()
+        for future in self.pending[predicate]:
+            if self.data_version[predicate] - self.model_version[predicate] <= staleness:
+                break
+            future.result()
+        self.pending[predicate] = [future for future in self.pending[predicate] if not future.done()]
+
+    def drain(self):
+        for pr in self.SAL.predicates:
+            self.wait(pr, 0)
+
+    def shutdown(self):
+        self.drain()
+        self.executor.shutdown()
+
+
+class LatencyCrowd:
+    '''
+    Crowd backend wrapper that simulates the time workers take to return votes
+    '''
+
+    def __init__(self, crowd=CrowdSimulator, seconds_per_batch=1., seconds_per_vote=0.):
+        self.crowd = crowd
+        self.seconds_per_batch = seconds_per_batch
+        self.seconds_per_vote = seconds_per_vote
+
+    def shuffle(self):
+        if hasattr(self.crowd, 'shuffle'):
+            self.crowd.shuffle()
+
+    def __getattr__(self, name):
+        # exhaustion of real votes is reported by the wrapped backend
+        if name == 'votes_left':
+            return getattr(self.crowd, name)
+        raise AttributeError(name)
+
+    def crowdsource_items(self, item_ids, gt_items, predicate, crowd_acc, n, crowd_votes_counts):
+        time.sleep(self.seconds_per_batch + self.seconds_per_vote * len(item_ids) * n)
+        return self.crowd.crowdsource_items(item_ids, gt_items, predicate, crowd_acc, n, crowd_votes_counts)
@@ -1,7 +1,11 @@
 class PointSwitchPolicy:
 
-    def __init__(self, B, switch_point):
+    def __init__(self, B, switch_point, query_cost=300):
+        '''
+        :param query_cost: cost of the smallest AL query, AL stops once the AL budget left is at most query_cost
+        '''
         self.B = B
+        self.query_cost = query_cost
         self.B_al = round(self.B * switch_point)
         self.B_crowd = self.B - self.B_al
         self.B_al_spent = 0
@@ -15,8 +19,7 @@ class PointSwitchPolicy:
 
     @property
     def is_continue_al(self):
-        # Hot Fix: To do
-        if self.B_al_spent + 300 >= self.B_al:
+        if self.B_al_spent + self.query_cost >= self.B_al:
             return False
         else:
             return True
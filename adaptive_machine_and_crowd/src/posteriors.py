@@ -0,0 +1,170 @@
+import os
+import glob
+import argparse
+import numpy as np
+import pandas as pd
+
+from adaptive_machine_and_crowd.src.kernels import posterior_in
+
+'''
+    Per item final posteriors and decision provenance of a trial, saved as a compressed npz if
+    params['posteriors_path'] is set, and a vectorized evaluator of screening metrics over threshold grids.
+    Saved arrays per item:
+        gt: screening ground truth, label: final label
+        provenance: index in PROVENANCE, who decided the final label
+        crowd_proba_in: P(item IN) from machine priors (or selectivity) and all crowd votes, as in SM-Run
+        machine_proba_in: P(item IN) from machines, nan without the AL-Box
+        votes: number of crowd votes on the item
+    Sweeps re-decide crowd and machine items with other thresholds on the stored posteriors, items are
+    not re-crowdsourced, so a threshold changes the decisions but not which votes were collected.
+
+        python -m adaptive_machine_and_crowd.src.posteriors "output/posteriors/*.npz" --lr 5 --beta 1
+'''
+
+# 'default': label of the AL-Box or IN by default, the item was not decided by the Crowd-Box or machines
+PROVENANCE = ['default', 'crowd', 'machine']
+
+
+def crowd_posterior_in(crowd_votes_counts, item_ids, predicates, accuracy, selectivity, prior_prob=None):
+    '''
+    :return: P(item IN) per item, the conjunction of SM-Run posteriors of predicates
+    '''
+    in_c = np.array([[crowd_votes_counts[item_id][pr]['in'] for pr in predicates] for item_id in item_ids])
+    out_c = np.array([[crowd_votes_counts[item_id][pr]['out'] for pr in predicates] for item_id in item_ids])
+    acc = np.array([accuracy[pr] for pr in predicates], dtype=float)
+    sel = np.array([selectivity[pr] for pr in predicates], dtype=float)
+    if prior_prob:
+        prior_in = np.array([[prior_prob[item_id][pr]['in'] for pr in predicates] for item_id in item_ids], dtype=float)
+    else:
+        prior_in = np.broadcast_to(sel, in_c.shape).copy()
+    votes = (in_c + out_c).sum(axis=1)
+
+    return posterior_in(in_c, out_c, acc, prior_in, sel).prod(axis=1), votes
+
+
+def save_posteriors(file_name, gt, item_labels, provenance, crowd_proba_in, machine_proba_in, votes, meta):
+    '''
+    :param item_labels: dict item_id -> final label
+    :param provenance: dict item_id -> name in PROVENANCE, 'default' for missing items
+    :param meta: dict of scalars kept with the arrays (thresholds, lr, beta, budget, ...)
+    '''
+    items_num = len(gt)
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+    np.savez_compressed(
+        file_name,
+        gt=np.asarray(gt, dtype=np.uint8),
+        label=np.array([item_labels[item_id] for item_id in range(items_num)], dtype=np.uint8),
+        provenance=np.array([PROVENANCE.index(provenance.get(item_id, 'default')) for item_id in range(items_num)],
+                            dtype=np.uint8),
+        crowd_proba_in=np.asarray(crowd_proba_in, dtype=np.float32),
+        machine_proba_in=np.asarray(machine_proba_in if machine_proba_in is not None else np.full(items_num, np.nan),
+                                    dtype=np.float32),
+        votes=np.asarray(votes, dtype=np.uint16),
+        **{'meta_' + key: np.asarray(value) for key, value in meta.items()}
+    )
+
+
+def _counts_by_threshold(gt, proba_in, thresholds):
+    '''
+    Items are OUT if 1 - proba_in > threshold, counts for all thresholds from one sort of the items
+    :return: tp, fp, fn, tn arrays [thresholds]
+    '''
+    order = np.argsort(proba_in)
+    proba_sorted, gt_sorted = proba_in[order], gt[order]
+    pos_below = np.concatenate([[0], np.cumsum(gt_sorted)])  # positives among the i lowest scored items
+    pos_num, items_num = gt_sorted.sum(), len(gt_sorted)
+    # number of items classified OUT: proba_in < 1 - threshold
+    out_num = np.searchsorted(proba_sorted, 1 - np.asarray(thresholds, dtype=float), side='left')
+    fn = pos_below[out_num]
+    tp = pos_num - fn
+    fp = (items_num - out_num) - tp
+    tn = out_num - fn
+
+    return tp, fp, fn, tn
+
+
+def _metrics(tp, fp, fn, items_num, lr, beta):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        precision = np.nan_to_num(tp / (tp + fp))
+        recall = np.nan_to_num(tp / (tp + fn))
+        f_beta = np.nan_to_num((beta ** 2 + 1) * precision * recall / (recall + beta ** 2 * precision))
+    loss = (fn * lr + fp) / items_num
+
+    return precision, recall, f_beta, loss
+
+
+def threshold_sweep(gt, proba_in, thresholds, lr, beta):
+    '''
+    :return: DataFrame of precision, recall, f_beta, loss per screening out threshold
+    '''
+    gt = np.asarray(gt, dtype=np.int64)
+    tp, fp, fn, tn = _counts_by_threshold(gt, np.asarray(proba_in, dtype=float), thresholds)
+    precision, recall, f_beta, loss = _metrics(tp, fp, fn, len(gt), lr, beta)
+
+    return pd.DataFrame({'threshold': thresholds, 'precision': precision, 'recall': recall,
+                         'f_beta': f_beta, 'loss': loss, 'fn_count': fn, 'fp_count': fp})
+
+
+def sweep_trial(data, crowd_thresholds, machine_thresholds, lr, beta):
+    '''
+    Metrics of a saved trial over the grid of crowd (SM-Run) and machine thresholds,
+    items keep their provenance, default items keep their label
+    :param data: loaded npz of save_posteriors
+    :return: DataFrame with a row per (crowd_threshold, machine_threshold)
+    '''
+    gt, provenance = data['gt'].astype(np.int64), data['provenance']
+    counts = np.zeros((4, len(crowd_thresholds), len(machine_thresholds)))
+    for name, proba_in, thresholds, axis in [('crowd', data['crowd_proba_in'], crowd_thresholds, 1),
+                                             ('machine', data['machine_proba_in'], machine_thresholds, 0)]:
+        mask = provenance == PROVENANCE.index(name)
+        group_counts = np.array(_counts_by_threshold(gt[mask], proba_in[mask].astype(float), thresholds))
+        counts += np.expand_dims(group_counts, axis + 1)
+    default = provenance == PROVENANCE.index('default')
+    label, gt_default = data['label'][default], gt[default]
+    counts += np.array([(label & gt_default).sum(), (label & ~gt_default.astype(bool)).sum(),
+                        (~label.astype(bool) & gt_default.astype(bool)).sum(), 0])[:, None, None]
+    tp, fp, fn = counts[0], counts[1], counts[2]
+    precision, recall, f_beta, loss = _metrics(tp, fp, fn, len(gt), lr, beta)
+    crowd_grid, machine_grid = np.meshgrid(crowd_thresholds, machine_thresholds, indexing='ij')
+
+    return pd.DataFrame({'crowd_threshold': crowd_grid.ravel(), 'machine_threshold': machine_grid.ravel(),
+                         'precision': precision.ravel(), 'recall': recall.ravel(), 'f_beta': f_beta.ravel(),
+                         'loss': loss.ravel(), 'fn_count': fn.ravel(), 'fp_count': fp.ravel()})
+
+
+def sweep_files(pattern, crowd_thresholds, machine_thresholds, lr, beta):
+    '''
+    :return: mean metrics over the repetitions of every (budget_per_item, switch_point, thresholds) combination
+    '''
+    dfs = []
+    for file_name in sorted(glob.glob(pattern)):
+        with np.load(file_name) as data:
+            df = sweep_trial(data, crowd_thresholds, machine_thresholds, lr, beta)
+            df['budget_per_item'] = float(data['meta_budget_per_item'])
+            df['AL_switch_point'] = float(data['meta_switch_point'])
+        dfs.append(df)
+    df = pd.concat(dfs, ignore_index=True)
+    keys = ['budget_per_item', 'AL_switch_point', 'crowd_threshold', 'machine_threshold']
+
+    return df.groupby(keys).mean().reset_index()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='screening metrics over threshold grids from saved posteriors')
+    parser.add_argument('pattern', help='glob of npz files saved with params["posteriors_path"]')
+    parser.add_argument('--lr', type=float, default=5)
+    parser.add_argument('--beta', type=float, default=1)
+    parser.add_argument('--output', default=None, help='csv file for the full grid')
+    args = parser.parse_args(argv)
+
+    crowd_thresholds = np.round(np.arange(0.5, 1., 0.01), 2)
+    machine_thresholds = np.round(np.arange(0.05, 1., 0.05), 2)
+    df = sweep_files(args.pattern, crowd_thresholds, machine_thresholds, args.lr, args.beta)
+    if args.output:
+        df.to_csv(args.output, index=False)
+    best = df.loc[df.groupby(['budget_per_item', 'AL_switch_point'])['loss'].idxmin()]
+    print(best.to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
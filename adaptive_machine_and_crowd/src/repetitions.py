@@ -0,0 +1,62 @@
+import numpy as np
+from scipy import stats
+
+
+class RunningStat:
+    '''
+    Online mean and variance (Welford's algorithm)
+    '''
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.
+        self.m2 = 0.
+
+    def add(self, value):
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+
+    @property
+    def var(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else np.inf
+
+
+class RepetitionController:
+    '''
+    Sequential stopping of repetitions of a grid cell: keeps online mean/variance of loss and F_beta
+    and stops once the confidence interval of every metric is narrower than ci_width, or at max_reps
+    '''
+    # position of the metric in a results row of run_trial
+    metric_columns = {'f_beta': 4, 'loss': 5}
+
+    def __init__(self, ci_width, min_reps=3, max_reps=10, confidence=0.95, metrics=('loss', 'f_beta')):
+        self.ci_width = ci_width
+        self.min_reps = min_reps
+        self.max_reps = max_reps
+        self.confidence = confidence
+        self.stats = {metric: RunningStat() for metric in metrics}
+
+    @property
+    def reps_used(self):
+        return next(iter(self.stats.values())).n
+
+    def add(self, row):
+        for metric, stat in self.stats.items():
+            stat.add(row[self.metric_columns[metric]])
+
+    def ci_width_of(self, metric):
+        stat = self.stats[metric]
+        if stat.n < 2:
+            return np.inf
+        t = stats.t.ppf(1 - (1 - self.confidence) / 2, stat.n - 1)
+        return 2 * t * np.sqrt(stat.var / stat.n)
+
+    @property
+    def is_continue(self):
+        if self.reps_used < self.min_reps:
+            return True
+        if self.reps_used >= self.max_reps:
+            return False
+        return any(self.ci_width_of(metric) > self.ci_width for metric in self.stats)
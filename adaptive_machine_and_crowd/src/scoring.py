@@ -0,0 +1,105 @@
+import numpy as np
+
+'''
+    Fused scoring of calibrated linear predicate learners.
+    The coefficient vectors of every predicate and calibration fold are stacked into one matrix, so the margins
+    of all of them are one matrix multiply per chunk of items, sigmoid calibration, the average over folds and
+    the conjunctive product over predicates are vectorized. Probabilities equal CalibratedClassifierCV.predict_proba
+    of the learners up to float rounding.
+'''
+
+
+def calibrated_folds(clf):
+    '''
+    :param clf: fitted CalibratedClassifierCV over a linear classifier with sigmoid calibration
+    :return: coef [folds, features], intercept [folds], a [folds], b [folds]
+    '''
+    if not hasattr(clf, 'calibrated_classifiers_'):
+        raise ValueError('Only fitted CalibratedClassifierCV learners can be fused')
+    coef, intercept, calib_a, calib_b = [], [], [], []
+    for calibrated in clf.calibrated_classifiers_:
+        # attribute names differ between sklearn versions
+        estimator = calibrated.estimator if hasattr(calibrated, 'estimator') else calibrated.base_estimator
+        calibrators = calibrated.calibrators if hasattr(calibrated, 'calibrators') else calibrated.calibrators_
+        if len(calibrators) != 1 or not hasattr(calibrators[0], 'a_') or not hasattr(estimator, 'coef_'):
+            raise ValueError('Only binary linear classifiers with sigmoid calibration can be fused')
+        coef.append(np.ravel(estimator.coef_))
+        intercept.append(np.ravel(estimator.intercept_)[0])
+        calib_a.append(calibrators[0].a_)
+        calib_b.append(calibrators[0].b_)
+
+    return np.array(coef), np.array(intercept), np.array(calib_a), np.array(calib_b)
+
+
+class FusedLinearScorer:
+
+    def __init__(self, learners, chunk_size=4096):
+        '''
+        :param learners: dict predicate -> dict of 'coef' [folds, features], 'intercept', 'calib_a', 'calib_b' [folds]
+        :param chunk_size: number of items scored per matrix multiply, bounds the margins buffer
+        '''
+        self.predicates = list(learners.keys())
+        self.chunk_size = chunk_size
+        self.folds_num = np.array([len(learners[pr]['intercept']) for pr in self.predicates])
+        self.offsets = np.concatenate([[0], np.cumsum(self.folds_num)])
+        self.coef = np.concatenate([learners[pr]['coef'] for pr in self.predicates])
+        self.intercept = np.concatenate([learners[pr]['intercept'] for pr in self.predicates])
+        self.calib_a = np.concatenate([learners[pr]['calib_a'] for pr in self.predicates])
+        self.calib_b = np.concatenate([learners[pr]['calib_b'] for pr in self.predicates])
+
+    @classmethod
+    def from_estimators(cls, estimators, chunk_size=4096):
+        '''
+        :param estimators: dict predicate -> fitted CalibratedClassifierCV
+        '''
+        learners = {}
+        for pr, clf in estimators.items():
+            learners[pr] = dict(zip(['coef', 'intercept', 'calib_a', 'calib_b'], calibrated_folds(clf)))
+
+        return cls(learners, chunk_size)
+
+    def _folds(self, predicates):
+        # rows of the stacked arrays for a subset of predicates
+        if predicates is None or list(predicates) == self.predicates:
+            return self.coef, self.intercept, self.calib_a, self.calib_b, self.offsets[:-1], self.folds_num
+        pr_idx = [self.predicates.index(pr) for pr in predicates]
+        rows = np.concatenate([np.arange(self.offsets[i], self.offsets[i + 1]) for i in pr_idx])
+        folds_num = self.folds_num[pr_idx]
+
+        return self.coef[rows], self.intercept[rows], self.calib_a[rows], self.calib_b[rows], \
+            np.concatenate([[0], np.cumsum(folds_num)[:-1]]), folds_num
+
+    def predict_proba_predicates(self, X, predicates=None):
+        '''
+        :return: dict predicate -> prob of predicate being IN for X
+        '''
+        predicates = self.predicates if predicates is None else list(predicates)
+        coef, intercept, calib_a, calib_b, starts, folds_num = self._folds(predicates)
+        proba = np.empty((X.shape[0], len(predicates)))
+        for start in range(0, X.shape[0], self.chunk_size):
+            end = min(start + self.chunk_size, X.shape[0])
+            margins = X[start:end] @ coef.T + intercept
+            with np.errstate(over='ignore'):
+                fold_proba = 1. / (1. + np.exp(calib_a * margins + calib_b))
+            # average over the folds of every predicate as in CalibratedClassifierCV
+            proba[start:end] = np.add.reduceat(fold_proba, starts, axis=1) / folds_num
+
+        return {pr: proba[:, j] for j, pr in enumerate(predicates)}
+
+    def predict_proba_in(self, X, predicates=None):
+        '''
+        :return: prob of all predicates being IN (conjunctive expression) for X
+        '''
+        return np.prod(list(self.predict_proba_predicates(X, predicates).values()), axis=0)
+
+
+def fused_scorer(learners, predicates=None):
+    '''
+    :param learners: dict predicate -> Learner
+    :return: FusedLinearScorer of the current estimators, None if some learner is not a calibrated linear model
+    '''
+    predicates = list(learners.keys()) if predicates is None else predicates
+    try:
+        return FusedLinearScorer.from_estimators({pr: learners[pr].learner.estimator for pr in predicates})
+    except (ValueError, AttributeError):
+        return None
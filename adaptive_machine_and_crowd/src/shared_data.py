@@ -0,0 +1,166 @@
+import os
+import weakref
+import numpy as np
+import scipy.sparse as sp
+from multiprocessing import shared_memory, resource_tracker, util
+
+from adaptive_machine_and_crowd.src.dedup import find_duplicates
+
+'''
+    Featurized dataset published once and attached read-only by other processes, so workers do not featurize
+    the dataset or keep their own copy of the features.
+    Arrays (the dense feature block, or data/indices/indptr of CSR features, and the label arrays) go to
+    multiprocessing.shared_memory segments, or to .npy files memory-mapped by workers if a directory is given.
+    Workers get a small picklable handle: params['shared_data'] = shared.handle makes prepare_data attach
+    to the published arrays instead of loading the dataset.
+        with SharedDataset.publish(prepare_data(params)) as shared:
+            run_experiment(dict(params, shared_data=shared.handle))
+    Segments and files are removed by close(), when the SharedDataset is garbage collected, or at exit of the
+    publishing process. Attaching processes never remove them, they close their attachments with
+    detach_data(handle) once the arrays are released, and at exit.
+    The publisher owns the fitted vectorizer, the handle carries a pickled copy of it: every worker unpickling
+    the handle gets its own copy (vocabulary and idf weights), used read-only to snapshot learners.
+    Raw texts are not published, near-duplicate clusters (see dedup.py) are computed by the publisher for
+    the dedup_threshold of the run and published with the features.
+'''
+
+# arrays on segments attached by this process: name -> array, kept until detach_data
+_attached = {}
+
+
+def _release(segments, files):
+    for shm in segments:
+        shm.close()
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+    for file_name in files:
+        if os.path.isfile(file_name):
+            os.remove(file_name)
+
+
+def _attach_array(kind, spec):
+    if kind == 'npy':
+        return np.load(spec, mmap_mode='r')
+    name, shape, dtype = spec
+    if name not in _attached:
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # before python 3.13 attached segments are tracked and unlinked at exit of the attaching process,
+            # unregistering afterwards would drop the registration of the publisher from a shared tracker
+            register = resource_tracker.register
+            resource_tracker.register = lambda *args: None
+            try:
+                shm = shared_memory.SharedMemory(name=name)
+            finally:
+                resource_tracker.register = register
+        array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        array.flags.writeable = False
+        # the segment is closed once the array and its views are garbage collected, closing it earlier would
+        # leave them dangling; at exit the mapping goes away with the process
+        weakref.finalize(array, shm.close).atexit = False
+        if not _attached:
+            # run at exit of the main process and of multiprocessing workers
+            util.Finalize(None, detach_data, exitpriority=10)
+        _attached[name] = array
+    return _attached[name]
+
+
+def detach_data(handle=None):
+    '''
+    Drop the references of this process to the segments of the handle, to all attached segments if None.
+    A segment is closed once the arrays of the caller on it are garbage collected too.
+    '''
+    if handle is None:
+        names = list(_attached)
+    elif handle['kind'] == 'shm':
+        names = [spec[0] for spec in handle['arrays'].values()]
+    else:
+        return
+    for name in names:
+        _attached.pop(name, None)
+
+
+def attach_data(handle):
+    '''
+    :return: (X, y_screening, y_predicate, vectorizer, X_features) as prepare_data, X (raw texts) is None
+    '''
+    arrays = {name: _attach_array(handle['kind'], spec) for name, spec in handle['arrays'].items()}
+    if handle['sparse']:
+        X_features = sp.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape=handle['shape'])
+    else:
+        X_features = arrays['X_features']
+    y_predicate = {pr: arrays['y_predicate{}'.format(j)] for j, pr in enumerate(handle['predicates'])}
+
+    return None, arrays['y_screening'], y_predicate, handle['vectorizer'], X_features
+
+
+def attach_duplicate_roots(handle, threshold):
+    '''
+    :return: representative per item of the near-duplicate clusters published for threshold, None if not published
+    '''
+    if handle.get('dedup_threshold') is None or handle['dedup_threshold'] != threshold:
+        return None
+    return _attach_array(handle['kind'], handle['arrays']['dedup_roots'])
+
+
+class SharedDataset:
+
+    def __init__(self, handle, segments, files):
+        self.handle = handle
+        self._finalizer = weakref.finalize(self, _release, segments, files)
+
+    @classmethod
+    def publish(cls, data, directory=None, dedup_threshold=None):
+        '''
+        :param data: (X, y_screening, y_predicate, vectorizer, X_features) as returned by prepare_data
+        :param directory: write memory-mapped .npy files there instead of shared memory segments
+        :param dedup_threshold: publish near-duplicate clusters of X for params['dedup_threshold'] of the workers
+        '''
+        X, y_screening, y_predicate, vectorizer, X_features = data
+        predicates = list(y_predicate.keys())
+        arrays = {'y_screening': np.asarray(y_screening)}
+        arrays.update({'y_predicate{}'.format(j): np.asarray(y_predicate[pr]) for j, pr in enumerate(predicates)})
+        if sp.issparse(X_features):
+            X_features = sp.csr_matrix(X_features)
+            arrays.update({'data': X_features.data, 'indices': X_features.indices, 'indptr': X_features.indptr})
+        else:
+            arrays['X_features'] = np.ascontiguousarray(X_features)
+        if dedup_threshold is not None:
+            arrays['dedup_roots'] = find_duplicates(X, dedup_threshold).roots
+
+        specs, segments, files = {}, [], []
+        for name, array in arrays.items():
+            if directory is not None:
+                os.makedirs(directory, exist_ok=True)
+                file_name = os.path.join(directory, '{}.npy'.format(name))
+                np.save(file_name, array)
+                files.append(file_name)
+                specs[name] = file_name
+            else:
+                shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[:] = array
+                segments.append(shm)
+                specs[name] = (shm.name, array.shape, array.dtype.str)
+        handle = {
+            'kind': 'npy' if directory is not None else 'shm',
+            'arrays': specs,
+            'sparse': sp.issparse(X_features),
+            'shape': X_features.shape,
+            'predicates': predicates,
+            'dedup_threshold': dedup_threshold,
+            'vectorizer': vectorizer  # pickled with the handle, a read-only copy per worker for snapshots
+        }
+
+        return cls(handle, segments, files)
+
+    def close(self):
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
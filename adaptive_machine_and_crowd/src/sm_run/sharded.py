@@ -0,0 +1,179 @@
+import numpy as np
+from multiprocessing import Pool, resource_tracker, shared_memory
+
+from adaptive_machine_and_crowd.src.sm_run.shortest_multi_run import ShortestMultiRun
+
+'''
+    Sharded SM-Run: Crowd-Box rounds over items partitioned across worker processes.
+    Vote counts, priors, ground truth and labels live in shared memory. Every round the items given budget
+    are split into contiguous shards of equal size, so every shard gets budget in proportion to its items,
+    workers assign predicates, simulate votes and classify the items of their shard in place.
+    Votes are drawn from counter-based uniforms of (vote_seed, item, predicate, vote index), so votes, labels
+    and spend equal ShortestMultiRun with the same vote_seed for any number of workers.
+    The worker pool and shared memory live as long as the executor: one is created per run_experiment and
+    passed as params['crowd_box_executor'], every Crowd-Box run starts it with its SM-Run params and votes,
+    workers attach to the arrays again when a new run starts. Drop-in for ShortestMultiRun in run_crowd_box
+    if params['crowd_box_workers'] > 1, simulated crowd only.
+'''
+
+# state of a worker process: arrays attached to shared memory and the SM-Run of the current Crowd-Box run
+_shared = {}
+
+
+def _attach(run):
+    # attach to the arrays of the run, once per run and worker
+    run_id, specs, smr_params = run
+    if _shared.get('run_id') == run_id:
+        return
+    for name, (shm_name, shape, dtype) in specs.items():
+        if name + '_shm' in _shared:
+            _shared[name + '_shm'].close()
+        shm = shared_memory.SharedMemory(name=shm_name)
+        _shared[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        _shared[name + '_shm'] = shm  # keep the mapping alive
+    _shared['smr'] = ShortestMultiRun(smr_params)
+    _shared['run_id'] = run_id
+
+
+def _classify_shard(task):
+    run, item_ids = task
+    _attach(run)
+    return _classify(item_ids)
+
+
+def _classify(item_ids):
+    smr, votes, labels = _shared['smr'], _shared['votes'], _shared['labels']
+    shard_labels = smr.classify_arrays(votes[item_ids, :, 0], votes[item_ids, :, 1], _shared['prior_in'][item_ids])
+    is_classified = shard_labels != -1
+    labels[item_ids[is_classified]] = shard_labels[is_classified]
+
+    return item_ids[~is_classified]
+
+
+def _round_shard(task):
+    run, item_ids = task
+    _attach(run)
+    smr, votes, gt = _shared['smr'], _shared['votes'], _shared['gt']
+    predicate_idx = smr.assign_arrays(votes[item_ids, :, 0], votes[item_ids, :, 1], _shared['prior_in'][item_ids])
+    for j in range(len(smr.predicates)):
+        ids = item_ids[predicate_idx == j]
+        if not len(ids):
+            continue
+        in_votes = smr.simulate_votes(ids, j, gt[ids, j], votes[ids, j].sum(axis=1))
+        votes[ids, j, 0] += in_votes
+        votes[ids, j, 1] += 1 - in_votes
+    assigned_item_ids = item_ids[predicate_idx != -1]
+
+    return _classify(assigned_item_ids), len(assigned_item_ids)
+
+
+class ShardedShortestMultiRun:
+
+    def __init__(self, workers_num, shards_num=None):
+        '''
+        :param shards_num: shards per round, workers_num by default
+        '''
+        self.shards_num = shards_num or workers_num
+        # workers share the tracker of shared memory with this process, it is started before they are forked
+        resource_tracker.ensure_running()
+        self.pool = Pool(workers_num)
+        self._shm, self.arrays, self._specs = {}, {}, {}
+        self.runs_num = 0
+        self.run = None
+        self.predicates = None
+        self.crowd_votes_counts = None
+
+    def start(self, params, crowd_votes_counts):
+        '''
+        Start a Crowd-Box run, shared memory is reused if the arrays keep their shapes
+        :param params: ShortestMultiRun params, 'vote_seed' is required
+        :param crowd_votes_counts: votes the Crowd-Box starts from, written back by finish()
+        :return: self
+        '''
+        if params.get('crowd') is not None:
+            raise ValueError('Sharded SM-Run simulates votes, crowd backends are not supported')
+        if params.get('vote_seed') is None:
+            raise ValueError('Sharded SM-Run needs a vote_seed')
+        smr = ShortestMultiRun(params)
+        self.predicates = smr.predicates
+        self.crowd_votes_counts = crowd_votes_counts
+        items_num = len(crowd_votes_counts)
+        arrays = {
+            'votes': np.array([[[crowd_votes_counts[item_id][pr]['in'], crowd_votes_counts[item_id][pr]['out']]
+                                for pr in self.predicates] for item_id in range(items_num)], dtype=np.int64),
+            'prior_in': smr._prior_in(range(items_num)),
+            'gt': np.array([[params['item_predicate_gt'][pr][item_id] for pr in self.predicates]
+                            for item_id in range(items_num)], dtype=np.int64),
+            'labels': np.full(items_num, -1, dtype=np.int8)
+        }
+        for name, array in arrays.items():
+            if name not in self.arrays or self.arrays[name].shape != array.shape:
+                self._release(name)
+                shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                self.arrays[name] = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+                self._shm[name] = shm
+                self._specs[name] = (shm.name, array.shape, array.dtype.str)
+            self.arrays[name][:] = array
+        # workers get the arrays from shared memory, not the dicts of priors and ground truth
+        worker_params = dict(params, prior_prob=None, item_predicate_gt={}, use_prior=smr.use_prior)
+        self.runs_num += 1
+        self.run = ((id(self), self.runs_num), dict(self._specs), worker_params)
+        return self
+
+    def _shards(self, item_ids):
+        item_ids = np.asarray(item_ids, dtype=np.int64)
+        return [(self.run, shard) for shard in np.array_split(item_ids, self.shards_num) if len(shard)]
+
+    def _update_labels(self, item_ids, item_labels):
+        labels = self.arrays['labels']
+        for item_id in item_ids:
+            if labels[item_id] != -1:
+                item_labels[item_id] = int(labels[item_id])
+
+    def classify_items(self, item_ids, crowd_votes_counts, item_labels):
+        '''
+        :param crowd_votes_counts: not used, votes are kept in shared memory until finish()
+        '''
+        item_ids = list(item_ids)
+        unclassified = self.pool.map(_classify_shard, self._shards(item_ids))
+        self._update_labels(item_ids, item_labels)
+
+        return np.concatenate(unclassified) if unclassified else np.array([], dtype=np.int64)
+
+    def do_round(self, crowd_votes_counts, item_ids, item_labels):
+        '''
+        :param crowd_votes_counts: not used, votes are kept in shared memory until finish()
+        '''
+        results = self.pool.map(_round_shard, self._shards(item_ids))
+        self._update_labels(item_ids, item_labels)
+        unclassified = [shard_unclassified for shard_unclassified, _ in results]
+        unclassified_item_ids = np.concatenate(unclassified) if unclassified else np.array([], dtype=np.int64)
+
+        return unclassified_item_ids, sum(budget for _, budget in results)
+
+    def finish(self):
+        # write the votes of the run back to crowd_votes_counts
+        votes = self.arrays['votes']
+        for item_id, item_votes in self.crowd_votes_counts.items():
+            for j, pr in enumerate(self.predicates):
+                item_votes[pr]['in'], item_votes[pr]['out'] = int(votes[item_id, j, 0]), int(votes[item_id, j, 1])
+        self.crowd_votes_counts = None
+
+    def _release(self, name):
+        if name in self._shm:
+            del self.arrays[name]
+            self._shm[name].close()
+            self._shm.pop(name).unlink()
+
+    def close(self):
+        # stop workers and release shared memory
+        self.pool.close()
+        self.pool.join()
+        for name in list(self._shm):
+            self._release(name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -1,6 +1,6 @@
 import numpy as np
-from scipy.special import binom
-import random
+
+from adaptive_machine_and_crowd.src.kernels import posterior_in, look_ahead_scores, tally_votes, counter_uniforms
 
 
 class ShortestMultiRun:
@@ -14,7 +14,16 @@ class ShortestMultiRun:
         self.crowd_acc_range = params['crowd_acc']
         self.item_predicate_gt = params['item_predicate_gt']
         self.prior_prob = params.get('prior_prob', None)
+        # crowd backend with CrowdSimulator.crowdsource_items interface, votes are simulated if None
+        self.crowd = params.get('crowd', None)
         self.max_votes_per_item = 20
+        # priors of the look-ahead: machine priors if given, selectivity otherwise
+        self.use_prior = params.get('use_prior', bool(self.prior_prob))
+        # seed of counter-based vote draws (same votes whatever the order of items), global numpy stream if None
+        self.vote_seed = params.get('vote_seed', None)
+        # per predicate arrays for the kernels
+        self._acc = np.array([self.estimated_predicate_accuracy[pr] for pr in self.predicates], dtype=float)
+        self._selectivity = np.array([self.estimated_predicate_selectivity[pr] for pr in self.predicates], dtype=float)
 
     def do_round(self, crowd_votes_counts, item_ids, item_labels):
         predicate_assigned = self.assign_predicates(item_ids, crowd_votes_counts)
@@ -25,96 +34,112 @@ class ShortestMultiRun:
         return unclassified_item_ids, budget_round
 
     def classify_items(self, item_ids, crowd_votes_counts, item_labels):
+        item_ids = list(item_ids)
+        in_c, out_c = self._votes_arrays(item_ids, crowd_votes_counts)
+        labels = self.classify_arrays(in_c, out_c, self._prior_in(item_ids))
+
         unclassified_item_ids = []
-        for item_id in item_ids:
-            prob_item_in = 1.
-            for predicate in self.predicates:
-                prob_predicate_in = self._prob_predicate_in(predicate, item_id, crowd_votes_counts)
-                prob_item_in *= prob_predicate_in
-            prob_item_out = 1 - prob_item_in
-
-            if prob_item_out > self.clf_threshold:
-                item_labels[item_id] = 0
-            elif prob_item_in > self.clf_threshold:
-                item_labels[item_id] = 1
-            else:
+        for item_id, label in zip(item_ids, labels):
+            if label == -1:
                 unclassified_item_ids.append(item_id)
+            else:
+                item_labels[item_id] = int(label)
 
         return np.array(unclassified_item_ids)
 
+    def classify_arrays(self, in_c, out_c, prior_in):
+        '''
+        :return: label per item, 0 - OUT, 1 - IN, -1 - unclassified
+        '''
+        prob_predicate_in = posterior_in(in_c, out_c, self._acc, prior_in, self._selectivity)
+        prob_item_in = np.ones(in_c.shape[0])
+        for j in range(len(self.predicates)):
+            prob_item_in *= prob_predicate_in[:, j]
+        prob_item_out = 1 - prob_item_in
+
+        return np.where(prob_item_out > self.clf_threshold, 0, np.where(prob_item_in > self.clf_threshold, 1, -1))
+
     def assign_predicates(self, item_ids, crowd_votes_counts):
-        predicate_assigned = {}
-        for item_id in item_ids:
-            crowdsourced_votes_num = 0
-            classify_score = {}
-            joint_prob_votes_out = {predicate: 1. for predicate in self.predicates}
-            for predicate in self.predicates:
-                crowdsourced_votes_num += sum(crowd_votes_counts[item_id][predicate].values())
-                # set up prob_item
-                _prob_item_in = 1.
-                for pr in [pr for pr in self.predicates if pr != predicate]:
-                    _prob_item_in *= self._prob_predicate_in(pr, item_id, crowd_votes_counts)
-
-                preducate_acc = self.estimated_predicate_accuracy[predicate]
-                predicate_select = self.estimated_predicate_selectivity[predicate]
-                if self.prior_prob:
-                    prior_pred_in = self.prior_prob[item_id][predicate]['in']
-                    prob_pred_out = 1 - prior_pred_in
-                else:
-                    prob_pred_out = 1 - predicate_select
-                    prior_pred_in = predicate_select
-                in_c, out_c = [crowd_votes_counts[item_id][predicate][key] for key in ['in', 'out']]
-                for n in range(1, 11):
-                    prob_next_vote_out = preducate_acc * prob_pred_out + (1 - preducate_acc) * (1 - prob_pred_out)
-                    joint_prob_votes_out[predicate] *= prob_next_vote_out
-
-                    term_in = binom(in_c + out_c + n, in_c) * preducate_acc ** in_c \
-                              * (1 - preducate_acc) ** (out_c + n) * prior_pred_in
-                    term_out = binom(in_c + out_c + n, out_c + n) * preducate_acc ** (out_c + n) \
-                               * (1 - preducate_acc) ** in_c * (1 - prior_pred_in)
-
-                    prob_predicate_in = term_in / (term_in + term_out)
-                    prob_item_out = 1 - _prob_item_in * prob_predicate_in
-                    if prob_item_out >= self.clf_threshold:
-                        classify_score[predicate] = n / joint_prob_votes_out[predicate]
-                        break
-                    elif n == 10:
-                        classify_score[predicate] = n / joint_prob_votes_out[predicate]
-
-            predicate_best_score = min(classify_score, key=classify_score.get)
-            if classify_score[predicate_best_score] < self.stop_score and crowdsourced_votes_num < self.max_votes_per_item:
-                predicate_assigned[item_id] = predicate_best_score
-
-        return predicate_assigned
+        item_ids = list(item_ids)
+        if not item_ids:
+            return {}
+        in_c, out_c = self._votes_arrays(item_ids, crowd_votes_counts)
+        exhausted = None
+        if self.crowd is not None and hasattr(self.crowd, 'votes_left'):
+            exhausted = np.stack([self.crowd.votes_left(pr, item_ids, crowd_votes_counts) == 0
+                                  for pr in self.predicates], axis=1)
+        predicate_idx = self.assign_arrays(in_c, out_c, self._prior_in(item_ids), exhausted)
+
+        return {item_id: self.predicates[j] for item_id, j in zip(item_ids, predicate_idx) if j != -1}
+
+    def assign_arrays(self, in_c, out_c, prior_in, exhausted=None):
+        '''
+        :param exhausted: bool array [items, predicates], item-predicates the crowd has no votes left for
+        :return: index of the predicate to crowdsource next per item, -1 if the item gets no more votes
+        '''
+        prob_predicate_in = posterior_in(in_c, out_c, self._acc, prior_in, self._selectivity)
+        # prob of all the other predicates being IN
+        prob_other_in = np.ones(in_c.shape)
+        for j in range(len(self.predicates)):
+            for j_other in range(len(self.predicates)):
+                if j_other != j:
+                    prob_other_in[:, j] *= prob_predicate_in[:, j_other]
+        if self.use_prior:
+            prior_look_ahead = prior_in
+        else:
+            prior_look_ahead = np.broadcast_to(self._selectivity, in_c.shape).copy()
+        classify_score = look_ahead_scores(in_c, out_c, self._acc, prior_look_ahead, prob_other_in, self.clf_threshold)
+        if exhausted is not None:
+            classify_score = np.where(exhausted, np.inf, classify_score)
+        predicate_best = np.argmin(classify_score, axis=1)
+        best_score = classify_score[np.arange(in_c.shape[0]), predicate_best]
+        crowdsourced_votes_num = (in_c + out_c).sum(axis=1)
+        is_assigned = (best_score < self.stop_score) & (crowdsourced_votes_num < self.max_votes_per_item)
+
+        return np.where(is_assigned, predicate_best, -1)
+
+    def _votes_arrays(self, item_ids, crowd_votes_counts):
+        in_c = np.array([[crowd_votes_counts[item_id][pr]['in'] for pr in self.predicates] for item_id in item_ids],
+                        dtype=np.int64).reshape(len(item_ids), len(self.predicates))
+        out_c = np.array([[crowd_votes_counts[item_id][pr]['out'] for pr in self.predicates] for item_id in item_ids],
+                         dtype=np.int64).reshape(len(item_ids), len(self.predicates))
+        return in_c, out_c
+
+    def _prior_in(self, item_ids):
+        if self.prior_prob:
+            return np.array([[self.prior_prob[item_id][pr]['in'] for pr in self.predicates] for item_id in item_ids],
+                            dtype=float).reshape(len(item_ids), len(self.predicates))
+        return np.broadcast_to(self._selectivity, (len(item_ids), len(self.predicates))).copy()
 
     def crowdsource_items(self, crowd_votes_counts, predicate_assigned):
-        for item_id in predicate_assigned.keys():
-            predicate = predicate_assigned[item_id]
+        for predicate in self.predicates:
+            item_ids = [item_id for item_id, pr in predicate_assigned.items() if pr == predicate]
+            if not item_ids:
+                continue
+            gt_items = [self.item_predicate_gt[predicate][item_id] for item_id in item_ids]
             crowd_acc_range = self.crowd_acc_range[predicate]
-            worker_acc = random.uniform(crowd_acc_range[0], crowd_acc_range[1])
-            gt = self.item_predicate_gt[predicate][item_id]
-            worker_vote = np.random.binomial(1, worker_acc if gt == 1 else 1 - worker_acc)
-            if worker_vote == 1:
-                crowd_votes_counts[item_id][predicate]['in'] += 1
-            else:
-                crowd_votes_counts[item_id][predicate]['out'] += 1
-
-    def _prob_predicate_in(self, predicate, item_id, crowd_votes_counts):
-        preducate_acc = self.estimated_predicate_accuracy[predicate]
-        predicate_select = self.estimated_predicate_selectivity[predicate]
-
-        if self.prior_prob:
-            prior_pred_in = self.prior_prob[item_id][predicate]['in']
-        else:
-            prior_pred_in = predicate_select
-        in_c, out_c = [crowd_votes_counts[item_id][predicate][key] for key in ['in', 'out']]
-        if in_c == 0 and out_c == 0:
-            prob_predicate_in = predicate_select
+            if self.crowd is not None:
+                self.crowd.crowdsource_items(item_ids, gt_items, predicate, crowd_acc_range, 1, crowd_votes_counts)
+                continue
+            # one simulated vote per item
+            votes_before = [crowd_votes_counts[item_id][predicate]['in'] + crowd_votes_counts[item_id][predicate]['out']
+                            for item_id in item_ids]
+            in_votes = self.simulate_votes(item_ids, self.predicates.index(predicate), gt_items, votes_before)
+            for item_id, worker_vote in zip(item_ids, in_votes):
+                if worker_vote == 1:
+                    crowd_votes_counts[item_id][predicate]['in'] += 1
+                else:
+                    crowd_votes_counts[item_id][predicate]['out'] += 1
+
+    def simulate_votes(self, item_ids, predicate_idx, gt_items, votes_before):
+        '''
+        :param votes_before: number of votes the items have on the predicate, vote index of counter-based draws
+        :return: one simulated vote per item, 1 - IN, 0 - OUT
+        '''
+        crowd_acc_range = self.crowd_acc_range[self.predicates[predicate_idx]]
+        if self.vote_seed is None:
+            acc_draws, vote_draws = np.random.random_sample((2, len(item_ids), 1))
         else:
-            term_in = binom(in_c + out_c, in_c) * preducate_acc ** in_c \
-                      * (1 - preducate_acc) ** out_c * prior_pred_in
-            term_out = binom(in_c + out_c, out_c) * preducate_acc ** out_c \
-                       * (1 - preducate_acc) ** in_c * (1 - prior_pred_in)
-            prob_predicate_in = term_in / (term_in + term_out)
+            acc_draws, vote_draws = counter_uniforms(self.vote_seed, item_ids, predicate_idx, votes_before)[:, :, None]
 
-        return prob_predicate_in
+        return tally_votes(gt_items, crowd_acc_range[0], crowd_acc_range[1], acc_draws, vote_draws)
@@ -0,0 +1,157 @@
+import os
+import re
+import json
+import numpy as np
+
+from adaptive_machine_and_crowd.src.scoring import calibrated_folds, FusedLinearScorer
+
+'''
+    Snapshot of trained screening learners as plain arrays, no pickled sklearn objects.
+    A snapshot is a directory with a json manifest and .npy files:
+        vocabulary.npy        terms ordered by feature index
+        idf.npy               idf weights of the TF-IDF vectorizer
+        predicate<i>_coef.npy, predicate<i>_intercept.npy   linear model per calibration fold
+        predicate<i>_calib_a.npy, predicate<i>_calib_b.npy  sigmoid calibration per fold
+    Arrays are loaded memory-mapped read-only, so processes loading one snapshot share its pages.
+    ScreeningModel reproduces Vectorizer.transform and ScreeningActiveLearner.predict_proba/predict.
+'''
+
+SNAPSHOT_FORMAT_VERSION = 1
+MANIFEST_FILE = 'manifest.json'
+
+
+def save_snapshot(path, vectorizer, SAL, meta=None):
+    '''
+    :param path: snapshot directory, created if missing
+    :param vectorizer: fitted Vectorizer
+    :param SAL: ScreeningActiveLearner, screening_out_threshold of SAL is stored with the learners
+    :param meta: json serializable info to keep in the manifest (dataset, budget, ...)
+    '''
+    tfidf = vectorizer.vectorizer
+    if tfidf.analyzer != 'word' or tfidf.tokenizer is not None or tfidf.preprocessor is not None \
+            or tfidf.stop_words is not None or tfidf.strip_accents is not None:
+        raise ValueError('Only word analyzer with the default tokenizer can be snapshot')
+    os.makedirs(path, exist_ok=True)
+
+    terms = [None] * len(tfidf.vocabulary_)
+    for term, idx in tfidf.vocabulary_.items():
+        terms[idx] = term
+    np.save(os.path.join(path, 'vocabulary.npy'), np.array(terms, dtype=str))
+    # idf_ is not fitted without use_idf, transform does not weight terms then
+    np.save(os.path.join(path, 'idf.npy'), tfidf.idf_ if tfidf.use_idf else np.ones(len(terms)))
+
+    predicates = list(SAL.predicates)
+    for i, pr in enumerate(predicates):
+        arrays = calibrated_folds(SAL.learners[pr].learner.estimator)
+        for name, array in zip(['coef', 'intercept', 'calib_a', 'calib_b'], arrays):
+            np.save(os.path.join(path, 'predicate{}_{}.npy'.format(i, name)), array)
+
+    # the manifest is written last, a directory without it is an incomplete snapshot
+    manifest = {
+        'format_version': SNAPSHOT_FORMAT_VERSION,
+        'predicates': predicates,
+        'screening_out_threshold': SAL.screening_out_threshold,
+        'vectorizer': {
+            'lowercase': tfidf.lowercase,
+            'token_pattern': tfidf.token_pattern,
+            'ngram_range': list(tfidf.ngram_range),
+            'norm': tfidf.norm,
+            'use_idf': tfidf.use_idf,
+            'sublinear_tf': tfidf.sublinear_tf,
+            'binary': tfidf.binary
+        },
+        'meta': meta or {}
+    }
+    with open(os.path.join(path, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+
+def load_snapshot(path, mmap_mode='r'):
+    '''
+    :return: ScreeningModel backed by the arrays of the snapshot
+    '''
+    with open(os.path.join(path, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    if manifest['format_version'] != SNAPSHOT_FORMAT_VERSION:
+        raise ValueError('Snapshot format version {} is not supported, expected {}'
+                         .format(manifest['format_version'], SNAPSHOT_FORMAT_VERSION))
+
+    def load(name):
+        return np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+
+    learners = {pr: {name: load('predicate{}_{}'.format(i, name)) for name in ['coef', 'intercept', 'calib_a', 'calib_b']}
+                for i, pr in enumerate(manifest['predicates'])}
+
+    return ScreeningModel(manifest, load('vocabulary'), load('idf'), learners)
+
+
+class ScreeningModel:
+
+    def __init__(self, manifest, vocabulary, idf, learners):
+        self.manifest = manifest
+        self.predicates = manifest['predicates']
+        self.screening_out_threshold = manifest['screening_out_threshold']
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.learners = learners
+        self.scorer = FusedLinearScorer(learners)  # stacked copy of the fold arrays, small next to the vocabulary
+        config = manifest['vectorizer']
+        self.lowercase = config['lowercase']
+        self.token_re = re.compile(config['token_pattern'])
+        self.ngram_range = tuple(config['ngram_range'])
+        self._term_idx = None
+
+    @property
+    def term_idx(self):
+        # term -> feature index, built on the first transform
+        if self._term_idx is None:
+            self._term_idx = {term: idx for idx, term in enumerate(self.vocabulary.tolist())}
+        return self._term_idx
+
+    def analyze(self, doc):
+        # same n-grams as the word analyzer of sklearn
+        tokens = self.token_re.findall(doc.lower() if self.lowercase else doc)
+        min_n, max_n = self.ngram_range
+        ngrams = list(tokens) if min_n == 1 else []
+        for n in range(max(min_n, 2), max_n + 1):
+            ngrams += [' '.join(tokens[i:i + n]) for i in range(len(tokens) - n + 1)]
+        return ngrams
+
+    def transform(self, docs):
+        config = self.manifest['vectorizer']
+        term_idx = self.term_idx
+        X = np.zeros((len(docs), len(self.vocabulary)))
+        for i, doc in enumerate(docs):
+            for term in self.analyze(doc):
+                idx = term_idx.get(term)
+                if idx is not None:
+                    X[i, idx] += 1
+        if config['binary']:
+            X = (X > 0).astype(float)
+        if config['sublinear_tf']:
+            # mask of counts before the log, log(1) + 1 of single occurrences is 0 afterwards
+            counted = X > 0
+            np.log(X, out=X, where=counted)
+            X[counted] += 1
+        if config['use_idf']:
+            X *= self.idf
+        if config['norm'] is not None:
+            ord_ = {'l1': 1, 'l2': 2}[config['norm']]
+            norms = np.linalg.norm(X, ord=ord_, axis=1)
+            norms[norms == 0] = 1.
+            X /= norms[:, None]
+
+        return X
+
+    def predict_proba_predicates(self, X, predicates=None):
+        return self.scorer.predict_proba_predicates(X, predicates)
+
+    def predict_proba(self, X):
+        proba_in = self.scorer.predict_proba_in(X)
+
+        return np.stack((1 - proba_in, proba_in), axis=1)
+
+    def predict(self, X):
+        proba_out = self.predict_proba(X)[:, 0]
+
+        return np.where(proba_out > self.screening_out_threshold, 0, 1)
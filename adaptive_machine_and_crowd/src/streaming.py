@@ -0,0 +1,251 @@
+import time
+import itertools
+import numpy as np
+from collections import deque, Counter
+
+from adaptive_machine_and_crowd.src.utils import Vectorizer, CrowdSimulator, MetricsMixin, load_data
+from adaptive_machine_and_crowd.src.sm_run.shortest_multi_run import ShortestMultiRun
+from adaptive_machine_and_crowd.src.kernels import posterior_in
+from adaptive_machine_and_crowd.src.experiment_handler import configure_al_box
+
+'''
+    Streaming screening of continuously arriving documents.
+    Documents arrive in micro-batches, get machine priors from the current predicate learners,
+    confident ones are classified by machines right away and uncertain ones join an ongoing SM-Run queue.
+    Every step runs one SM-Run round over the queue. Items SM-Run gives up on, or pushed out of the window,
+    are classified by machine priors combined with the votes they got.
+    Crowd labels of finished items are fed back to the learners in batches, learners are refit on the latest
+    training_window labelled rows only.
+    Per item state is kept only while the item is in flight, the queue is bounded by window_size, and the
+    training data of a learner by training_window rows, so state and retrain time do not grow with the stream.
+    Decisions are emitted as they are made, (item_id, label, decided_by) tuples are drained with
+    pop_decisions(), only counters and a bounded window of latencies are kept.
+'''
+
+
+class StreamingScreener:
+
+    def __init__(self, params, vectorizer, SAL, estimated_predicate_selectivity):
+        '''
+        :param params: experiment params (predicates, crowd_acc, screening_out_threshold, stop_score, ...)
+                       and streaming params 'window_size', 'retrain_batch_size', 'budget_per_item',
+                       'training_window' (labelled rows a learner is refit on),
+                       'latency_window' (latencies of the last decisions kept for the report)
+        :param vectorizer: fitted Vectorizer
+        :param SAL: ScreeningActiveLearner with trained predicate learners
+        '''
+        self.predicates = params['predicates']
+        self.vectorizer = vectorizer
+        self.SAL = SAL
+        self.crowd = params.get('crowd', CrowdSimulator)
+        self.window_size = params.get('window_size', 1000)
+        self.retrain_batch_size = params.get('retrain_batch_size', 100)
+        self.training_window = params.get('training_window', 2000)
+        self.budget_per_item = params['budget_per_item']
+        self.clf_threshold = params['screening_out_threshold']
+        # in flight state, entries are removed once an item is classified
+        self.prior_prob = {}
+        self.crowd_votes_counts = {}
+        self.item_predicate_gt = {pr: {} for pr in self.predicates}
+        self.features = {}
+        self.arrival_time = {}
+        self.queue = {}  # item ids in SM-Run, oldest first, dict for O(1) removal
+        self.SMR = ShortestMultiRun({
+            'estimated_predicate_accuracy': {pr: sum(params['crowd_acc'][pr]) / 2 for pr in self.predicates},
+            'estimated_predicate_selectivity': estimated_predicate_selectivity,
+            'predicates': self.predicates,
+            'item_predicate_gt': self.item_predicate_gt,
+            'clf_threshold': self.clf_threshold,
+            'stop_score': params['stop_score'],
+            'crowd_acc': params['crowd_acc'],
+            'prior_prob': self.prior_prob,
+            'crowd': self.crowd if self.crowd is not CrowdSimulator else None
+        })
+        # crowd labels waiting to be fed back to the learners, per predicate
+        self.feedback = {pr: ([], []) for pr in self.predicates}
+        # decisions not popped yet, counters and latencies of the last decisions
+        self.decisions = deque()
+        self.decided_by = Counter()
+        self.latencies = deque(maxlen=params.get('latency_window', 10000))
+        self.next_item_id = 0
+        self.budget_available = 0
+        self.budget_spent = 0
+        self.retrain_num = 0
+        self.start_time = None
+
+    def process_batch(self, docs, gt_predicate=None):
+        '''
+        :param docs: raw documents (tokens) of a micro-batch
+        :param gt_predicate: dict predicate -> ground truth per document, used by the crowd simulator
+        :return: ids assigned to the documents
+        '''
+        now = time.perf_counter()
+        if self.start_time is None:
+            self.start_time = now
+        item_ids = list(range(self.next_item_id, self.next_item_id + len(docs)))
+        self.next_item_id += len(docs)
+        self.budget_available += self.budget_per_item * len(docs)
+
+        X = self.vectorizer.transform(docs)
+        proba_in = self.SAL.predict_proba_predicates(X)
+        machine_proba_in = np.prod([proba_in[pr] for pr in self.predicates], axis=0)
+        for i, item_id in enumerate(item_ids):
+            self.arrival_time[item_id] = now
+            if 1 - machine_proba_in[i] > self.clf_threshold:
+                self._decide(item_id, 0, 'machine')
+            elif machine_proba_in[i] > self.clf_threshold:
+                self._decide(item_id, 1, 'machine')
+            else:
+                self.prior_prob[item_id] = {pr: {'in': proba_in[pr][i], 'out': 1 - proba_in[pr][i]}
+                                            for pr in self.predicates}
+                self.crowd_votes_counts[item_id] = {pr: {'in': 0, 'out': 0} for pr in self.predicates}
+                for pr in self.predicates:
+                    self.item_predicate_gt[pr][item_id] = gt_predicate[pr][i] if gt_predicate is not None else None
+                self.features[item_id] = X[i]
+                self.queue[item_id] = None
+
+        # bound the in flight window, the oldest items leave it
+        while len(self.queue) > self.window_size:
+            self._decide_leftover([next(iter(self.queue))])
+
+        return item_ids
+
+    def step(self):
+        '''
+        One SM-Run round over the queue within the budget accrued so far
+        :return: number of votes spent
+        '''
+        budget_left = self.budget_available - self.budget_spent
+        item_ids = list(itertools.islice(self.queue, max(budget_left, 0)))
+        if not item_ids:
+            return 0
+        predicate_assigned = self.SMR.assign_predicates(item_ids, self.crowd_votes_counts)
+        # SM-Run stopped asking on these items
+        self._decide_leftover([item_id for item_id in item_ids if item_id not in predicate_assigned])
+        self.SMR.crowdsource_items(self.crowd_votes_counts, predicate_assigned)
+        self.budget_spent += len(predicate_assigned)
+        item_labels = {}
+        unclassified = set(self.SMR.classify_items(predicate_assigned.keys(), self.crowd_votes_counts, item_labels))
+        for item_id, label in item_labels.items():
+            if item_id not in unclassified:
+                self._collect_feedback(item_id)
+                self._decide(item_id, label, 'crowd')
+        self._retrain()
+
+        return len(predicate_assigned)
+
+    def flush(self):
+        # classify the items left in the queue
+        self._decide_leftover(list(self.queue))
+
+    def _decide_leftover(self, item_ids):
+        # machine priors combined with the crowd votes collected so far, at the machines threshold
+        if not item_ids:
+            return
+        in_c, out_c = self.SMR._votes_arrays(item_ids, self.crowd_votes_counts)
+        prior_in = self.SMR._prior_in(item_ids)
+        prob_predicate_in = np.where((in_c + out_c) > 0,
+                                     posterior_in(in_c, out_c, self.SMR._acc, prior_in, self.SMR._selectivity),
+                                     prior_in)
+        prob_item_out = 1 - prob_predicate_in.prod(axis=1)
+        for item_id, p_out, votes_num in zip(item_ids, prob_item_out, (in_c + out_c).sum(axis=1)):
+            self._collect_feedback(item_id)
+            self._decide(item_id, 0 if p_out > self.SAL.screening_out_threshold else 1,
+                         'crowd+machine' if votes_num else 'machine')
+
+    def _collect_feedback(self, item_id):
+        # majority of crowd votes per predicate becomes a training label
+        for pr in self.predicates:
+            counts = self.crowd_votes_counts.get(item_id, {}).get(pr)
+            if counts and counts['in'] + counts['out'] > 0:
+                X_pr, y_pr = self.feedback[pr]
+                X_pr.append(self.features[item_id])
+                y_pr.append(1 if counts['in'] >= counts['out'] else 0)
+
+    def _retrain(self):
+        for pr in self.predicates:
+            X_pr, y_pr = self.feedback[pr]
+            if len(y_pr) >= self.retrain_batch_size:
+                self.SAL.learners[pr].teach(np.vstack(X_pr), np.array(y_pr), self.training_window)
+                self.feedback[pr] = ([], [])
+                self.retrain_num += 1
+
+    def pop_decisions(self):
+        '''
+        :return: generator of (item_id, label, decided_by) of the decisions made since the last call
+        '''
+        while self.decisions:
+            yield self.decisions.popleft()
+
+    def _decide(self, item_id, label, decided_by):
+        self.decisions.append((item_id, int(label), decided_by))
+        self.decided_by[decided_by] += 1
+        self.latencies.append(time.perf_counter() - self.arrival_time.pop(item_id))
+        if item_id in self.features:
+            del self.queue[item_id]
+            del self.features[item_id], self.prior_prob[item_id], self.crowd_votes_counts[item_id]
+            for pr in self.predicates:
+                del self.item_predicate_gt[pr][item_id]
+
+    def report(self):
+        elapsed = time.perf_counter() - self.start_time if self.start_time is not None else 0.
+        latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+        items_classified = sum(self.decided_by.values())
+        return {
+            'items_arrived': self.next_item_id,
+            'items_classified': items_classified,
+            'items_in_flight': len(self.queue),
+            'classified_by_machine': self.decided_by['machine'],
+            'classified_by_crowd': self.decided_by['crowd'],
+            'classified_by_crowd_and_machine': self.decided_by['crowd+machine'],
+            'crowd_votes_spent': self.budget_spent,
+            'retrain_num': self.retrain_num,
+            'throughput_items_per_sec': items_classified / elapsed if elapsed else 0.,
+            'latency_p50_sec': np.percentile(latencies, 50),
+            'latency_p95_sec': np.percentile(latencies, 95),
+            'latency_p99_sec': np.percentile(latencies, 99)
+        }
+
+
+def run_streaming(params, bootstrap_size=500, batch_size=50, steps_per_batch=3):
+    '''
+    Replays a dataset as a stream: the first bootstrap_size documents fit the vectorizer and the initial
+    learners, the rest arrive in micro-batches of batch_size with steps_per_batch SM-Run rounds per batch
+    :return: streaming report with screening metrics
+    '''
+    # the vectorizer is fitted on the bootstrap documents only, the corpus is not featurized upfront
+    X, y_screening, y_predicate = load_data(params['dataset_file_name'], params['predicates'],
+                                            params['path_to_project'])
+    order = np.random.permutation(len(X))
+    boot_idx, stream_idx = order[:bootstrap_size], order[bootstrap_size:]
+
+    # initial learners on a balanced sample of the bootstrap documents, as in the batch AL-Box
+    vectorizer = Vectorizer()
+    X_boot = vectorizer.fit_transform(X[boot_idx])
+    y_predicate_boot = {pr: y_predicate[pr][boot_idx] for pr in params['predicates']}
+    boot_params = dict(params, X_features=X_boot, y_screening=y_screening[boot_idx], y_predicate=dict(y_predicate_boot))
+    SAL = configure_al_box(boot_params, {pr: np.arange(bootstrap_size) for pr in params['predicates']},
+                           {item_id: {pr: {'in': 0, 'out': 0} for pr in params['predicates']}
+                            for item_id in range(bootstrap_size)}, {})
+    SAL.screening_out_threshold = 0.7  # as for machines in the batch mode
+    selectivity = {pr: y_predicate_boot[pr].mean() for pr in params['predicates']}
+
+    screener = StreamingScreener(params, vectorizer, SAL, selectivity)
+    item_labels = {}
+    for start in range(0, len(stream_idx), batch_size):
+        batch_idx = stream_idx[start:start + batch_size]
+        screener.process_batch(X[batch_idx], {pr: y_predicate[pr][batch_idx] for pr in params['predicates']})
+        for _ in range(steps_per_batch):
+            screener.step()
+        item_labels.update((item_id, label) for item_id, label, _ in screener.pop_decisions())
+    screener.flush()
+    item_labels.update((item_id, label) for item_id, label, _ in screener.pop_decisions())
+
+    report = screener.report()
+    gt = {item_id: y_screening[idx] for item_id, idx in enumerate(stream_idx)}
+    pre, rec, f_beta, loss, fn_count, fp_count = MetricsMixin.compute_screening_metrics(
+        gt, item_labels, params['lr'], params['beta'])
+    report.update({'precision': pre, 'recall': rec, 'f_beta': f_beta, 'loss': loss,
+                   'budget_spent_per_item': report['crowd_votes_spent'] / len(stream_idx)})
+
+    return report
@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+
+from adaptive_machine_and_crowd.src.experiment_handler import run_trial, prepare_data, \
+    summarize_results, save_results, make_crowd_box_executor, close_crowd_box_executor
+from adaptive_machine_and_crowd.src.utils import make_executor
+
+'''
+    Search of the best AL/crowd budget split, instead of the exhaustive policy_switch_point sweep.
+    Loss (or F_beta) is treated as a noisy function of the switch point and minimized by
+    golden-section search. Every evaluated point gets 'search_reps_init' repetitions, more
+    repetitions (up to 'search_reps_max') are spent only when two compared points are not
+    separated by their confidence intervals.
+'''
+
+INV_PHI = (np.sqrt(5) - 1) / 2  # 1 / golden ratio
+
+
+class NoisyObjective:
+
+    def __init__(self, params, budget_per_item, data, metric='loss', reps_init=3, reps_max=10, z=1.96):
+        self.params = params
+        self.budget_per_item = budget_per_item
+        self.data = data
+        self.metric = metric
+        self.reps_init = reps_init
+        self.reps_max = reps_max
+        self.z = z
+        self.results = {}  # switch_point -> list of results rows
+        # loss is minimized, F_beta is maximized
+        self.sign = 1. if metric == 'loss' else -1.
+        self.column = {'loss': 5, 'f_beta': 4}[metric]
+
+    def add_rep(self, switch_point):
+        rows = self.results.setdefault(switch_point, [])
+        rows.append(run_trial(self.params, self.budget_per_item, switch_point, len(rows), self.data))
+
+    def values(self, switch_point):
+        if len(self.results.get(switch_point, [])) < self.reps_init:
+            for _ in range(self.reps_init - len(self.results.get(switch_point, []))):
+                self.add_rep(switch_point)
+        return np.array([self.sign * row[self.column] for row in self.results[switch_point]])
+
+    def mean_ci(self, switch_point):
+        values = self.values(switch_point)
+        half_width = self.z * values.std(ddof=1) / np.sqrt(len(values)) if len(values) > 1 else np.inf
+        return values.mean(), half_width
+
+    def is_less(self, a, b):
+        '''
+        :return: True if objective in switch point a is lower than in b,
+                 repetitions are added until confidence intervals separate or reps_max is reached
+        '''
+        while True:
+            mean_a, hw_a = self.mean_ci(a)
+            mean_b, hw_b = self.mean_ci(b)
+            if abs(mean_a - mean_b) > hw_a + hw_b:
+                break
+            # spend the next repetition on the noisier point
+            candidates = [(hw, sp) for hw, sp in [(hw_a, a), (hw_b, b)] if len(self.results[sp]) < self.reps_max]
+            if not candidates:
+                break
+            self.add_rep(max(candidates)[1])
+
+        return mean_a < mean_b
+
+
+def golden_section_search(objective, low=0., high=1., tol=0.05, check_bounds=True):
+    '''
+    :param objective: NoisyObjective over switch points
+    :param tol: width of the switch point interval to stop at
+    :param check_bounds: compare the optimum with pure crowd (0.) and pure AL (1.) policies as well
+    :return: best switch point
+    '''
+    a, b = low, high
+    c = round(b - INV_PHI * (b - a), 3)
+    d = round(a + INV_PHI * (b - a), 3)
+    while b - a > tol:
+        if objective.is_less(c, d):
+            b, d = d, c
+            c = round(b - INV_PHI * (b - a), 3)
+        else:
+            a, c = c, d
+            d = round(a + INV_PHI * (b - a), 3)
+    best = c if objective.is_less(c, d) else d
+    if check_bounds:
+        for bound in [low, high]:
+            if objective.is_less(bound, best):
+                best = bound
+
+    return best
+
+
+def run_switch_point_search(params):
+    '''
+    Golden-section search of the switch point per budget,
+    evaluated points are appended to the output csv with suffix '_search'
+    '''
+    executor = make_executor(params.get('n_jobs'))
+    params['executor'] = executor
+    params['crowd_box_executor'] = make_crowd_box_executor(params)
+    data = prepare_data(params)
+
+    df_to_print = pd.DataFrame()
+    for budget_per_item in params['budget_per_item']:
+        print('Switch point search, budget per item: {}'.format(budget_per_item))
+        print('************************************')
+        objective = NoisyObjective(params, budget_per_item, data,
+                                   metric=params.get('search_metric', 'loss'),
+                                   reps_init=params.get('search_reps_init', 3),
+                                   reps_max=params.get('search_reps_max', params['experiment_nums']))
+        best = golden_section_search(objective, tol=params.get('search_tol', 0.05))
+        for switch_point, results_list in sorted(objective.results.items()):
+            df = summarize_results(results_list, params, switch_point)
+            df['best_switch_point'] = best
+            df_to_print = df_to_print.append(df, ignore_index=True)
+        print('best switch point: {}, evaluated points: {}, repetitions: {}'
+              .format(best, len(objective.results), sum(len(r) for r in objective.results.values())))
+
+    save_results(df_to_print, params, suffix='_search')
+
+    if executor is not None:
+        executor.shutdown()
+    params['executor'] = None
+    close_crowd_box_executor(params)
@@ -0,0 +1,111 @@
+import numpy as np
+import scipy.sparse as sp
+
+'''
+    Training data of an active learner with amortized appends.
+    Rows are stored in preallocated arrays whose capacity doubles when full (dense rows, or data/indices/indptr
+    of CSR rows), so teaching a batch copies only the batch. Shuffles permute an index of the stored rows,
+    and ordered() gathers the rows in that order into a reused buffer for fitting.
+    shuffle() draws from the global numpy stream like sklearn.utils.shuffle, so fits see the same data in
+    the same order as with shuffled copies of the training set.
+'''
+
+
+def _grow(array, size):
+    # new array with capacity for at least size rows, doubling the current one
+    capacity = max(size, 2 * array.shape[0], 1)
+    grown = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+    grown[:array.shape[0]] = array
+    return grown
+
+
+class TrainingBuffer:
+
+    def __init__(self, X, y):
+        self.sparse = sp.issparse(X)
+        y = np.asarray(y)
+        self.size = X.shape[0]
+        self.features_num = X.shape[1]
+        if self.sparse:
+            X = sp.csr_matrix(X)
+            self._data, self._indices = X.data.copy(), X.indices.copy()
+            self._indptr = X.indptr.astype(np.int64)
+        else:
+            self._X = np.array(X)
+        self._y = y.copy()
+        self.order = np.arange(self.size)
+        self._X_out = None
+        self._y_out = None
+
+    def __len__(self):
+        return self.size
+
+    def append(self, X, y):
+        y = np.asarray(y)
+        rows_num = X.shape[0]
+        size = self.size + rows_num
+        if size > self._y.shape[0]:
+            self._y = _grow(self._y, size)
+            if not self.sparse:
+                self._X = _grow(self._X, size)
+        self._y[self.size:size] = y
+        if self.sparse:
+            X = sp.csr_matrix(X)
+            nnz, nnz_new = self._indptr[self.size], X.nnz
+            if nnz + nnz_new > self._data.shape[0]:
+                self._data = _grow(self._data, nnz + nnz_new)
+                self._indices = _grow(self._indices, nnz + nnz_new)
+            if size + 1 > self._indptr.shape[0]:
+                self._indptr = _grow(self._indptr, size + 1)
+            self._data[nnz:nnz + nnz_new] = X.data
+            self._indices[nnz:nnz + nnz_new] = X.indices
+            self._indptr[self.size + 1:size + 1] = X.indptr[1:] + nnz
+        else:
+            self._X[self.size:size] = X
+        self.order = np.concatenate([self.order, np.arange(self.size, size)])
+        self.size = size
+
+    def keep_last(self, rows_num):
+        # drop the rows appended first, so that at most rows_num rows are kept, the kept ones keep their order
+        if self.size <= rows_num:
+            return
+        X, y = self.stored()
+        first = self.size - rows_num
+        order = self.order[self.order >= first] - first
+        self.__init__(X[first:], y[first:])
+        self.order = order
+
+    def shuffle(self):
+        # same draws as sklearn.utils.shuffle of the training arrays
+        permutation = np.arange(self.size)
+        np.random.shuffle(permutation)
+        self.order = self.order[permutation]
+
+    def stored(self):
+        '''
+        :return: views of the stored rows (X, y) in the order of appending
+        '''
+        if self.sparse:
+            nnz = self._indptr[self.size]
+            X = sp.csr_matrix((self._data[:nnz], self._indices[:nnz], self._indptr[:self.size + 1]),
+                              shape=(self.size, self.features_num), copy=False)
+        else:
+            X = self._X[:self.size]
+        return X, self._y[:self.size]
+
+    def ordered(self, copy=False):
+        '''
+        :param copy: fresh arrays instead of the reused buffer, for data fitted after the next append
+        :return: (X, y) in the current order
+        '''
+        X, y = self.stored()
+        if self.sparse or copy:
+            return X[self.order], y[self.order]
+        if self._X_out is None or self._X_out.shape[0] < self.size:
+            self._X_out = np.empty((self._X.shape[0],) + self._X.shape[1:], dtype=self._X.dtype)
+            self._y_out = np.empty(self._y.shape[0], dtype=self._y.dtype)
+        X_out, y_out = self._X_out[:self.size], self._y_out[:self.size]
+        # indices are in range, mode='clip' does not buffer the output
+        np.take(X, self.order, axis=0, out=X_out, mode='clip')
+        np.take(y, self.order, out=y_out, mode='clip')
+        return X_out, y_out
@@ -0,0 +1,79 @@
+import numpy as np
+from sklearn.base import clone
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.metrics import roc_auc_score
+from sklearn.model_selection import check_cv
+
+'''
+    Warm-started regularization path for the SGD screening models.
+    The linear model of a learner is fitted along a grid of alpha values, strongest regularization first, on the
+    folds CalibratedClassifierCV uses for calibration. Every fit starts from the coefficients of the previous alpha
+    and stops after one epoch without improvement, so a path of 5 alphas costs about 2 fits of the calibrated
+    learner instead of 5. Alphas are scored by the held-out ROC AUC of the decision function averaged over folds.
+    Used by run_al_box if params['alpha_grid'] is set: the learner of a predicate is tuned on its labelled set
+    before every params['tune_every']-th fit, the fit then uses the best alpha.
+'''
+
+
+def _linear_model(clf):
+    return clf.estimator if isinstance(clf, CalibratedClassifierCV) else clf
+
+
+def alpha_path(clf, X, y, alphas):
+    '''
+    :param clf: CalibratedClassifierCV over SGDClassifier or SGDClassifier (5 stratified folds then)
+    :return: (alphas in decreasing order, mean held-out ROC AUC per alpha, epochs run)
+    '''
+    alphas = np.sort(np.asarray(alphas, dtype=float))[::-1]
+    y = np.asarray(y)
+    cv = check_cv(getattr(clf, 'cv', None), y, classifier=True)
+    # fixed random_state, path fits do not draw from the global numpy stream
+    model = clone(_linear_model(clf)).set_params(random_state=0)
+    scores = np.zeros(len(alphas))
+    folds_num, epochs = 0, 0
+    for train_idx, test_idx in cv.split(X, y):
+        if len(np.unique(y[train_idx])) < 2 or len(np.unique(y[test_idx])) < 2:
+            continue
+        X_train, y_train, X_test = X[train_idx], y[train_idx], X[test_idx]
+        coef, intercept = None, None
+        for i, alpha in enumerate(alphas):
+            warm = coef is not None
+            model.set_params(alpha=alpha, n_iter_no_change=1 if warm else _linear_model(clf).n_iter_no_change)
+            model.fit(X_train, y_train, coef_init=coef, intercept_init=intercept)
+            coef, intercept = model.coef_, model.intercept_
+            epochs += model.n_iter_
+            scores[i] += roc_auc_score(y[test_idx], model.decision_function(X_test))
+        folds_num += 1
+
+    return alphas, scores / max(folds_num, 1), epochs
+
+
+class AlphaTuner:
+    '''
+    Tunes alpha of the linear model of one learner along the path, every `every` fits
+    '''
+
+    def __init__(self, alphas, every=1):
+        self.alphas = alphas
+        self.every = every
+        self.fits_num = 0
+        self.history = []  # (labelled set size, alpha, epochs of the path)
+
+    def tune(self, clf, X, y):
+        '''
+        Set alpha of clf to the best one of the path on (X, y)
+        :return: the best alpha, the current one if no fold has both classes
+        '''
+        alphas, scores, epochs = alpha_path(clf, X, y, self.alphas)
+        model = _linear_model(clf)
+        if epochs:
+            # ties go to the strongest regularization
+            model.set_params(alpha=alphas[np.argmax(scores)])
+        self.history.append((len(y), model.alpha, epochs))
+
+        return model.alpha
+
+    def before_fit(self, clf, X, y):
+        if self.fits_num % self.every == 0:
+            self.tune(clf, X, y)
+        self.fits_num += 1
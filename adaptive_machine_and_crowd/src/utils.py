@@ -1,11 +1,14 @@
 import numpy as np
 import pandas as pd
-import warnings, random
+import warnings, random, hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.model_selection import StratifiedKFold
 from sklearn.metrics import fbeta_score
 
+from adaptive_machine_and_crowd.src.kernels import tally_votes
+
 
 class Vectorizer():
     def __init__(self):
@@ -32,16 +35,13 @@ class CrowdSimulator:
         :param predicate: predicate name for
         :return: aggregated crwodsourced label on items
         '''
+        # base round passes ground truth as dict item_id -> gt
+        gt = np.asarray(list(gt_items.values()) if isinstance(gt_items, dict) else gt_items)
+        acc_draws, vote_draws = np.random.random_sample((2, len(gt), n))
+        in_votes = tally_votes(gt, crowd_acc[0], crowd_acc[1], acc_draws, vote_draws)
         crodsourced_items = []
-        for item_id, gt in zip(item_ids, gt_items):
-            in_votes, out_votes = 0, 0
-            for _ in range(n):
-                worker_acc = random.uniform(crowd_acc[0], crowd_acc[1])
-                worker_vote = np.random.binomial(1, worker_acc if gt == 1 else 1 - worker_acc)
-                if worker_vote == 1:
-                    in_votes += 1
-                else:
-                    out_votes += 1
+        for item_id, item_in_votes in zip(item_ids, in_votes):
+            in_votes, out_votes = int(item_in_votes), n - int(item_in_votes)
             item_label = 1 if in_votes >= out_votes else 0
             crowd_votes_counts[item_id][predicate]['in'] += in_votes
             crowd_votes_counts[item_id][predicate]['out'] += out_votes
@@ -49,6 +49,125 @@ class CrowdSimulator:
         return crodsourced_items
 
 
+class RealVotesCrowd:
+    '''
+    Crowd backend replaying real votes collected per item and predicate, e.g. '<predicate>_in'/'<predicate>_out'
+    columns of crowdsourced datasets. Votes of an item-predicate are stored shuffled in one flat array,
+    the k-th vote bought for an item-predicate is the k-th stored one, where k is the number of real votes
+    already drawn, kept as crowd_votes_counts[item_id][predicate]['drawn'] apart from the 'in'/'out' counts
+    (initial training items get votes that were never drawn). Draws are without replacement, O(1) and
+    independent of the AL-Box/Crowd-Box history. Real votes are not replayed: an item-predicate gets at most
+    the votes collected for it, votes_left reports exhausted item-predicates, which get no more assignments.
+    '''
+
+    def __init__(self, votes_in, votes_out, source=None):
+        '''
+        :param votes_in: dict predicate -> array of IN vote counts per item
+        :param votes_out: dict predicate -> array of OUT vote counts per item
+        :param source: description of where the votes come from for cache_key, a hash of the counts if None
+        '''
+        self.predicates = list(votes_in.keys())
+        if source is None:
+            sha = hashlib.sha256()
+            for pr in self.predicates:
+                sha.update(pr.encode())
+                sha.update(np.asarray(votes_in[pr], dtype=np.int64).tobytes())
+                sha.update(np.asarray(votes_out[pr], dtype=np.int64).tobytes())
+            source = 'counts_sha256={}'.format(sha.hexdigest())
+        self.source = source
+        self.votes_num, self.offsets, self.votes = {}, {}, {}
+        for pr in self.predicates:
+            in_c, out_c = np.asarray(votes_in[pr], dtype=np.int64), np.asarray(votes_out[pr], dtype=np.int64)
+            self.votes_num[pr] = in_c + out_c
+            self.offsets[pr] = np.concatenate([[0], np.cumsum(self.votes_num[pr])[:-1]])
+            # IN votes first, then OUT votes of every item
+            vote_idx = np.arange(self.votes_num[pr].sum()) - np.repeat(self.offsets[pr], self.votes_num[pr])
+            self.votes[pr] = (vote_idx < np.repeat(in_c, self.votes_num[pr])).astype(np.uint8)
+        self._votes_sorted = dict(self.votes)
+        self.shuffle()
+
+    @classmethod
+    def load(cls, file_name, predicates, path_to_project):
+        path = get_data_path(file_name, path_to_project) + file_name
+        with open(path, 'rb') as f:
+            file_hash = hashlib.sha256(f.read()).hexdigest()
+        data = pd.read_csv(path)
+        return cls({pr: data[pr + '_in'].values for pr in predicates},
+                   {pr: data[pr + '_out'].values for pr in predicates},
+                   source='file={}, sha256={}, predicates={}'.format(file_name, file_hash, list(predicates)))
+
+    @property
+    def cache_key(self):
+        return 'RealVotesCrowd({})'.format(self.source)
+
+    def subset(self, item_ids):
+        '''
+        :return: RealVotesCrowd over the votes of item_ids, the i-th item of the subset is item_ids[i]
+        '''
+        votes_in = {pr: self.in_counts(pr)[item_ids] for pr in self.predicates}
+        items_hash = hashlib.sha256(np.asarray(item_ids, dtype=np.int64).tobytes()).hexdigest()
+        return RealVotesCrowd(votes_in, {pr: self.votes_num[pr][item_ids] - votes_in[pr] for pr in self.predicates},
+                              source='{}, items_sha256={}'.format(self.source, items_hash))
+
+    def in_counts(self, predicate):
+        # IN votes per item, items may have no votes
+        item_of_vote = np.repeat(np.arange(len(self.votes_num[predicate])), self.votes_num[predicate])
+        return np.bincount(item_of_vote, weights=self.votes[predicate],
+                           minlength=len(self.votes_num[predicate])).astype(np.int64)
+
+    def shuffle(self):
+        # new order of votes within every item-predicate, call once per repetition,
+        # the order depends on the random state only, not on the repetitions shuffled before
+        for pr in self.predicates:
+            item_of_vote = np.repeat(np.arange(len(self.votes_num[pr])), self.votes_num[pr])
+            order = np.lexsort((np.random.random(len(item_of_vote)), item_of_vote))
+            self.votes[pr] = self._votes_sorted[pr][order]
+
+    def accuracy(self, predicate, gt):
+        '''
+        :param gt: array of ground truth values per item
+        :return: share of real votes agreeing with the ground truth
+        '''
+        in_c = self.in_counts(predicate)
+        correct = np.where(np.asarray(gt) == 1, in_c, self.votes_num[predicate] - in_c)
+        return correct.sum() / self.votes_num[predicate].sum()
+
+    def votes_left(self, predicate, item_ids, crowd_votes_counts):
+        '''
+        :return: array of real votes not drawn yet per item on the predicate, 0 if the item-predicate is exhausted
+        '''
+        drawn = np.array([crowd_votes_counts[item_id][predicate].get('drawn', 0) for item_id in item_ids],
+                         dtype=np.int64)
+        return self.votes_num[predicate][np.asarray(item_ids, dtype=np.int64)] - drawn
+
+    def crowdsource_items(self, item_ids, gt_items, predicate, crowd_acc, n, crowd_votes_counts):
+        '''
+        Same interface as CrowdSimulator.crowdsource_items, gt_items and crowd_acc are not used.
+        An item gets min(n, votes left) votes, the label of an item without votes left is IN
+        :return: aggregated crwodsourced label on items
+        '''
+        votes, offsets, votes_num = self.votes[predicate], self.offsets[predicate], self.votes_num[predicate]
+        crodsourced_items = []
+        for item_id in item_ids:
+            counts = crowd_votes_counts[item_id][predicate]
+            drawn = counts.get('drawn', 0)
+            start = offsets[item_id] + drawn
+            votes_drawn = min(n, votes_num[item_id] - drawn)
+            in_votes = int(votes[start:start + votes_drawn].sum())
+            out_votes = votes_drawn - in_votes
+            counts['in'] += in_votes
+            counts['out'] += out_votes
+            counts['drawn'] = drawn + votes_drawn
+            crodsourced_items.append(1 if in_votes >= out_votes else 0)
+        return crodsourced_items
+
+
+def votes_cast(crowd_votes_counts, item_ids, predicate):
+    # votes counted on the items, spend is the difference before and after crowdsourcing
+    return sum(crowd_votes_counts[item_id][predicate]['in'] + crowd_votes_counts[item_id][predicate]['out']
+               for item_id in item_ids)
+
+
 # screening metrics, aimed to obtain high recall
 class MetricsMixin:
 
@@ -86,7 +205,7 @@ class MetricsMixin:
         return precision, recall, fbeta, loss, fn, fp
 
 
-def load_data(file_name, predicates, path_to_project):
+def get_data_path(file_name, path_to_project):
     path_dict = {
         '100000_reviews_lemmatized_old.csv': path_to_project + 'data/amazon-sentiment-dataset/',
         '5000_reviews_lemmatized.csv': path_to_project + 'data/amazon-sentiment-dataset/',
@@ -94,9 +213,15 @@ def load_data(file_name, predicates, path_to_project):
         'ohsumed_C10_C23_1grams.csv': path_to_project + '/data/ohsumed_data/',
         'ohsumed_C14_C23_1grams.csv': path_to_project + 'data/ohsumed_data/',
         'loneliness-dataset-2018.csv': path_to_project + 'data/loneliness-dataset-2018/',
-        'crisis-lemmatized_witness_inf.csv': path_to_project + 'data/crisis-dataset/'
+        'crisis-lemmatized_witness_inf.csv': path_to_project + 'data/crisis-dataset/',
+        '1k_amazon_reviews_crowdsourced_lemmatized_min3votes.csv': path_to_project + 'data/amazon-sentiment-dataset/',
+        '1k_amazon_reviews_crowdsourced_lemmatized_min5votes.csv': path_to_project + 'data/amazon-sentiment-dataset/'
     }
-    path = path_dict[file_name]
+    return path_dict[file_name]
+
+
+def load_data(file_name, predicates, path_to_project):
+    path = get_data_path(file_name, path_to_project)
     data = pd.read_csv(path + file_name)
     X = data['tokens'].values
     y_screening = data['Y'].values
@@ -119,6 +244,17 @@ def get_init_training_data_idx(y_screening, y_predicate_train, init_train_size):
    return train_idx
 
 
+def make_executor(n_jobs=None):
+    '''
+    Thread pool, workers share the feature matrix and the learners without copying them
+    :param n_jobs: number of workers, None or 1 keeps predicate learners sequential
+    :return: executor to pass as params['executor'] or None
+    '''
+    if not n_jobs or n_jobs == 1:
+        return None
+    return ThreadPoolExecutor(max_workers=n_jobs)
+
+
 # random sampling strategy for modAL
 def random_sampling(_, X, n_instances=1):
     query_idx = random.sample(range(X.shape[0]), n_instances)
@@ -127,13 +263,15 @@ def random_sampling(_, X, n_instances=1):
 
 
 # sampling takes into account conjunctive expression of predicates
-def objective_aware_sampling(classifier, X, learners_, n_instances=1, **uncertainty_measure_kwargs):
+# l_prob_in: joint prob of other predicates being IN, if already computed by the caller
+def objective_aware_sampling(classifier, X, learners_, n_instances=1, l_prob_in=None, **uncertainty_measure_kwargs):
     from modAL.uncertainty import classifier_uncertainty, multi_argmax
     uncertainty = classifier_uncertainty(classifier, X, **uncertainty_measure_kwargs)
-    l_prob_in = np.ones(X.shape[0])
     if learners_:
-        for l in learners_.values():
-            l_prob_in *= l.learner.predict_proba(X)[:, 1]
+        if l_prob_in is None:
+            l_prob_in = np.ones(X.shape[0])
+            for l in learners_.values():
+                l_prob_in *= l.learner.predict_proba(X)[:, 1]
         uncertainty_weighted = l_prob_in * uncertainty
     else:
         uncertainty_weighted = uncertainty
@@ -144,7 +282,7 @@ def objective_aware_sampling(classifier, X, learners_, n_instances=1, **uncertai
 
 
 # sampling takes into account conjunctive expression of predicates
-def mix_sampling(classifier, X, learners_, n_instances=1, **uncertainty_measure_kwargs):
+def mix_sampling(classifier, X, learners_, n_instances=1, l_prob_in=None, **uncertainty_measure_kwargs):
     from modAL.uncertainty import classifier_uncertainty, multi_argmax
     epsilon = 0.5
     uncertainty = classifier_uncertainty(classifier, X, **uncertainty_measure_kwargs)
@@ -152,10 +290,11 @@ def mix_sampling(classifier, X, learners_, n_instances=1, **uncertainty_measure_
     if np.random.binomial(1, epsilon):
         query_idx = np.array(random.sample(range(0, X.shape[0]-1), n_instances))
     else:
-        l_prob_in = np.ones(X.shape[0])
         if learners_:
-            for l in learners_.values():
-                l_prob_in *= l.learner.predict_proba(X)[:, 1]
+            if l_prob_in is None:
+                l_prob_in = np.ones(X.shape[0])
+                for l in learners_.values():
+                    l_prob_in *= l.learner.predict_proba(X)[:, 1]
             uncertainty_weighted = l_prob_in * uncertainty
         else:
             uncertainty_weighted = uncertainty
@@ -168,48 +307,43 @@ def mix_sampling(classifier, X, learners_, n_instances=1, **uncertainty_measure_
 # Mixin for ScreeningActiveLearner if to use adaptive_policy for learning-exploitation
 class ChoosePredicateMixin:
 
-    def init_stat(self):
+    def init_stat(self, window=5):
         # initialize statistic for predicates
         self.stat = {}
+        # prequential evaluation: (y_true, y_pred) of the last `window` queried batches per predicate
+        self.prequential = {}
         for predicate in self.predicates:
             self.stat[predicate] = {
                 'num_items_queried': [],
                 'f_beta': [],
             }
+            self.prequential[predicate] = deque(maxlen=window)
+
+    # score a queried batch with the current learner before it is taught on the batch
+    def score_prequential(self, predicate, X_batch, y_batch):
+        y_pred = self.learners[predicate].learner.predict(X_batch)
+        self.prequential[predicate].append((np.asarray(y_batch), y_pred))
 
     # compute and update performance statistic for predicate-based classifiers
     def update_stat(self):
-        # do cross validation
-        # estimate and save statistics for extrapolation
-        window = 5
+        # f_beta over the window of prequentially scored batches, no extra model fits
         for predicate in self.predicates:
             s = self.stat[predicate]
             assert (len(s['num_items_queried']) == len(s['f_beta'])), 'Stat attribute error'
 
-            l = self.learners[predicate]
-            X, y = l.learner.X_training, l.learner.y_training
-            tpr_list, tnr_list, f_beta_list = [], [], []
-            k = 5
-            skf = StratifiedKFold(n_splits=k)
-            for train_idx, val_idx in skf.split(np.empty(y.shape[0]), y):
-                X_train, X_val = X[train_idx], X[val_idx]
-                y_train, y_val = y[train_idx], y[val_idx]
-                clf = l.learner
-                clf.fit(X_train, y_train)
-                f_beta_list.append(fbeta_score(y_val, clf.predict(X_val), beta=self.beta, average='binary'))
-            l.learner.fit(X, y)
-
-            f_beta_mean = np.mean(f_beta_list)
+            batches = self.prequential[predicate]
+            if batches:
+                y_true = np.concatenate([y for y, _ in batches])
+                y_pred = np.concatenate([y for _, y in batches])
+                f_beta = fbeta_score(y_true, y_pred, beta=self.beta, average='binary')
+            else:
+                f_beta = 0.
             try:
                 num_items_queried_prev = self.stat[predicate]['num_items_queried'][-1]
             except IndexError:
                 num_items_queried_prev = 0
 
-            if len(self.stat[predicate]['num_items_queried']) >= window - 1:
-                f_beta_avg = (sum(self.stat[predicate]['f_beta'][-(window-1):]) + f_beta_mean) / window
-                self.stat[predicate]['f_beta'].append(f_beta_avg)
-            else:
-                self.stat[predicate]['f_beta'].append(f_beta_mean)
+            self.stat[predicate]['f_beta'].append(f_beta)
             self.stat[predicate]['num_items_queried'].append((num_items_queried_prev + self.n_instances_query))
 
     def select_predicate_stop(self, param):
@@ -0,0 +1,86 @@
+import numpy as np
+
+'''
+    Common random numbers for simulated crowds: a pre-drawn tape per repetition of whether the k-th simulated
+    worker voting on an item-predicate is correct, for every (item, predicate, vote index k < max_votes).
+    All configurations run in a repetition read the same tape, so the k-th vote bought for an item-predicate is
+    the same whatever the sampling strategy, switch point or budget, and differences between configurations are
+    paired. k is the number of votes already counted in crowd_votes_counts and votes are replayed cyclically
+    past max_votes.
+    The tape of repetition i depends only on (seed, i): the worker accuracy is drawn uniformly from crowd_acc of
+    the predicate and the vote is correct with that probability, as in CrowdSimulator. Correctness is stored
+    bit-packed, items * predicates * max_votes / 8 bytes per repetition.
+    Used as the crowd backend: params['crowd'] = VoteTape(items_num, predicates, crowd_acc, seed=0)
+'''
+
+
+class VoteTape:
+
+    def __init__(self, items_num, predicates, crowd_acc, seed=0, max_votes=32):
+        '''
+        :param crowd_acc: dict predicate -> (low, high) worker accuracy range
+        :param max_votes: votes per item-predicate on the tape, a multiple of 8
+        '''
+        if max_votes % 8:
+            raise ValueError('max_votes has to be a multiple of 8')
+        self.items_num = items_num
+        self.predicates = list(predicates)
+        self.crowd_acc = {pr: tuple(crowd_acc[pr]) for pr in self.predicates}
+        self.seed = seed
+        self.max_votes = max_votes
+        self.repetition = None
+        self.tape = None
+        self.start_repetition(0)
+
+    @property
+    def cache_key(self):
+        return 'VoteTape(seed={}, max_votes={}, crowd_acc={})'.format(self.seed, self.max_votes, self.crowd_acc)
+
+    def start_repetition(self, repetition):
+        # the tape of a repetition is drawn from its own stream, independent of the global one
+        if repetition == self.repetition:
+            return
+        rng = np.random.RandomState([self.seed, repetition])
+        tape = np.empty((len(self.predicates), self.items_num, self.max_votes // 8), dtype=np.uint8)
+        for j, pr in enumerate(self.predicates):
+            acc_low, acc_high = self.crowd_acc[pr]
+            worker_acc = acc_low + rng.random_sample((self.items_num, self.max_votes)) * (acc_high - acc_low)
+            tape[j] = np.packbits(rng.random_sample((self.items_num, self.max_votes)) < worker_acc, axis=1)
+        self.tape = tape
+        self.repetition = repetition
+
+    def shuffle(self):
+        # next repetition, for callers that do not pass the repetition index
+        self.start_repetition(0 if self.repetition is None else self.repetition + 1)
+
+    def correct(self, predicate, item_ids, vote_idx):
+        '''
+        :param vote_idx: int array [items, votes] of vote indexes
+        :return: 1 if the vote is correct, [items, votes]
+        '''
+        vote_idx = vote_idx % self.max_votes
+        packed = self.tape[self.predicates.index(predicate), np.asarray(item_ids)[:, None], vote_idx >> 3]
+        return (packed >> (7 - (vote_idx & 7))) & 1
+
+    def crowdsource_items(self, item_ids, gt_items, predicate, crowd_acc, n, crowd_votes_counts):
+        '''
+        Same interface as CrowdSimulator.crowdsource_items, crowd_acc is fixed when the tape is drawn
+        :return: aggregated crwodsourced label on items
+        '''
+        if tuple(crowd_acc) != self.crowd_acc[predicate]:
+            raise ValueError('Vote tape was drawn for crowd accuracy {} on {}, got {}'
+                             .format(self.crowd_acc[predicate], predicate, tuple(crowd_acc)))
+        # base round passes ground truth as dict item_id -> gt
+        gt = np.asarray(list(gt_items.values()) if isinstance(gt_items, dict) else gt_items)
+        item_ids = np.asarray(item_ids, dtype=np.int64)
+        cast = np.array([crowd_votes_counts[item_id][predicate]['in'] + crowd_votes_counts[item_id][predicate]['out']
+                         for item_id in item_ids], dtype=np.int64)
+        correct = self.correct(predicate, item_ids, cast[:, None] + np.arange(n))
+        in_votes = np.where(gt[:, None] == 1, correct, 1 - correct).sum(axis=1)
+        crodsourced_items = []
+        for item_id, item_in_votes in zip(item_ids, in_votes):
+            in_votes, out_votes = int(item_in_votes), n - int(item_in_votes)
+            crowd_votes_counts[item_id][predicate]['in'] += in_votes
+            crowd_votes_counts[item_id][predicate]['out'] += out_votes
+            crodsourced_items.append(1 if in_votes >= out_votes else 0)
+        return crodsourced_items
@@ -0,0 +1,308 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+import traceback
+import multiprocessing
+
+from adaptive_machine_and_crowd.src.datasets import DATASETS
+from adaptive_machine_and_crowd.src.experiment_server import split_tasks, _run_task, _init_worker
+
+'''
+    Distribution of experiment sweeps over several processes and hosts through an SQLite work queue.
+    The coordinator writes one task per (dataset, sampling strategy, grid cell, repetition), or per
+    repetition covering all cells if 'fork_al', workers claim tasks with a lease, keep the lease alive
+    while running the task and write the results rows back. Leases of crashed or stalled workers expire
+    and their tasks are requeued. The database file has to be on a filesystem with working file locks
+    (a local disk or a shared mount supporting POSIX locks), clocks of the hosts are assumed to be in sync.
+
+        python -m adaptive_machine_and_crowd.src.work_queue coordinator sweep.db --datasets crisis,slr
+        python -m adaptive_machine_and_crowd.src.work_queue worker sweep.db --processes 4   # on every host
+        python -m adaptive_machine_and_crowd.src.work_queue status sweep.db
+        python -m adaptive_machine_and_crowd.src.work_queue collect sweep.db results.csv
+'''
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sweep TEXT NOT NULL,
+    task TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, task_id);
+CREATE TABLE IF NOT EXISTS results (
+    task_id INTEGER NOT NULL,
+    sweep TEXT NOT NULL,
+    dataset TEXT NOT NULL,
+    sampling_strategy TEXT NOT NULL,
+    row TEXT NOT NULL
+);
+'''
+
+
+class WorkQueue:
+
+    def __init__(self, path, lease_seconds=600, max_attempts=3):
+        '''
+        :param lease_seconds: a claimed task is requeued if its lease is not renewed within this time
+        :param max_attempts: a task failing that many times is marked 'failed'
+        '''
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # autocommit mode, transactions are opened explicitly
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def _transaction(self, func, *args):
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers never claim the same task
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = func(*args)
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+        return result
+
+    def enqueue(self, sweep, tasks):
+        def insert():
+            self.conn.executemany('INSERT INTO tasks (sweep, task) VALUES (?, ?)',
+                                  [(sweep, json.dumps(task)) for task in tasks])
+        self._transaction(insert)
+
+    def claim(self, worker):
+        '''
+        :return: (task_id, task) with a lease for the worker, or None if nothing is pending
+        '''
+        def claim_next():
+            now = time.time()
+            self._requeue_expired(now)
+            row = self.conn.execute("SELECT task_id, task FROM tasks WHERE status = 'pending' "
+                                    "ORDER BY task_id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE tasks SET status = 'leased', worker = ?, lease_expires = ?, "
+                              "attempts = attempts + 1 WHERE task_id = ?", (worker, now + self.lease_seconds, row[0]))
+            return row[0], json.loads(row[1])
+        return self._transaction(claim_next)
+
+    def _requeue_expired(self, now):
+        self.conn.execute("UPDATE tasks SET status = 'pending', worker = NULL, lease_expires = NULL "
+                          "WHERE status = 'leased' AND lease_expires < ? AND attempts < ?", (now, self.max_attempts))
+        self.conn.execute("UPDATE tasks SET status = 'failed', error = 'lease expired' "
+                          "WHERE status = 'leased' AND lease_expires < ?", (now,))
+
+    def renew(self, task_id, worker):
+        '''
+        :return: False if the lease was lost (expired and requeued)
+        '''
+        def renew_lease():
+            return self.conn.execute("UPDATE tasks SET lease_expires = ? WHERE task_id = ? AND worker = ? "
+                                     "AND status = 'leased'",
+                                     (time.time() + self.lease_seconds, task_id, worker)).rowcount == 1
+        return self._transaction(renew_lease)
+
+    def complete(self, task_id, worker, dataset, sampling_strategy, rows):
+        '''
+        Results are written only if the worker still holds the lease, otherwise the task runs elsewhere
+        :return: True if the results were accepted
+        '''
+        def write_results():
+            updated = self.conn.execute("UPDATE tasks SET status = 'done', lease_expires = NULL "
+                                        "WHERE task_id = ? AND worker = ? AND status = 'leased'",
+                                        (task_id, worker)).rowcount
+            if updated != 1:
+                return False
+            sweep = self.conn.execute('SELECT sweep FROM tasks WHERE task_id = ?', (task_id,)).fetchone()[0]
+            self.conn.executemany('INSERT INTO results VALUES (?, ?, ?, ?, ?)',
+                                  [(task_id, sweep, dataset, sampling_strategy, json.dumps(row)) for row in rows])
+            return True
+        return self._transaction(write_results)
+
+    def fail(self, task_id, worker, error):
+        def release():
+            self.conn.execute("UPDATE tasks SET status = CASE WHEN attempts < ? THEN 'pending' ELSE 'failed' END, "
+                              "worker = NULL, lease_expires = NULL, error = ? "
+                              "WHERE task_id = ? AND worker = ? AND status = 'leased'",
+                              (self.max_attempts, error, task_id, worker))
+        self._transaction(release)
+
+    def status(self):
+        with self.lock:
+            counts = dict(self.conn.execute('SELECT status, COUNT(*) FROM tasks GROUP BY status').fetchall())
+        return {status: counts.get(status, 0) for status in ['pending', 'leased', 'done', 'failed']}
+
+    def results(self, sweep=None):
+        query = 'SELECT sweep, dataset, sampling_strategy, row FROM results'
+        with self.lock:
+            rows = self.conn.execute(query + ' WHERE sweep = ?', (sweep,)).fetchall() if sweep \
+                else self.conn.execute(query).fetchall()
+        return [dict(json.loads(row), sweep=sweep_, dataset=dataset, sampling_strategy=strategy)
+                for sweep_, dataset, strategy, row in rows]
+
+
+def make_sweep_tasks(datasets, sampling_strategies, spec):
+    '''
+    :param spec: experiment parameters shared by the sweep ('budget_per_item', 'policy_switch_point', ...)
+    :return: tasks as for the experiment server, one spec per dataset and sampling strategy
+    '''
+    tasks = []
+    for dataset in datasets:
+        for sampling_strategy in sampling_strategies:
+            tasks.extend(split_tasks(dict(spec, dataset=dataset, sampling_strategy=sampling_strategy)))
+    return tasks
+
+
+def _keep_lease(work_queue, task_id, worker, done, interval):
+    # renew the lease of one task until it is done, or the lease is lost
+    while not done.wait(interval):
+        if not work_queue.renew(task_id, worker):
+            return
+
+
+def run_worker(path, lease_seconds=600, poll_seconds=5., max_tasks=None, run_task=_run_task):
+    '''
+    Claims and runs tasks until the queue has nothing pending or leased
+    :param run_task: func((spec, cells, experiment_id)) -> results rows
+    :return: number of tasks completed by this worker
+    '''
+    work_queue = WorkQueue(path, lease_seconds)
+    worker = '{}:{}'.format(socket.gethostname(), os.getpid())
+    completed = 0
+    while max_tasks is None or completed < max_tasks:
+        claimed = work_queue.claim(worker)
+        if claimed is None:
+            status = work_queue.status()
+            if status['leased'] == 0:
+                break
+            # tasks of other workers may be requeued if their leases expire
+            time.sleep(poll_seconds)
+            continue
+        task_id, (spec, cells, experiment_id) = claimed
+        cells = [tuple(cell) for cell in cells]
+
+        # renew the lease in the background while the task runs, one heartbeat per task
+        done = threading.Event()
+        heartbeat = threading.Thread(target=_keep_lease, args=(work_queue, task_id, worker, done, lease_seconds / 3),
+                                     name='lease-{}'.format(task_id), daemon=True)
+        heartbeat.start()
+        try:
+            rows = run_task((spec, cells, experiment_id))
+        except Exception:
+            work_queue.fail(task_id, worker, traceback.format_exc(limit=5))
+            continue
+        finally:
+            done.set()
+            heartbeat.join()
+        if work_queue.complete(task_id, worker, spec['dataset'], spec['sampling_strategy'], rows):
+            completed += 1
+    work_queue.close()
+
+    return completed
+
+
+def _worker_process(args):
+    path, lease_seconds, preload = args
+    _init_worker(preload)
+    return run_worker(path, lease_seconds)
+
+
+def run_workers(path, processes_num, lease_seconds=600, preload=()):
+    '''
+    Runs several worker processes on this host
+    :return: number of tasks completed per process
+    '''
+    with multiprocessing.Pool(processes_num) as pool:
+        return pool.map(_worker_process, [(path, lease_seconds, list(preload))] * processes_num)
+
+
+def collect(path, output_file, sweep=None):
+    '''
+    Writes results rows and mean/std per (dataset, sampling strategy, budget, switch point) to csv files
+    '''
+    import pandas as pd
+    work_queue = WorkQueue(path)
+    df = pd.DataFrame(work_queue.results(sweep))
+    work_queue.close()
+    if df.empty:
+        return df
+    df.to_csv(output_file, index=False)
+    keys = ['sweep', 'dataset', 'sampling_strategy', 'budget_per_item', 'AL_switch_point']
+    metrics = ['budget_spent_per_item', 'precision', 'recall', 'f_beta', 'loss', 'fn_count', 'fp_count']
+    summary = df.groupby(keys)[metrics].agg(['mean', 'std'])
+    summary.columns = ['{}_{}'.format(metric, stat) for metric, stat in summary.columns]
+    summary['reps_used'] = df.groupby(keys).size()
+    summary = summary.reset_index()
+    summary.to_csv(output_file[:-4] + '_summary.csv' if output_file.endswith('.csv')
+                   else output_file + '_summary', index=False)
+
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='SQLite work queue for experiment sweeps')
+    subparsers = parser.add_subparsers(dest='command')
+    coordinator_parser = subparsers.add_parser('coordinator')
+    coordinator_parser.add_argument('db')
+    coordinator_parser.add_argument('--sweep', default=time.strftime('%Y%m%d-%H%M%S'))
+    coordinator_parser.add_argument('--datasets', default=','.join(DATASETS), help='comma separated dataset names')
+    coordinator_parser.add_argument('--sampling-strategies', default='random_sampling,uncertainty_sampling')
+    coordinator_parser.add_argument('--spec', default='{}', help='json string or file with experiment parameters')
+    worker_parser = subparsers.add_parser('worker')
+    worker_parser.add_argument('db')
+    worker_parser.add_argument('--processes', type=int, default=1)
+    worker_parser.add_argument('--lease-seconds', type=float, default=600)
+    worker_parser.add_argument('--preload', default='', help='comma separated dataset names')
+    status_parser = subparsers.add_parser('status')
+    status_parser.add_argument('db')
+    collect_parser = subparsers.add_parser('collect')
+    collect_parser.add_argument('db')
+    collect_parser.add_argument('output')
+    collect_parser.add_argument('--sweep', default=None)
+    args = parser.parse_args(argv)
+
+    if args.command == 'coordinator':
+        # the full grid of main.py by default
+        spec = {
+            'budget_per_item': list(range(1, 9)),
+            'policy_switch_point': [round(0.1 * i, 1) for i in range(11)],
+            'experiment_nums': 10,
+            'fork_al': True
+        }
+        spec.update(json.load(open(args.spec)) if os.path.isfile(args.spec) else json.loads(args.spec))
+        tasks = make_sweep_tasks(args.datasets.split(','), args.sampling_strategies.split(','), spec)
+        work_queue = WorkQueue(args.db)
+        work_queue.enqueue(args.sweep, tasks)
+        print('sweep {}: {} tasks enqueued, queue status: {}'.format(args.sweep, len(tasks), work_queue.status()))
+        work_queue.close()
+    elif args.command == 'worker':
+        preload = [d for d in args.preload.split(',') if d]
+        completed = run_workers(args.db, args.processes, args.lease_seconds, preload)
+        print('tasks completed per process: {}'.format(completed))
+    elif args.command == 'status':
+        work_queue = WorkQueue(args.db)
+        print(work_queue.status())
+        work_queue.close()
+    elif args.command == 'collect':
+        summary = collect(args.db, args.output, args.sweep)
+        print('{} summary rows written'.format(len(summary)))
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
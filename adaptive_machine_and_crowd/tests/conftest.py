@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from sklearn.linear_model import SGDClassifier
+from sklearn.calibration import CalibratedClassifierCV
+
+from adaptive_machine_and_crowd.src.utils import Vectorizer, random_sampling
+from adaptive_machine_and_crowd.src.active_learning import Learner, ScreeningActiveLearner
+
+
+def make_docs(rng, docs_num=300):
+    '''
+    :return: documents of random words, label per predicate, a predicate is IN if its topic word is in the document
+    '''
+    vocabulary = ['w{}'.format(i) for i in range(300)]
+    docs, y_predicate = [], {'p0': [], 'p1': []}
+    for _ in range(docs_num):
+        words = list(rng.choice(vocabulary, rng.randint(5, 30)))
+        for pr, topic in [('p0', 'alpha'), ('p1', 'beta')]:
+            is_in = rng.random_sample() < 0.5
+            if is_in:
+                words += [topic] * rng.randint(1, 3)  # repeated words, for sublinear tf
+            y_predicate[pr].append(int(is_in))
+        rng.shuffle(words)
+        docs.append(' '.join(words))
+    return docs, {pr: np.array(y) for pr, y in y_predicate.items()}
+
+
+@pytest.fixture(scope='module')
+def screening_learners():
+    '''
+    :return: (fitted Vectorizer, ScreeningActiveLearner of calibrated linear learners, documents)
+    '''
+    docs, y_predicate = make_docs(np.random.RandomState(0))
+    vectorizer = Vectorizer()
+    X_features = vectorizer.fit_transform(docs)
+    train_rows, pool_rows = np.arange(200), np.arange(200, len(docs))
+    learners = {}
+    for i, pr in enumerate(y_predicate):
+        clf = CalibratedClassifierCV(SGDClassifier(class_weight='balanced', max_iter=1000, tol=1e-3, random_state=i), cv=3)
+        learners[pr] = Learner({'clf': clf, 'sampling_strategy': random_sampling})
+        learners[pr].setup_active_learner(X_features[train_rows], y_predicate[pr][train_rows], X_features, pool_rows,
+                                          y_predicate[pr][pool_rows])
+    SAL = ScreeningActiveLearner({'n_instances_query': 10, 'screening_out_threshold': 0.7, 'lr': 5, 'beta': 1,
+                                  'learners': learners})
+    return vectorizer, SAL, docs
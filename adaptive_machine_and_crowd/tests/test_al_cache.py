@@ -0,0 +1,54 @@
+import os
+
+import numpy as np
+
+from adaptive_machine_and_crowd.src import experiment_handler
+from adaptive_machine_and_crowd.src.al_cache import ALBoxCache
+from adaptive_machine_and_crowd.src.vote_tape import VoteTape
+from adaptive_machine_and_crowd.src.utils import random_sampling
+from adaptive_machine_and_crowd.src.datasets import get_dataset_config
+
+path_to_project = os.path.realpath(__file__)[:-len('adaptive_machine_and_crowd/tests/test_al_cache.py')]
+CELLS = [(2, 0.3), (2, 0.6)]
+
+
+def _params(cache_path, **kwargs):
+    params = dict(get_dataset_config('crisis'), path_to_project=path_to_project, al_cache_path=str(cache_path),
+                  seed=0, n_instances_query=100, size_init_train_data=20, screening_out_threshold=0.99,
+                  stop_score=50, lr=5, beta=1, crowd_votes_per_item_al=3, sampling_strategy=random_sampling)
+    params.update(kwargs)
+    return params
+
+
+def test_key_depends_on_vote_tape_repetition(tmp_path):
+    params = _params(tmp_path)
+    cache = ALBoxCache(str(tmp_path))
+    digests = []
+    for seed, repetition in [(0, 1), (1, 0)]:
+        tape = VoteTape(10, params['predicates'], params['crowd_acc'], seed=0)
+        tape.start_repetition(repetition)
+        digests.append(cache.key(dict(params, crowd=tape), 100, seed + repetition)[0])
+    # trial seeds are equal, the tapes read by the AL-Box are not
+    assert digests[0] != digests[1]
+    assert cache.key(params, 100, 1)[0] == cache.key(dict(params), 100, 1)[0]
+    assert cache.key(params, 100, 1)[0] != cache.key(params, 200, 1)[0]
+
+
+def test_cache_miss_then_hit(tmp_path, monkeypatch):
+    al_box_runs = []
+    run_al_box = experiment_handler.run_al_box
+
+    def counted_run_al_box(*args, **kwargs):
+        al_box_runs.append(1)
+        return run_al_box(*args, **kwargs)
+
+    monkeypatch.setattr(experiment_handler, 'run_al_box', counted_run_al_box)
+    data = experiment_handler.prepare_data(_params(tmp_path))
+    rows = [experiment_handler.run_forked_trials(_params(tmp_path), CELLS, 0, data) for _ in range(2)]
+    assert len(al_box_runs) == 1  # the second run is served from the cache
+    assert len(os.listdir(str(tmp_path))) == len(CELLS)
+    np.testing.assert_array_equal(rows[0], rows[1])
+
+    # another repetition of the same seed misses
+    experiment_handler.run_forked_trials(_params(tmp_path), CELLS, 1, data)
+    assert len(al_box_runs) == 2 and len(os.listdir(str(tmp_path))) == 2 * len(CELLS)
@@ -0,0 +1,75 @@
+import os
+
+import numpy as np
+
+from adaptive_machine_and_crowd.src import dedup
+from adaptive_machine_and_crowd.src.dedup import find_duplicates, collapse_data, DuplicateClusters
+
+DATASET_FILE_NAME = 'crisis-lemmatized_witness_inf.csv'
+
+
+def _docs(rng, docs_num=60, copies=(3, 7, 12, 13, 40)):
+    '''
+    :param copies: items that are near-duplicates of the item before them
+    :return: documents of distinct random words, roots expected from find_duplicates
+    '''
+    vocabulary = ['w{}'.format(i) for i in range(5000)]
+    docs = [' '.join(rng.choice(vocabulary, 30)) for _ in range(docs_num)]
+    roots = np.arange(docs_num)
+    for item_id in copies:
+        tokens = docs[item_id - 1].split()
+        tokens[-1] = 'changed'  # one shingle of 29 differs
+        docs[item_id] = ' '.join(tokens)
+        roots[item_id] = roots[item_id - 1]
+    return np.array(docs), roots
+
+
+def test_find_duplicates():
+    docs, roots = _docs(np.random.RandomState(0))
+    np.testing.assert_array_equal(find_duplicates(docs, 0.8).roots, roots)
+    # large buckets compared within a window find the same adjacent duplicates
+    np.testing.assert_array_equal(find_duplicates(docs, 0.8, max_bucket_size=2).roots, roots)
+    # exact copies are merged whatever the threshold
+    np.testing.assert_array_equal(find_duplicates(np.array(['a b c', 'd e f', 'a b c']), 1.).roots, [0, 1, 0])
+
+
+def test_expand_labels():
+    clusters = DuplicateClusters([0, 0, 2, 0, 2, 5])
+    np.testing.assert_array_equal(clusters.representatives, [0, 2, 5])
+    assert clusters.collapsed_num == 3
+    assert clusters.expand_labels({0: 1, 1: 0, 2: 1}) == {0: 1, 1: 1, 2: 0, 3: 1, 4: 0, 5: 1}
+    np.testing.assert_array_equal(clusters.expand([0.1, 0.2, 0.3]), [0.1, 0.1, 0.2, 0.1, 0.2, 0.3])
+
+
+def test_collapse_expand_round_trip(tmp_path, capsys):
+    rng = np.random.RandomState(1)
+    docs, roots = _docs(rng)
+    # the dataset file is only hashed for the cache key
+    path_to_project = str(tmp_path) + '/'
+    os.makedirs(path_to_project + 'data/crisis-dataset/')
+    with open(path_to_project + 'data/crisis-dataset/' + DATASET_FILE_NAME, 'w') as f:
+        f.write('\n'.join(docs))
+    params = {'dataset_file_name': DATASET_FILE_NAME, 'path_to_project': path_to_project, 'dedup_threshold': 0.8}
+    # labels are constant within clusters, as for duplicates of a dataset
+    y_predicate = {'p0': rng.randint(0, 2, len(docs))[roots], 'p1': rng.randint(0, 2, len(docs))[roots]}
+    y_screening = y_predicate['p0'] * y_predicate['p1']
+    X_features = rng.random_sample((len(docs), 4))
+    dedup._clusters_cache.clear()
+
+    collapsed, clusters = collapse_data((docs, y_screening, y_predicate, None, X_features), params)
+    X_reps, y_screening_reps, y_predicate_reps, _, X_features_reps = collapsed
+    np.testing.assert_array_equal(clusters.roots, roots)
+    assert len(X_reps) == len(docs) - 5 and clusters.items_num == len(docs)
+    np.testing.assert_array_equal(X_features_reps, X_features[clusters.representatives])
+    np.testing.assert_array_equal(clusters.expand(y_screening_reps), y_screening)
+    for pr in y_predicate:
+        np.testing.assert_array_equal(clusters.expand(y_predicate_reps[pr]), y_predicate[pr])
+    expanded = clusters.expand_labels(dict(enumerate(y_screening_reps)))
+    assert expanded == dict(enumerate(y_screening))
+
+    # a new featurization of the same dataset reuses the clusters
+    collapsed_again, clusters_again = collapse_data((docs, y_screening, y_predicate, None, X_features.copy()), params)
+    assert clusters_again is clusters
+    np.testing.assert_array_equal(collapsed_again[4], X_features_reps)
+    assert capsys.readouterr().out.count('near-duplicates') == 1
+    dedup._clusters_cache.clear()
@@ -0,0 +1,64 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from adaptive_machine_and_crowd.src.inference_service import InferenceService, LearnersModel, generate_load, \
+    make_http_server, http_classify
+
+
+def _assert_same_result(result, expected):
+    assert result['label'] == expected['label']
+    assert result['proba_in'] == pytest.approx(expected['proba_in'], abs=1e-9)
+    assert result['proba_in_predicates'] == pytest.approx(expected['proba_in_predicates'], abs=1e-9)
+
+
+def test_batched_results_match_unbatched_score(screening_learners):
+    vectorizer, SAL, docs = screening_learners
+    docs = docs[:50]
+    results, lock = [], threading.Lock()
+    service = InferenceService(LearnersModel(vectorizer, SAL), max_batch_size=8, max_wait=0.005)
+
+    def classify(doc):
+        result = service.classify(doc, timeout=10)
+        with lock:
+            results.append((doc, result))
+        return result
+
+    with service:
+        load = generate_load(classify, docs, clients_num=8, requests_num=200)
+        stats = service.stats()
+    assert load['requests'] == stats['requests'] == len(results) == 200
+    assert stats['mean_batch_size'] > 1  # concurrent requests were coalesced
+    for doc, result in results:
+        _assert_same_result(result, service.score([doc])[0])
+
+
+def test_stop_fails_pending_and_later_requests(screening_learners):
+    vectorizer, SAL, docs = screening_learners
+    service = InferenceService(LearnersModel(vectorizer, SAL)).start()
+    service.stop()
+    with pytest.raises(RuntimeError):
+        service.classify(docs[0], timeout=1)
+
+
+def test_http_front_end(screening_learners):
+    vectorizer, SAL, docs = screening_learners
+    with InferenceService(LearnersModel(vectorizer, SAL)) as service:
+        server = make_http_server(service, port=0)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+        try:
+            for result, expected in zip(http_classify(docs[:3], url), service.score(docs[:3])):
+                _assert_same_result(result, expected)
+            for body in [b'not json', json.dumps({'docs': 'a doc'}).encode(), json.dumps({'docs': ['a', 1]}).encode()]:
+                request = urllib.request.Request(url + '/classify', data=body)
+                with pytest.raises(urllib.error.HTTPError) as error:
+                    urllib.request.urlopen(request, timeout=10)
+                assert error.value.code == 400
+        finally:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,142 @@
+import numpy as np
+import pytest
+from scipy.special import binom
+
+from adaptive_machine_and_crowd.src import kernels
+from adaptive_machine_and_crowd.src.sm_run.shortest_multi_run import ShortestMultiRun
+
+PREDICATES = ['p0', 'p1', 'p2']
+
+
+def _random_votes(items_num, rng, perfect=()):
+    '''
+    :param perfect: predicates of perfect workers (acc = 1), their votes on an item all agree
+    '''
+    in_c = rng.randint(0, 5, (items_num, len(PREDICATES)))
+    out_c = rng.randint(0, 5, (items_num, len(PREDICATES)))
+    # a third of the item-predicates have no votes
+    no_votes = rng.random_sample(in_c.shape) < 1 / 3
+    in_c[no_votes], out_c[no_votes] = 0, 0
+    for j in perfect:
+        is_in = rng.random_sample(items_num) < 0.5
+        in_c[is_in, j], out_c[~is_in, j] = 0, 0
+    return in_c, out_c
+
+
+def _acc(rng, perfect=()):
+    acc = rng.uniform(0.55, 0.95, len(PREDICATES))
+    acc[list(perfect)] = 1.
+    return acc
+
+
+# per item SM-Run formulas of the scalar implementation the kernels replace
+def _prob_predicate_in(in_c, out_c, acc, prior_in, selectivity):
+    if in_c == 0 and out_c == 0:
+        return selectivity
+    term_in = binom(in_c + out_c, in_c) * acc ** in_c * (1 - acc) ** out_c * prior_in
+    term_out = binom(in_c + out_c, out_c) * acc ** out_c * (1 - acc) ** in_c * (1 - prior_in)
+    return term_in / (term_in + term_out)
+
+
+def _classify_item(smr, in_c, out_c, prior_in):
+    prob_item_in = 1.
+    for j in range(len(smr.predicates)):
+        prob_item_in *= _prob_predicate_in(in_c[j], out_c[j], smr._acc[j], prior_in[j], smr._selectivity[j])
+    if 1 - prob_item_in > smr.clf_threshold:
+        return 0
+    if prob_item_in > smr.clf_threshold:
+        return 1
+    return -1
+
+
+def _assign_item(smr, in_c, out_c, prior_in):
+    classify_score = []
+    for j in range(len(smr.predicates)):
+        prob_other_in = 1.
+        for j_other in range(len(smr.predicates)):
+            if j_other != j:
+                prob_other_in *= _prob_predicate_in(in_c[j_other], out_c[j_other], smr._acc[j_other],
+                                                    prior_in[j_other], smr._selectivity[j_other])
+        acc = smr._acc[j]
+        prior_pred_in = prior_in[j] if smr.use_prior else smr._selectivity[j]
+        prob_pred_out = 1 - prior_pred_in
+        joint_prob_votes_out = 1.
+        for n in range(1, 11):
+            joint_prob_votes_out *= acc * prob_pred_out + (1 - acc) * (1 - prob_pred_out)
+            term_in = binom(in_c[j] + out_c[j] + n, in_c[j]) * acc ** in_c[j] \
+                * (1 - acc) ** (out_c[j] + n) * prior_pred_in
+            term_out = binom(in_c[j] + out_c[j] + n, out_c[j] + n) * acc ** (out_c[j] + n) \
+                * (1 - acc) ** in_c[j] * (1 - prior_pred_in)
+            if 1 - prob_other_in * term_in / (term_in + term_out) >= smr.clf_threshold or n == 10:
+                classify_score.append(n / joint_prob_votes_out)
+                break
+    best = int(np.argmin(classify_score))
+    if classify_score[best] < smr.stop_score and in_c.sum() + out_c.sum() < smr.max_votes_per_item:
+        return best
+    return -1
+
+
+def _smr(acc, selectivity, prior_prob=None):
+    return ShortestMultiRun({
+        'estimated_predicate_accuracy': dict(zip(PREDICATES, acc)),
+        'estimated_predicate_selectivity': dict(zip(PREDICATES, selectivity)),
+        'predicates': PREDICATES,
+        'clf_threshold': 0.9,
+        'stop_score': 30,
+        'crowd_acc': {pr: (0.6, 0.9) for pr in PREDICATES},
+        'item_predicate_gt': {},
+        'prior_prob': prior_prob
+    })
+
+
+@pytest.mark.skipif(not kernels.NUMBA_AVAILABLE, reason='numba is not installed')
+@pytest.mark.parametrize('perfect', [(), (0,), (0, 2)])
+def test_numba_kernels_match_numpy(perfect):
+    rng = np.random.RandomState(len(perfect))
+    # votes of perfect workers are not made consistent here, 0/0 posteriors are nan in both backends
+    in_c, out_c = _random_votes(500, rng)
+    acc = _acc(rng, perfect)
+    prior_in = rng.uniform(0.01, 0.99, in_c.shape)
+    prior_in[:10] = 1.
+    selectivity = rng.uniform(0.1, 0.9, len(PREDICATES))
+    prob_other_in = rng.uniform(0., 1., in_c.shape)
+
+    np.testing.assert_allclose(kernels.posterior_in_numba(in_c, out_c, acc, prior_in, selectivity),
+                               kernels.posterior_in_numpy(in_c, out_c, acc, prior_in, selectivity), rtol=1e-12)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scores_numpy = kernels.look_ahead_scores_numpy(in_c, out_c, acc, prior_in, prob_other_in, 0.9)
+    np.testing.assert_allclose(kernels.look_ahead_scores_numba(in_c, out_c, acc, prior_in, prob_other_in, 0.9),
+                               scores_numpy, rtol=1e-12)
+    gt = rng.randint(0, 2, 500)
+    acc_draws, vote_draws = rng.random_sample((2, 500, 5))
+    np.testing.assert_array_equal(kernels.tally_votes_numba(gt, 0.6, 1., acc_draws, vote_draws),
+                                  kernels.tally_votes_numpy(gt, 0.6, 1., acc_draws, vote_draws))
+
+
+@pytest.mark.parametrize('use_prior', [False, True])
+@pytest.mark.parametrize('perfect', [(), (1,)])
+def test_sm_run_arrays_match_per_item_formulas(use_prior, perfect):
+    rng = np.random.RandomState(10 + len(perfect) + 2 * use_prior)
+    items_num = 300
+    in_c, out_c = _random_votes(items_num, rng, perfect)
+    in_c[:20], out_c[:20] = 4, 0  # items voted IN on every predicate
+    acc = _acc(rng, perfect)
+    selectivity = rng.uniform(0.1, 0.9, len(PREDICATES))
+    prior_prob = None
+    if use_prior:
+        prior_in = rng.uniform(0.01, 0.99, in_c.shape)
+        prior_prob = {item_id: {pr: {'in': prior_in[item_id, j], 'out': 1 - prior_in[item_id, j]}
+                                for j, pr in enumerate(PREDICATES)} for item_id in range(items_num)}
+    smr = _smr(acc, selectivity, prior_prob)
+    prior_in = smr._prior_in(range(items_num))
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        expected_labels = [_classify_item(smr, in_c[i], out_c[i], prior_in[i]) for i in range(items_num)]
+        expected_predicates = [_assign_item(smr, in_c[i], out_c[i], prior_in[i]) for i in range(items_num)]
+        labels = smr.classify_arrays(in_c, out_c, prior_in)
+        predicate_idx = smr.assign_arrays(in_c, out_c, prior_in)
+
+    np.testing.assert_array_equal(labels, expected_labels)
+    np.testing.assert_array_equal(predicate_idx, expected_predicates)
+    # items are left unclassified and classified, assigned and not
+    assert {-1, 0} <= set(labels) and -1 in predicate_idx and (predicate_idx != -1).any()
@@ -0,0 +1,50 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from sklearn.linear_model import SGDClassifier
+from sklearn.calibration import CalibratedClassifierCV
+
+from adaptive_machine_and_crowd.src.scoring import FusedLinearScorer, fused_scorer
+from adaptive_machine_and_crowd.src.active_learning import _predict_proba_in
+
+
+def _fitted(rng, X, cv, method='sigmoid'):
+    y = (X[:, :3].sum(axis=1) + rng.normal(0, 0.5, X.shape[0]) > 1.5).astype(int)
+    clf = CalibratedClassifierCV(SGDClassifier(class_weight='balanced', max_iter=1000, tol=1e-3,
+                                               random_state=cv), cv=cv, method=method)
+    return clf.fit(X, y)
+
+
+@pytest.mark.parametrize('cv', [2, 3, 5])
+def test_fused_matches_calibrated_classifier(cv):
+    rng = np.random.RandomState(cv)
+    X = rng.random_sample((300, 20))
+    # predicates with different numbers of folds
+    estimators = {'p0': _fitted(rng, X, cv), 'p1': _fitted(rng, X, 2), 'p2': _fitted(rng, X, 5)}
+    X_test = rng.random_sample((100, 20)) * 2 - 0.5
+    expected = {pr: clf.predict_proba(X_test)[:, 1] for pr, clf in estimators.items()}
+
+    scorer = FusedLinearScorer.from_estimators(estimators, chunk_size=32)
+    for pr, proba in scorer.predict_proba_predicates(X_test).items():
+        np.testing.assert_allclose(proba, expected[pr], rtol=0, atol=1e-12)
+    subset = scorer.predict_proba_predicates(X_test, ['p2', 'p0'])
+    np.testing.assert_allclose(subset['p2'], expected['p2'], rtol=0, atol=1e-12)
+    np.testing.assert_allclose(scorer.predict_proba_in(X_test), expected['p0'] * expected['p1'] * expected['p2'],
+                               rtol=0, atol=1e-12)
+
+
+def test_active_learner_scores_fused_or_per_learner(screening_learners):
+    _, SAL, _ = screening_learners
+    X = np.vstack([l.X_pool for l in SAL.learners.values()])
+    # fused and per-learner scoring of the learners of the active learning box
+    fused = SAL.predict_proba_predicates(X)
+    for pr, l in SAL.learners.items():
+        np.testing.assert_allclose(fused[pr], _predict_proba_in(l, X), rtol=0, atol=1e-12)
+
+    isotonic = _fitted(np.random.RandomState(0), np.random.RandomState(1).random_sample((100, 5)), 3, 'isotonic')
+    with pytest.raises(ValueError):
+        FusedLinearScorer.from_estimators({'p0': isotonic})
+
+    # ScreeningActiveLearner falls back to per-learner scoring
+    assert fused_scorer({'p0': SimpleNamespace(learner=SimpleNamespace(estimator=isotonic))}) is None
@@ -0,0 +1,70 @@
+import copy
+
+import numpy as np
+
+from adaptive_machine_and_crowd.src.sm_run.shortest_multi_run import ShortestMultiRun
+from adaptive_machine_and_crowd.src.sm_run.sharded import ShardedShortestMultiRun
+
+PREDICATES = ['p0', 'p1']
+ITEMS_NUM = 200
+
+
+def _smr_params(rng, vote_seed, use_prior):
+    gt = {pr: rng.randint(0, 2, ITEMS_NUM) for pr in PREDICATES}
+    prior_prob = None
+    if use_prior:
+        prior_in = rng.uniform(0.05, 0.95, (ITEMS_NUM, len(PREDICATES)))
+        prior_prob = {item_id: {pr: {'in': prior_in[item_id, j], 'out': 1 - prior_in[item_id, j]}
+                                for j, pr in enumerate(PREDICATES)} for item_id in range(ITEMS_NUM)}
+    return {
+        'estimated_predicate_accuracy': {pr: 0.75 for pr in PREDICATES},
+        'estimated_predicate_selectivity': {pr: gt[pr].mean() for pr in PREDICATES},
+        'predicates': PREDICATES,
+        'item_predicate_gt': gt,
+        'clf_threshold': 0.9,
+        'stop_score': 30,
+        'crowd_acc': {pr: (0.6, 0.9) for pr in PREDICATES},
+        'prior_prob': prior_prob,
+        'crowd': None,
+        'vote_seed': vote_seed
+    }
+
+
+def _crowd_votes_counts(rng):
+    # a few items start with votes, as after the AL-Box
+    crowd_votes_counts = {item_id: {pr: {'in': 0, 'out': 0} for pr in PREDICATES} for item_id in range(ITEMS_NUM)}
+    for item_id in rng.choice(ITEMS_NUM, 30, replace=False):
+        for pr in PREDICATES:
+            crowd_votes_counts[item_id][pr]['in'], crowd_votes_counts[item_id][pr]['out'] = rng.randint(0, 3, 2)
+    return crowd_votes_counts
+
+
+def _run_crowd_box(SMR, crowd_votes_counts, budget):
+    # Crowd-Box loop of run_crowd_box
+    item_labels = {}
+    spent = 0
+    unclassified_item_ids = SMR.classify_items(np.arange(ITEMS_NUM), crowd_votes_counts, item_labels)
+    while spent < budget and len(unclassified_item_ids):
+        unclassified_item_ids = unclassified_item_ids[:budget - spent]
+        unclassified_item_ids, budget_round = SMR.do_round(crowd_votes_counts, unclassified_item_ids, item_labels)
+        spent += budget_round
+    return item_labels, spent
+
+
+def test_sharded_matches_single_process():
+    rng = np.random.RandomState(0)
+    # two Crowd-Box runs of different params on one executor, its pool and shared memory are reused
+    runs = [(_smr_params(rng, 17, False), _crowd_votes_counts(rng), 400),
+            (_smr_params(rng, 23, True), _crowd_votes_counts(rng), 250)]
+    with ShardedShortestMultiRun(workers_num=2, shards_num=3) as sharded:
+        for smr_params, crowd_votes_counts, budget in runs:
+            expected_votes = copy.deepcopy(crowd_votes_counts)
+            expected_labels, expected_spent = _run_crowd_box(ShortestMultiRun(smr_params), expected_votes, budget)
+
+            sharded.start(smr_params, crowd_votes_counts)
+            labels, spent = _run_crowd_box(sharded, crowd_votes_counts, budget)
+            sharded.finish()
+
+            assert spent == expected_spent and spent > 0
+            assert labels == expected_labels
+            assert crowd_votes_counts == expected_votes
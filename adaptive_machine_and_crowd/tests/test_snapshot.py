@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from adaptive_machine_and_crowd.src.snapshot import save_snapshot, load_snapshot
+from adaptive_machine_and_crowd.src.utils import Vectorizer
+
+
+@pytest.mark.parametrize('config', [{}, {'sublinear_tf': True}, {'binary': True, 'norm': 'l1'},
+                                    {'lowercase': True, 'ngram_range': (1, 3), 'use_idf': False}])
+def test_transform_round_trip(screening_learners, tmp_path, config):
+    _, SAL, docs = screening_learners
+    vectorizer = Vectorizer()
+    vectorizer.vectorizer = TfidfVectorizer(**dict({'lowercase': False, 'max_features': 2000, 'ngram_range': (1, 2)},
+                                                   **config))
+    # upper case and unseen words, documents without known terms
+    docs = docs[:100] + ['ALPHA alpha beta beta beta W1 unseen', 'unseen words only', '']
+    vectorizer.fit(docs[:100])
+    save_snapshot(str(tmp_path), vectorizer, SAL)
+
+    np.testing.assert_allclose(load_snapshot(str(tmp_path)).transform(docs), vectorizer.transform(docs),
+                               rtol=0, atol=1e-12)
+
+
+def test_learners_round_trip(screening_learners, tmp_path):
+    vectorizer, SAL, docs = screening_learners
+    save_snapshot(str(tmp_path), vectorizer, SAL, meta={'dataset': 'synthetic'})
+    model = load_snapshot(str(tmp_path))
+    assert model.predicates == SAL.predicates and model.manifest['meta'] == {'dataset': 'synthetic'}
+    assert model.screening_out_threshold == SAL.screening_out_threshold
+
+    X = model.transform(docs)
+    np.testing.assert_allclose(X, vectorizer.transform(docs), rtol=0, atol=1e-12)
+    expected = {pr: l.learner.estimator.predict_proba(X)[:, 1] for pr, l in SAL.learners.items()}
+    for pr, proba in model.predict_proba_predicates(X).items():
+        np.testing.assert_allclose(proba, expected[pr], rtol=0, atol=1e-12)
+    np.testing.assert_allclose(model.predict_proba(X), SAL.predict_proba(X), rtol=0, atol=1e-12)
+    np.testing.assert_array_equal(model.predict(X), SAL.predict(X))
@@ -0,0 +1,80 @@
+import os
+from collections import Counter
+
+import numpy as np
+import scipy.sparse as sp
+import pytest
+
+from adaptive_machine_and_crowd.src import streaming
+from adaptive_machine_and_crowd.src.streaming import StreamingScreener, run_streaming
+from adaptive_machine_and_crowd.src.training_buffer import TrainingBuffer
+from adaptive_machine_and_crowd.src.utils import random_sampling
+from adaptive_machine_and_crowd.src.datasets import get_dataset_config
+
+path_to_project = os.path.realpath(__file__)[:-len('adaptive_machine_and_crowd/tests/test_streaming.py')]
+
+
+class _CheckedScreener(StreamingScreener):
+    # records the decisions popped and the largest queue after a micro-batch
+    instances = []
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.popped = Counter()
+        self.max_queue_size = 0
+        self.max_training_size = 0
+        _CheckedScreener.instances.append(self)
+
+    def process_batch(self, docs, gt_predicate=None):
+        item_ids = super().process_batch(docs, gt_predicate)
+        self.max_queue_size = max(self.max_queue_size, len(self.queue))
+        return item_ids
+
+    def _retrain(self):
+        super()._retrain()
+        self.max_training_size = max([self.max_training_size] + [len(l.training) for l in self.SAL.learners.values()])
+
+    def pop_decisions(self):
+        for decision in super().pop_decisions():
+            self.popped[decision[0]] += 1
+            yield decision
+
+
+def test_every_item_decided_once_within_window(monkeypatch):
+    monkeypatch.setattr(streaming, 'StreamingScreener', _CheckedScreener)
+    params = dict(get_dataset_config('crisis'), path_to_project=path_to_project, n_instances_query=100,
+                  size_init_train_data=20, screening_out_threshold=0.99, stop_score=50, lr=5, beta=1,
+                  crowd_votes_per_item_al=3, sampling_strategy=random_sampling, budget_per_item=2,
+                  window_size=60, retrain_batch_size=30, training_window=100)
+    np.random.seed(0)
+    bootstrap_size = 400
+    report = run_streaming(params, bootstrap_size=bootstrap_size, batch_size=50)
+
+    screener = _CheckedScreener.instances[-1]
+    stream_size = report['items_arrived']
+    assert stream_size > 1000 and report['items_classified'] == stream_size
+    assert sorted(screener.popped) == list(range(stream_size)) and set(screener.popped.values()) == {1}
+    assert report['items_in_flight'] == 0 and not screener.features and not screener.arrival_time
+    assert 0 < screener.max_queue_size <= params['window_size']
+    assert report['retrain_num'] > 0 and screener.max_training_size <= params['training_window']
+
+
+@pytest.mark.parametrize('sparse', [False, True])
+def test_training_buffer_keep_last(sparse):
+    X = np.arange(20, dtype=float).reshape(10, 2)
+    y = np.arange(10)
+    buffer = TrainingBuffer(sp.csr_matrix(X[:6]) if sparse else X[:6], y[:6])
+    np.random.seed(0)
+    buffer.shuffle()
+    buffer.append(sp.csr_matrix(X[6:]) if sparse else X[6:], y[6:])
+    order = buffer.order.copy()
+    buffer.keep_last(4)
+
+    X_kept, y_kept = buffer.ordered(copy=True)
+    kept = order[order >= 6]
+    np.testing.assert_array_equal(X_kept.toarray() if sparse else X_kept, X[kept])
+    np.testing.assert_array_equal(y_kept, y[kept])
+    # appends go on after the kept rows
+    buffer.append(sp.csr_matrix(X[:1]) if sparse else X[:1], y[:1])
+    X_all, y_all = buffer.ordered(copy=True)
+    np.testing.assert_array_equal(y_all, np.append(y[kept], 0))
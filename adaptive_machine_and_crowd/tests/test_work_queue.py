@@ -0,0 +1,73 @@
+import time
+import threading
+import multiprocessing
+
+from adaptive_machine_and_crowd.src.work_queue import WorkQueue, run_worker
+
+SPEC = {'dataset': 'crisis', 'sampling_strategy': 'random_sampling'}
+
+
+def _echo_task(task):
+    spec, cells, experiment_id = task
+    time.sleep(0.05)
+    return [{'experiment_id': experiment_id, 'budget_per_item': cells[0][0]}]
+
+
+def _slow_task(task):
+    time.sleep(60)
+    return []
+
+
+def _run_worker(args):
+    path, lease_seconds = args
+    completed = run_worker(path, lease_seconds, poll_seconds=0.1, run_task=_echo_task)
+    # threads left besides the main thread of the pool worker
+    return completed, threading.active_count() - 1
+
+
+def _enqueue(path, tasks_num):
+    work_queue = WorkQueue(path)
+    work_queue.enqueue('test', [(SPEC, [[1, 0.5]], i) for i in range(tasks_num)])
+    work_queue.close()
+
+
+def test_workers_claim_every_task_once(tmp_path):
+    path = str(tmp_path / 'queue.db')
+    _enqueue(path, 30)
+    with multiprocessing.get_context('fork').Pool(3) as pool:
+        outcomes = pool.map(_run_worker, [(path, 0.3)] * 3)
+
+    assert sum(completed for completed, _ in outcomes) == 30
+    # heartbeats of finished tasks are joined
+    assert all(heartbeats == 0 for _, heartbeats in outcomes)
+    work_queue = WorkQueue(path)
+    assert work_queue.status() == {'pending': 0, 'leased': 0, 'done': 30, 'failed': 0}
+    assert sorted(row['experiment_id'] for row in work_queue.results('test')) == list(range(30))
+    work_queue.close()
+
+
+def test_task_of_killed_worker_is_requeued(tmp_path):
+    path = str(tmp_path / 'queue.db')
+    _enqueue(path, 2)
+    context = multiprocessing.get_context('fork')
+    stalled = context.Process(target=run_worker, args=(path, 0.5),
+                              kwargs={'poll_seconds': 0.1, 'max_tasks': 1, 'run_task': _slow_task})
+    stalled.start()
+    work_queue = WorkQueue(path)
+    deadline = time.time() + 30
+    while work_queue.status()['leased'] == 0 and time.time() < deadline:
+        time.sleep(0.05)
+    # the lease is renewed while the worker is alive
+    time.sleep(1.)
+    assert work_queue.status()['leased'] == 1
+    stalled.kill()
+    stalled.join()
+
+    with context.Pool(2) as pool:
+        outcomes = pool.map(_run_worker, [(path, 0.5)] * 2)
+
+    assert sum(completed for completed, _ in outcomes) == 2
+    assert work_queue.status() == {'pending': 0, 'leased': 0, 'done': 2, 'failed': 0}
+    attempts = dict(work_queue.conn.execute('SELECT task_id, attempts FROM tasks').fetchall())
+    assert sorted(attempts.values()) == [1, 2]
+    work_queue.close()
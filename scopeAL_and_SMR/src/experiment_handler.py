@@ -51,6 +51,9 @@ def run_experiment(params):
                     'vectorizer': vectorizer
                 })
 
+                # predicates by ascending selectivity, estimated as for SM-Run
+                predicates_al_order = sorted(predicates, key=lambda pr: y_predicate[pr].mean())
+
                 # if Available Budget for Active Learniong is available then Do Run Active Learning Box
                 if switch_point != 0:
                     SAL = configure_al_box(params, item_ids_helper, crowd_votes_counts, item_labels)
@@ -70,13 +73,20 @@ def run_experiment(params):
                             gt_items_queried[pr] = y_predicate[pr][query_idx]
                             y_predicate[pr] = np.delete(y_predicate[pr], query_idx)
 
-                        y_crowdsourced = CrowdSimulator.crowdsource_items_scope_mode(item_ids_helper[predicates[0]][query_idx], gt_items_queried, predicates,
-                                                                          crowd_acc, crowd_votes_per_pred_al, crowd_votes_counts)
+                        if params.get('short_circuit_al', False):
+                            # ask the most likely OUT predicates first, stop once an item is OUT
+                            y_crowdsourced, votes_cast = CrowdSimulator.crowdsource_items_scope_mode_ordered(
+                                item_ids_helper[predicates[0]][query_idx], gt_items_queried, predicates_al_order,
+                                crowd_acc, crowd_votes_per_pred_al, crowd_votes_counts)
+                        else:
+                            y_crowdsourced = CrowdSimulator.crowdsource_items_scope_mode(item_ids_helper[predicates[0]][query_idx], gt_items_queried, predicates,
+                                                                              crowd_acc, crowd_votes_per_pred_al, crowd_votes_counts)
+                            votes_cast = SAL.n_instances_query*crowd_votes_per_pred_al*len(predicates)
                         SAL.teach(query_idx, y_crowdsourced)
                         for pr in predicates:
                             item_ids_helper[pr] = np.delete(item_ids_helper[pr], query_idx)
 
-                        policy.update_budget_al(SAL.n_instances_query*crowd_votes_per_pred_al*len(predicates))
+                        policy.update_budget_al(votes_cast)
 
                     unclassified_item_ids = np.arange(items_num)
                     # Get prior from machines
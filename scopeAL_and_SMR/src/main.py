@@ -25,7 +25,9 @@ import numpy as np
     'dataset_file_name ': file name of dataset,
     'predicates': predicates will be used in experiment,
     'B': budget available for classification,
-    'B_al_prop': proportion of B for training machines (AL-Box)
+    'B_al_prop': proportion of B for training machines (AL-Box),
+    'short_circuit_al': ask predicates of a queried item in ascending selectivity and stop once it is OUT,
+                        only votes actually cast are charged to the AL budget
 '''
 
 
@@ -88,6 +90,7 @@ if __name__ == '__main__':
     # budget_per_item = np.arange(1, 9, 1)  # number of votes per item we can spend per item on average
     budget_per_item = [3, 5, 7, 9]  # number of votes per item we can spend per item on average
     crowd_votes_per_pred_al = 3  # for Active Learning annotation
+    short_circuit_al = False
 
     for sampling_strategy in [random_sampling, uncertainty_sampling]:
         print('{} is Running!'.format(sampling_strategy.__name__))
@@ -103,6 +106,7 @@ if __name__ == '__main__':
             'sampling_strategy': sampling_strategy,
             'crowd_acc': crowd_acc,
             'crowd_votes_per_pred_al': crowd_votes_per_pred_al,
+            'short_circuit_al': short_circuit_al,
             'policy_switch_point': policy_switch_point,
             'budget_per_item': budget_per_item,
             'stop_score': stop_score,
@@ -78,6 +78,38 @@ class CrowdSimulator:
             crodsourced_items.append(item_label)
         return crodsourced_items
 
+    @staticmethod
+    def crowdsource_items_scope_mode_ordered(item_ids, gt_items, predicates, crowd_acc, n, crowd_votes_counts):
+        '''
+        Short-circuit version of crowdsource_items_scope_mode: predicates are asked in the order given
+        (ascending estimated selectivity, i.e. the most likely OUT first) and no more predicates are asked
+        once the item is OUT on one of them, the item label is the same conjunction of predicate labels
+        :param predicates: ordered names of predicates
+        :return: aggregated crwodsourced label on items, number of votes cast
+        '''
+        crodsourced_items = []
+        votes_cast = 0
+        for item_ind, item_id in enumerate(item_ids):
+            item_label = 1
+            for pr in predicates:
+                gt = gt_items[pr][item_ind]
+                in_votes, out_votes = 0, 0
+                for _ in range(n):
+                    worker_acc = random.uniform(crowd_acc[pr][0], crowd_acc[pr][1])
+                    worker_vote = np.random.binomial(1, worker_acc if gt == 1 else 1 - worker_acc)
+                    if worker_vote == 1:
+                        in_votes += 1
+                    else:
+                        out_votes += 1
+                crowd_votes_counts[item_id][pr]['in'] += in_votes
+                crowd_votes_counts[item_id][pr]['out'] += out_votes
+                votes_cast += n
+                if in_votes < out_votes:
+                    item_label = 0
+                    break
+            crodsourced_items.append(item_label)
+        return crodsourced_items, votes_cast
+
 
 # screening metrics, aimed to obtain high recall
 class MetricsMixin: